@@ -0,0 +1,112 @@
+"""Benchmark of the logging overhead on the hot path.
+
+Compares the time spent on the logging thread per record with the console and the rotating file handlers attached to
+the logger directly, as mdl used to do, against the queue-based pipeline of `mdl.utils.build_logger`, along with the
+time until the listener has drained the queue. Also times the logging of the output of a chatty child process through
+`mdl.utils.logging_with_pipe`. The console output goes to the null device.
+
+Usage:
+    python benchmarks/bench_logging.py [--records N] [--lines N] [--runs N]
+"""
+import os
+import sys
+import logging
+import statistics
+import subprocess
+import tempfile
+import time
+from argparse import ArgumentParser
+from logging.handlers import RotatingFileHandler
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mdl.utils import build_logger, logging_with_pipe, _LISTENERS  # noqa: E402
+
+LINE = "[#2089b0 400.0KiB/33.2MiB(1%) CN:1 DL:115.7KiB] seg_0001.ts: 'frame=  250 fps=0.0 q=-1.0 size=1024kB'"
+
+
+def direct_logger(name, log_file, devnull):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+    ch = logging.StreamHandler(devnull)
+    ch.setFormatter(logging.Formatter('%(message)s'))
+    fh = RotatingFileHandler(log_file, mode='a', maxBytes=1024*1024*2, backupCount=1, delay=True)
+    fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \n%(message)s'))
+    logger.addHandler(ch)
+    logger.addHandler(fh)
+
+    return logger
+
+
+def queued_logger(name, log_file, devnull):
+    logger = build_logger(name, log_file)
+    logger.propagate = False
+    for handler in _LISTENERS[name].handlers:
+        if not isinstance(handler, logging.FileHandler):
+            handler.setStream(devnull)
+
+    return logger
+
+
+def time_records(logger, records):
+    start = time.perf_counter()
+    for i in range(records):
+        logger.info('%s %d', LINE, i)
+
+    return time.perf_counter() - start
+
+
+def time_pipe(logger, lines):
+    script = 'import sys\nfor i in range({}):\n    sys.stdout.write({!r} + " %d\\n" % i)\n'.format(lines, LINE)
+    start = time.perf_counter()
+    with logging_with_pipe(logger, level=logging.INFO) as log_pipe:
+        subprocess.run([sys.executable, '-c', script], stdout=log_pipe, stderr=subprocess.STDOUT, check=True)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--lines', type=int, default=200000)
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mdl_bench_logging_')
+    with open(os.devnull, 'w') as devnull:
+        direct = direct_logger('bench.direct', os.path.join(work_dir, 'direct.log'), devnull)
+        queued = queued_logger('bench.queued', os.path.join(work_dir, 'queued.log'), devnull)
+        listener = _LISTENERS['bench.queued']
+
+        secs = statistics.median(time_records(direct, args.records) for _ in range(args.runs))
+        print('direct handlers: {:8.2f} us/record on the logging thread'.format(secs / args.records * 1e6))
+
+        samples, drained = [], []
+        for _ in range(args.runs):
+            samples.append(time_records(queued, args.records))
+            start = time.perf_counter()
+            listener.stop()  # wait for the queue to be drained
+            drained.append(time.perf_counter() - start)
+            listener.start()
+        print('queued:          {:8.2f} us/record on the logging thread, {:.3f} s to drain'.format(
+            statistics.median(samples) / args.records * 1e6, statistics.median(drained)))
+
+        secs = statistics.median(time_pipe(queued, args.lines) for _ in range(args.runs))
+        print('child output:    {:8.2f} s for {} lines through the pipe ({:.0f} lines/s)'.format(
+            secs, args.lines, args.lines / secs))
+
+        listener.stop()
+        for handler in direct.handlers + list(listener.handlers):
+            handler.close()
+
+    for fn in os.listdir(work_dir):
+        os.remove(os.path.join(work_dir, fn))
+    os.rmdir(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""Benchmark of joining the parts of an MP4 video in-process (`mdl.mp4.concat_mp4`) against mkvmerge.
+
+The stand-in fixtures are generated locally: with `--ffmpeg`, a test pattern video encoded by ffmpeg and split into
+parts; otherwise synthetic MP4 files of a video and an audio track carrying random payloads, which are well-formed
+but not decodable, so that only the in-process joiner is timed on them.
+
+Usage:
+    python benchmarks/bench_mp4concat.py [--parts N] [--part-mb MB] [--runs N] [--ffmpeg FFMPEG] [--mkvmerge MKVMERGE]
+"""
+import os
+import sys
+import shutil
+import struct
+import statistics
+import subprocess
+import tempfile
+import time
+from argparse import ArgumentParser
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mdl.mp4 import concat_mp4  # noqa: E402
+
+
+def box(type, payload):
+    return struct.pack('>I4s', len(payload) + 8, type) + payload
+
+
+def full_box(type, payload, version=0):
+    return box(type, struct.pack('>B3x', version) + payload)
+
+
+def make_synthetic_part(path, part_bytes, fps=25, sample_rate=48000):
+    """Write an MP4 file with a video track of 1-second chunks of `fps` samples, interleaved with an audio track"""
+    video_sample, audio_sample = max(part_bytes // (fps * 12), 16), 512
+    seconds = max(part_bytes // ((video_sample * fps) + audio_sample * 47), 1)
+    audio_per_chunk = sample_rate // 1024
+
+    ftyp = box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2avc1mp41')
+    mdat_payload_size = seconds * (fps * video_sample + audio_per_chunk * audio_sample)
+
+    def trak(track_id, handler, timescale, delta, samples_per_chunk, sample_size, offsets, stsd_entry, sync):
+        count = samples_per_chunk * len(offsets)
+        stbl = (full_box(b'stsd', struct.pack('>I', 1) + box(stsd_entry, b'\0' * 70)) +
+                full_box(b'stts', struct.pack('>III', 1, count, delta)) +
+                (full_box(b'stss', struct.pack('>I%dI' % len(sync), len(sync), *sync)) if sync else b'') +
+                full_box(b'stsz', struct.pack('>II', sample_size, count)) +
+                full_box(b'stsc', struct.pack('>IIII', 1, 1, samples_per_chunk, 1)) +
+                full_box(b'stco', struct.pack('>I%dI' % len(offsets), len(offsets), *offsets)))
+        minf = box(b'minf', box(b'stbl', stbl))
+        mdia = box(b'mdia', full_box(b'mdhd', struct.pack('>IIIIHH', 0, 0, timescale, count * delta, 0, 0)) +
+                   full_box(b'hdlr', struct.pack('>I4s12x', 0, handler) + b'\0') + minf)
+        tkhd = full_box(b'tkhd', struct.pack('>IIIII', 0, 0, track_id, 0, seconds * 1000) + b'\0' * 60)
+        return box(b'trak', tkhd + mdia)
+
+    def moov(data_start):
+        video_offsets, audio_offsets = [], []
+        pos = data_start
+        for _ in range(seconds):
+            video_offsets.append(pos)
+            pos += fps * video_sample
+            audio_offsets.append(pos)
+            pos += audio_per_chunk * audio_sample
+        mvhd = full_box(b'mvhd', struct.pack('>IIII', 0, 0, 1000, seconds * 1000) + b'\0' * 80)
+        return box(b'moov', mvhd +
+                   trak(1, b'vide', fps * 512, 512, fps, video_sample, video_offsets, b'avc1',
+                        list(range(1, seconds * fps + 1, fps))) +
+                   trak(2, b'soun', sample_rate, 1024, audio_per_chunk, audio_sample, audio_offsets, b'mp4a', None))
+
+    # mdat first, then moov, as written by most encoders without faststart
+    data_start = len(ftyp) + 8
+    with open(path, 'wb') as fd:
+        fd.write(ftyp)
+        fd.write(struct.pack('>I4s', mdat_payload_size + 8, b'mdat'))
+        remaining = mdat_payload_size
+        while remaining:
+            chunk = min(remaining, 1024 * 1024)
+            fd.write(os.urandom(chunk))
+            remaining -= chunk
+        fd.write(moov(data_start))
+
+
+def make_ffmpeg_parts(ffmpeg, work_dir, num_parts, part_seconds=60):
+    pattern = os.path.join(work_dir, 'part_%03d.mp4')
+    subprocess.run([ffmpeg, '-y', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25',
+                    '-f', 'lavfi', '-i', 'sine=frequency=1000:sample_rate=48000', '-t', str(num_parts * part_seconds),
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '50', '-c:a', 'aac', '-f', 'segment',
+                    '-segment_time', str(part_seconds), '-reset_timestamps', '1', pattern], check=True)
+
+    return sorted(os.path.join(work_dir, fn) for fn in os.listdir(work_dir) if fn.startswith('part_'))
+
+
+def timed(func, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+
+    return statistics.median(samples)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--parts', type=int, default=8)
+    parser.add_argument('--part-mb', type=int, default=64, help='size of each synthetic part in MiB')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--ffmpeg', default='', help='generate real fixtures with this ffmpeg executable')
+    parser.add_argument('--mkvmerge', default=shutil.which('mkvmerge') or '', help='path to the mkvmerge executable')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='mdl_bench_mp4_')
+    try:
+        if args.ffmpeg:
+            parts = make_ffmpeg_parts(args.ffmpeg, work_dir, args.parts)
+        else:
+            parts = [os.path.join(work_dir, 'part_{:03}.mp4'.format(i)) for i in range(args.parts)]
+            for part in parts:
+                make_synthetic_part(part, args.part_mb * 1024 * 1024)
+
+        total_mb = sum(os.path.getsize(part) for part in parts) / (1024 * 1024)
+        print('{} parts, {:.1f} MiB in total ({} fixtures)'.format(len(parts), total_mb,
+                                                                  'ffmpeg' if args.ffmpeg else 'synthetic'))
+
+        out_mp4 = os.path.join(work_dir, 'joined.mp4')
+        secs = timed(lambda: concat_mp4(parts, out_mp4), args.runs)
+        print('concat_mp4: {:8.3f} s  {:8.1f} MiB/s'.format(secs, total_mb / secs))
+
+        if args.mkvmerge and args.ffmpeg:
+            out_mkv = os.path.join(work_dir, 'joined.mkv')
+            cmd = [args.mkvmerge, '-q', '-o', out_mkv, '['] + parts + [']']
+            secs = timed(lambda: subprocess.run(cmd, check=True), args.runs)
+            print('mkvmerge:   {:8.3f} s  {:8.1f} MiB/s'.format(secs, total_mb / secs))
+        elif args.mkvmerge:
+            print('mkvmerge:   skipped, as the synthetic fixtures are not decodable (use "--ffmpeg")')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Startup benchmark of mdl.
+
+Measures the import time of the `mdl` package with `python -X importtime`, along with the wall-clock time of
+`python -m mdl --help`, and checks them against the time budgets.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs N] [--import-budget-ms MS] [--help-budget-ms MS]
+"""
+import os
+import sys
+import subprocess
+import statistics
+import time
+from argparse import ArgumentParser
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_time_us():
+    """Cumulative import time of `mdl` in microseconds, and the top self-time modules"""
+    cp = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import mdl'], cwd=ROOT_DIR,
+                        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    total, modules = None, []
+    for line in cp.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((int(self_us), name.rstrip()))
+        if name.strip() == 'mdl':
+            total = int(cumulative_us)
+
+    return total, sorted(modules, reverse=True)[:10]
+
+
+def help_time_ms():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-m', 'mdl', '--help'], cwd=ROOT_DIR, stdout=subprocess.DEVNULL, check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget-ms', type=float, default=60)
+    parser.add_argument('--help-budget-ms', type=float, default=200)
+    args = parser.parse_args()
+
+    import_ms = statistics.median(import_time_us()[0] for _ in range(args.runs)) / 1000
+    help_ms = statistics.median(help_time_ms() for _ in range(args.runs))
+
+    _, top_modules = import_time_us()
+    print('Top modules by self import time:')
+    for self_us, name in top_modules:
+        print('  {:8.2f} ms  {}'.format(self_us / 1000, name))
+
+    print('import mdl:     {:8.2f} ms (budget {} ms)'.format(import_ms, args.import_budget_ms))
+    print('mdl --help:     {:8.2f} ms (budget {} ms)'.format(help_ms, args.help_budget_ms))
+
+    if import_ms > args.import_budget_ms or help_ms > args.help_budget_ms:
+        print('Startup time budget exceeded!')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,17 +2,15 @@
 import sys
 import os
 import logging
-import errno
-from shutil import which
-from itertools import zip_longest
+from itertools import zip_longest, chain
 
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 from configparser import ConfigParser
 
-from .third_parties import exists_3rd_parties, third_party_progs_default
-from .downloader import MDownloader
 from .utils import build_logger, change_logging_level
 
+# NOTE: the submodules such as `downloader` and `third_parties` are imported lazily, so as to keep the startup fast
+
 
 MOD_DIR = os.path.dirname(os.path.abspath(__file__))
 LOGGER = build_logger('MDL', os.path.normpath(os.path.join(MOD_DIR, 'log/mdl.log')))
@@ -47,17 +45,81 @@ def _segment_playlist_items(items):
     return res
 
 
+def _parse_timestamp(ts):
+    """Parse a point in time of the form [[HH:]MM:]SS[.m...] into seconds.
+
+    >>> _parse_timestamp("1:02:03.5"), _parse_timestamp("05:00"), _parse_timestamp("90")
+    (3723.5, 300.0, 90.0)
+    """
+    fields = ts.strip().split(':')
+    if len(fields) > 3:
+        raise ArgumentTypeError('invalid timestamp: {!r}'.format(ts))
+
+    secs = 0.0
+    for idx, field in enumerate(fields):
+        # only the seconds may be fractional, and the minutes and seconds following the hours or minutes below 60
+        is_secs = idx == len(fields) - 1
+        if not (field.replace('.', '', 1) if is_secs else field).isdecimal() or (idx > 0 and float(field) >= 60):
+            raise ArgumentTypeError('invalid timestamp: {!r}'.format(ts))
+        secs = secs * 60 + float(field)
+
+    return secs
+
+
 def arg_parser():
     parser = ArgumentParser()
 
-    parser.add_argument('url', nargs='+', help='Episode or cover/playlist web page URL(s)')
+    parser.add_argument('url', nargs='*', help='Episode or cover/playlist web page URL(s)')
+    parser.add_argument('-a', '--batch-file', dest='batch_file', default='',
+                        help='file containing the URLs to download, one URL per line. use "-" for stdin')
+    parser.add_argument('--metadata-only', dest='metadata_only', action='store_true',
+                        help='write the cover metadata of the URLs to stdout as JSON Lines, without downloading any video')
+    parser.add_argument('--probe-definitions', dest='probe_definitions', action='store_true',
+                        help='along with "--metadata-only", probe for the available definitions of the episodes as well')
     parser.add_argument('-D', '--dir', default='', dest='dir', help='path to downloaded videos')
     parser.add_argument('-d', '--definition', default='', dest='definition', choices=['fhd', 'shd', 'hd', 'sd'])
     parser.add_argument('-p', '--proxy', dest='proxy', help='proxy in the form of "http://[user:password@]host:port"')
+    parser.add_argument('--plan-out', dest='plan_out', default='',
+                        help='resolve the URLs and write the download plans to the manifest file, without downloading')
+    parser.add_argument('--from-manifest', dest='from_manifest', default='',
+                        help='download and join the videos planned in the manifest file written with "--plan-out"')
+    parser.add_argument('--shard-dir', dest='shard_dir', default='',
+                        help='directory shared by the coordinator and the workers of the sharded downloading')
+    shard_role = parser.add_mutually_exclusive_group()
+    shard_role.add_argument('--coordinator', dest='coordinator', action='store_true',
+                            help='split the episodes of the URLs into shards in "--shard-dir" and wait for the workers')
+    shard_role.add_argument('--worker', dest='worker', action='store_true',
+                            help='claim, download and join the shards in "--shard-dir" until there are none left')
+    parser.add_argument('--shard-size', dest='shard_size', default=1, type=int,
+                        help='maximum number of episodes per shard, default to 1')
+    parser.add_argument('--steal-after', dest='steal_after', default=120, type=int,
+                        help='number of seconds without heartbeats after which a claimed shard can be stolen, default to 120')
     parser.add_argument('--playlist-items', default='', dest='playlist_items', type=_segment_playlist_items,
                         help='desired episode indices in a playlist separated by commas, while the playlists are separated by semicolons,'
                              'e.g. "--playlist-items 1,2,5-10", "--playlist-items 1,2,5-10;3-", and "--playlist-items 1,2,5-10;;-20"')
 
+    parser.add_argument('--start', dest='start', type=_parse_timestamp,
+                        help='download only the part of the episodes starting at the point in time of the form "[[HH:]MM:]SS[.m...]"')
+    parser.add_argument('--end', dest='end', type=_parse_timestamp,
+                        help='download only the part of the episodes ending at the point in time of the form "[[HH:]MM:]SS[.m...]"')
+
+    parser.add_argument('--catalog', dest='catalog', default='',
+                        help='SQLite database cataloging the downloaded episodes across runs, which are then skipped, '
+                             'or hard-linked into the directories of other covers')
+    parser.add_argument('--scratch-dir', dest='scratch_dir', default='',
+                        help='fast scratch directory to download and join the segments in, spilling over to the save '
+                             'directory when full')
+    parser.add_argument('--stream-join', dest='stream_join', action='store_true',
+                        help='join the TS segments of each episode while the later ones are still being downloaded')
+    parser.add_argument('--fmp4', dest='fmp4', action='store_true',
+                        help='join the episodes into fragmented MP4, which can be played while still being joined')
+
+    progress = parser.add_mutually_exclusive_group()
+    progress.add_argument('--progress-fd', dest='progress_fd', type=int,
+                          help='file descriptor to write the progress events to as JSON Lines')
+    progress.add_argument('--progress-socket', dest='progress_socket', default='',
+                          help='"HOST:PORT" or the path to a Unix domain socket to send the progress events to as JSON Lines')
+
     parser.add_argument('--QQVideo-no-logo', dest='QQVideo_no_logo', default='', choices=['True', 'False'])
 
     parser.add_argument('-A', '--aria2c', dest='aria2c', default='', help='path to the aria2 executable')
@@ -70,6 +132,37 @@ def arg_parser():
     return parser
 
 
+def serve_arg_parser():
+    """Command line options of "mdl serve", i.e. those of mdl plus the daemon's own ones"""
+    parser = arg_parser()
+    parser.prog = '{} serve'.format(parser.prog)
+
+    parser.add_argument('--host', dest='host', default='127.0.0.1', help='address of the HTTP API to listen on')
+    parser.add_argument('--port', dest='port', default=8770, type=int, help='port of the HTTP API to listen on')
+    parser.add_argument('--unix-socket', dest='unix_socket', default='',
+                        help='path to the Unix domain socket to serve the API on, instead of HTTP over TCP')
+    parser.add_argument('--queue-file', dest='queue_file', default='',
+                        help='JSON file persisting the job queue, default to "mdl_jobs.json" in the save directory')
+    parser.add_argument('--max-jobs', dest='max_jobs', default=4, type=int, help='maximum number of concurrent jobs')
+
+    return parser
+
+
+def sync_arg_parser():
+    """Command line options of "mdl sync", i.e. those of mdl plus the syncer's own ones"""
+    parser = arg_parser()
+    parser.prog = '{} sync'.format(parser.prog)
+
+    parser.add_argument('--state-file', dest='state_file', default='',
+                        help='JSON file persisting the states of the covers, default to "mdl_sync.json" in the save directory')
+    parser.add_argument('--interval', dest='interval', default=0, type=int,
+                        help='sync the covers every INTERVAL seconds, instead of only once')
+    parser.add_argument('--max-covers', dest='max_covers', default=4, type=int,
+                        help='maximum number of covers synced concurrently')
+
+    return parser
+
+
 def conf_parser():
     confs = {}
 
@@ -86,11 +179,21 @@ def conf_parser():
             for option in config.options(section):
                 confs[section][option] = config.get(section, option)
 
+        if conf_path == conf_dlops:
+            # the site plugins without their own sections get the defaults
+            from .sites import get_all_sites_vcs
+
+            for site in get_all_sites_vcs():
+                if site not in confs:
+                    confs[site] = dict(config.defaults())
+
     return confs
 
 
 def parse_3rd_party_progs(args, confs):
     """Option precedence: cmdline args > confs(config file) > default"""
+    from .third_parties import third_party_progs_default
+    from .toolchain import discover_toolchain
 
     aria2c_default, ffmpeg_default, mkvmerge_default, node_default = third_party_progs_default
 
@@ -99,12 +202,10 @@ def parse_3rd_party_progs(args, confs):
     mkvmerge_path = args.mkvmerge or confs['progs']['mkvmerge'] or mkvmerge_default
     node_path = args.node or confs['progs']['node'] or node_default
 
-    progs = (aria2c_path, ffmpeg_path, mkvmerge_path, node_path)
+    progs = {'aria2c': aria2c_path, 'ffmpeg': ffmpeg_path, 'mkvmerge': mkvmerge_path, 'node': node_path}
     try:
-        for prog in progs:
-            path, exe = os.path.split(prog)
-            if which(exe, path=path) is None:
-                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), exe)
+        # the versions and capabilities of the programs are probed once and then cached
+        toolchain = discover_toolchain(progs)
     except Exception as e:
         LOGGER.error(str(e))
         LOGGER.info('For how to get and install Aria2, FFmpeg, MKVToolnix(mkvmerge) and Nodejs, please refer to README.md. '
@@ -112,10 +213,8 @@ def parse_3rd_party_progs(args, confs):
         sys.exit(-1)
 
     # update config info
-    confs['progs']['aria2c'] = aria2c_path
-    confs['progs']['ffmpeg'] = ffmpeg_path
-    confs['progs']['mkvmerge'] = mkvmerge_path
-    confs['progs']['node'] = node_path
+    confs['progs'].update(progs)
+    confs['toolchain'] = toolchain
 
 
 def parse_con_log_level(args, confs):
@@ -132,7 +231,7 @@ def parse_dlops_default(args, confs):
     definition_default = 'fhd'
 
     for site in confs:
-        if site not in ('misc', 'progs'):
+        if site not in ('misc', 'progs', 'toolchain'):
             save_dir = args.dir or confs[site]['dir'] or save_dir_default
             confs[site]['dir'] = save_dir
             # Validate the file save directory
@@ -146,14 +245,54 @@ def parse_dlops_default(args, confs):
             if args.proxy:
                 confs[site]['proxy'] = args.proxy
 
+            from .requester import parse_rate_limits, parse_endpoint_policies
+            for key, parse in (('rate_limits', parse_rate_limits), ('endpoint_policies', parse_endpoint_policies)):
+                try:
+                    parse(confs[site].get(key))
+                except ValueError as e:
+                    LOGGER.error('{} of {}: {}'.format(key, site, e))
+                    sys.exit(-1)
+
 
 def parse_other_ops(args, confs):
     # associate the playlist URLs with desired video episodes
     url_plist = zip_longest(args.url, args.playlist_items) if len(args.url) >= len(args.playlist_items) else zip(args.url, args.playlist_items)
     confs['playlist_items'] = {url: items for url, items in url_plist}
 
+    if args.start is not None and args.end is not None and args.end <= args.start:
+        LOGGER.error('The "--end" time must be later than the "--start" time!')
+        sys.exit(-1)
+
+    confs['misc']['catalog'] = args.catalog or confs['misc'].get('catalog', '')
+
+    scratch_dir = args.scratch_dir or confs['misc'].get('scratch_dir', '')
+    if scratch_dir and not os.path.isdir(scratch_dir):
+        LOGGER.error('"{}" is not a valid path!'.format(scratch_dir))
+        sys.exit(-1)
+    confs['misc']['scratch_dir'] = scratch_dir
+    from .scratch import parse_size
+    try:
+        parse_size(confs['misc'].get('scratch_size', ''))
+    except ValueError as e:
+        LOGGER.error('scratch_size: {}'.format(e))
+        sys.exit(-1)
+
+
+def read_batch_file(batch_file):
+    """Lazily read the URLs from the batch file, skipping the blank and comment lines"""
+    if not batch_file:
+        return
+
+    with (sys.stdin if batch_file == '-' else open(batch_file, encoding='utf-8')) as fd:
+        for line in fd:
+            url = line.strip()
+            if url and not url.startswith(('#', ';')):
+                yield url
+
 
 def check_deps():
+    from .third_parties import exists_3rd_parties
+
     if not exists_3rd_parties():
         LOGGER.error('The third-parties such as Aria2, FFmpeg, MKVToolnix and Nodejs are required. Before moving on, '
                      'simply run "mdl_3rd_parties" from within the Shell to automatically download and install them. '
@@ -162,13 +301,59 @@ def check_deps():
         sys.exit(-1)
 
 
+def run_daemon(dl, args, confs, urls):
+    from .daemon import DownloadDaemon
+
+    sites = [site for site in confs if site not in ('misc', 'progs', 'toolchain', 'playlist_items')]
+    site_limits = {site: int(confs[site].get('max_jobs_per_site') or 2) for site in sites}
+    queue_file = args.queue_file or os.path.join(confs[sites[0]]['dir'], 'mdl_jobs.json')
+
+    try:
+        daemon = DownloadDaemon(dl, queue_file, max_jobs=max(args.max_jobs, 1), site_limits=site_limits,
+                                host=args.host, port=args.port, unix_socket=args.unix_socket)
+    except OSError as e:
+        LOGGER.error('Failed to start the daemon: {}'.format(e.strerror or e))
+        sys.exit(-1)
+    for url in urls:
+        try:
+            daemon.queue.submit(url)
+        except ValueError as e:
+            LOGGER.error(str(e))
+
+    daemon.serve_forever()
+
+
+def run_syncer(dl, args, confs, urls):
+    from .sync import Syncer
+
+    sites = [site for site in confs if site not in ('misc', 'progs', 'toolchain', 'playlist_items')]
+    state_file = args.state_file or os.path.join(confs[sites[0]]['dir'], 'mdl_sync.json')
+
+    syncer = Syncer(dl, state_file, max_covers=max(args.max_covers, 1))
+    try:
+        failed = syncer.run(urls, interval=max(args.interval, 0))
+    except KeyboardInterrupt:
+        return
+
+    if failed:
+        sys.exit(1)
+
+
 def main():
+    command = sys.argv[1] if sys.argv[1:2] in (['serve'], ['sync']) else None
+    serve, sync = command == 'serve', command == 'sync'
+    parser = serve_arg_parser() if serve else sync_arg_parser() if sync else arg_parser()
+    args = parser.parse_args(sys.argv[2:] if command else None)  # "-h" gets handled here without further ado
+    if (args.coordinator or args.worker) and not args.shard_dir:
+        parser.error('"--coordinator" and "--worker" require the "--shard-dir"')
+    if sync and not (args.url or args.batch_file):
+        parser.error('at least one URL or the "--batch-file" is required')
+    if not (args.url or args.batch_file or args.from_manifest or args.worker or serve):
+        parser.error('at least one URL, the "--batch-file" or the "--from-manifest" is required')
+
     check_deps()  # make sure the prerequisites are satisfied
 
     confs = conf_parser()  # parse the config file
-    parser = arg_parser()
-    args = parser.parse_args()
-
     parse_con_log_level(args, confs)
     change_logging_level('MDL', console_level=confs['misc']['log_level'])
 
@@ -176,7 +361,30 @@ def main():
     parse_dlops_default(args, confs)
     parse_other_ops(args, confs)
 
+    urls = chain(args.url, read_batch_file(args.batch_file))
+
+    from .downloader import MDownloader
+
     dl = MDownloader(args, confs)
-    dl.download(args.url)
+    try:
+        if serve:
+            run_daemon(dl, args, confs, urls)
+        elif sync:
+            run_syncer(dl, args, confs, urls)
+        elif args.coordinator:
+            from .shard import create_shards, wait_for_shards
+            create_shards(dl, urls, args.shard_dir, shard_size=max(args.shard_size, 1))
+            wait_for_shards(args.shard_dir, steal_after=args.steal_after)
+        elif args.worker:
+            from .shard import ShardWorker
+            ShardWorker(dl, args.shard_dir, steal_after=args.steal_after).run()
+        elif args.from_manifest:
+            dl.download_from_manifest(args.from_manifest)
+        elif args.metadata_only:
+            dl.dump_metadata(urls, probe_defns=args.probe_definitions)
+        else:
+            dl.download(urls)
+    finally:
+        dl.close()  # close the progress event stream after the last "job_finished"
 
 # __all__ = ["main"]
@@ -0,0 +1,108 @@
+"""Persistent catalog of the downloaded episodes across runs, kept in an SQLite database.
+
+The episodes are keyed by the site, the video ID and the definition, along with the path, the size and a sampled
+checksum of the joined video file. An episode found in the catalog, whose file is still intact, needs neither resolving
+nor downloading again, but just hard-linking into the directory of the cover being downloaded.
+"""
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import logging
+
+
+SAMPLE_SIZE = 64 * 1024  # bytes of each sample
+NUM_SAMPLES = 3  # at the beginning, in the middle and at the end of the file
+
+LOGGER = logging.getLogger('MDL.catalog')
+
+
+def sampled_checksum(path, size=None):
+    """SHA-1 digest of the file size along with the samples of the file content, which is cheap even for huge files"""
+    size = os.path.getsize(path) if size is None else size
+
+    sha1 = hashlib.sha1(str(size).encode('ascii'))
+    with open(path, 'rb') as fd:
+        for i in range(NUM_SAMPLES):
+            fd.seek(max(size - SAMPLE_SIZE, 0) * i // (NUM_SAMPLES - 1))
+            sha1.update(fd.read(SAMPLE_SIZE))
+
+    return sha1.hexdigest()
+
+
+class Catalog(object):
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS episodes ('
+                               'site TEXT NOT NULL, vid TEXT NOT NULL, defn TEXT NOT NULL, '
+                               'path TEXT NOT NULL, size INTEGER NOT NULL, checksum TEXT NOT NULL, added REAL NOT NULL, '
+                               'PRIMARY KEY (site, vid, defn))')
+
+    def lookup(self, site, vid, defns):
+        """Find the intact video file of the episode in any of the definitions `defns`, tried in order.
+
+        The entries whose files have been removed or changed get dropped from the catalog.
+
+        Returns:
+            dict: The catalog entry of the episode, i.e. its 'site', 'vid', 'defn', 'path', 'size' and 'checksum', or
+            ``None`` if not found.
+        """
+        for defn in defns:
+            with self._lock:
+                row = self._conn.execute('SELECT path, size, checksum FROM episodes WHERE site = ? AND vid = ? AND defn = ?',
+                                         (site, vid, defn)).fetchone()
+            if row is None:
+                continue
+
+            path, size, checksum = row
+            try:
+                intact = os.path.getsize(path) == size and sampled_checksum(path, size) == checksum
+            except OSError:
+                intact = False
+
+            if intact:
+                return {'site': site, 'vid': vid, 'defn': defn, 'path': path, 'size': size, 'checksum': checksum}
+
+            LOGGER.info("Cataloged file '{}' is gone or changed, forgotten.".format(path))
+            self.forget(site, vid, defn)
+
+        return None
+
+    def record(self, site, vid, defn, path):
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        checksum = sampled_checksum(path, size)
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO episodes (site, vid, defn, path, size, checksum, added) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)', (site, vid, defn, path, size, checksum, time.time()))
+
+    def forget(self, site, vid, defn):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM episodes WHERE site = ? AND vid = ? AND defn = ?', (site, vid, defn))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def link_file(src, dst):
+    """Hard-link `src` to `dst`, falling back to copying across filesystems or where hard links are unsupported.
+
+    Returns:
+        bool: ``True`` if linked or copied, ``False`` if `dst` already exists.
+    """
+    if os.path.exists(dst):
+        return False
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+    return True
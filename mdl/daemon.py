@@ -0,0 +1,328 @@
+"""The long-running download daemon, i.e. ``mdl serve``.
+
+It keeps one :class:`MDownloader`, along with the warm site instances and their HTTP sessions, for all the jobs, which
+are submitted through a small JSON API over localhost HTTP or a Unix domain socket:
+
+    POST   /jobs        {"url": URL, "priority": 0, "playlist_items": "1,2,5-10"}  -> the job
+    GET    /jobs        -> all the jobs
+    GET    /jobs/<id>   -> the job
+    DELETE /jobs/<id>   -> cancel the job if it is still queued
+
+The jobs are persisted in the queue file, so that the queued and interrupted ones are resumed upon restart. Jobs of
+higher priorities get scheduled first, subject to the limit of concurrent jobs per site.
+"""
+import os
+import json
+import time
+import stat
+import errno
+import socket
+import uuid
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+try:
+    from socketserver import UnixStreamServer
+except ImportError:  # Windows
+    UnixStreamServer = None
+
+
+QUEUED, RUNNING, DONE, FAILED, CANCELED = 'queued', 'running', 'done', 'failed', 'canceled'
+
+LOGGER = logging.getLogger('MDL.daemon')
+
+
+def remove_stale_socket(path):
+    """Remove the Unix domain socket `path` left behind by a daemon no longer listening on it, if any.
+
+    Raises:
+        OSError: Raised when the `path` is not a socket, or is still being listened on.
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EEXIST, "'{}' exists and is not a socket, not removed".format(path))
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except ConnectionRefusedError:  # nobody listening
+        os.remove(path)
+        return
+    finally:
+        sock.close()
+
+    raise OSError(errno.EADDRINUSE, "'{}' is in use by another daemon".format(path))
+
+
+def parse_playlist_items(playlist_items):
+    """Parse the episode indices of a playlist, e.g. "1,2,5-10", into the form of :func:`mdl._segment_playlist_items`
+
+    Raises:
+        ValueError: Raised when the `playlist_items` is malformed.
+    """
+    from . import _segment_playlist_items
+
+    if not isinstance(playlist_items, str):
+        raise ValueError('playlist_items {!r} is not a string'.format(playlist_items))
+    try:
+        playlists = _segment_playlist_items(playlist_items)
+    except ValueError:
+        raise ValueError('playlist_items {!r} is invalid'.format(playlist_items))
+    if len(playlists) > 1:
+        raise ValueError('playlist_items {!r} is of more than one playlist'.format(playlist_items))
+
+    return playlists[0]
+
+
+class JobQueue(object):
+    """Priority queue of the download jobs, persisted in a JSON file"""
+
+    def __init__(self, queue_file, site_of, site_limits, default_site_limit=2):
+        self.queue_file = queue_file
+        self._site_of = site_of
+        self._site_limits = site_limits
+        self._default_site_limit = default_site_limit
+
+        self._jobs = {}  # job ID -> job
+        self._seq = 0
+        self._running = {}  # site -> number of running jobs
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.queue_file, encoding='utf-8') as fd:
+                jobs = json.load(fd)
+        except FileNotFoundError:
+            return
+
+        for job in jobs:
+            if job['state'] == RUNNING:  # interrupted
+                job['state'] = QUEUED
+            self._jobs[job['id']] = job
+            self._seq = max(self._seq, job['seq'] + 1)
+
+    def _save(self):
+        tmp_file = self.queue_file + '.tmp'
+        with open(tmp_file, mode='w', encoding='utf-8') as fd:
+            json.dump(sorted(self._jobs.values(), key=lambda job: job['seq']), fd, ensure_ascii=False)
+        os.replace(tmp_file, self.queue_file)
+
+    def submit(self, url, priority=0, playlist_items=''):
+        site = self._site_of(url)
+        if site is None:
+            raise ValueError('Video URL {!r} is invalid'.format(url))
+        parse_playlist_items(playlist_items)
+
+        with self._cond:
+            job = {'id': uuid.uuid4().hex, 'seq': self._seq, 'url': url, 'site': site, 'priority': priority,
+                   'playlist_items': playlist_items, 'state': QUEUED, 'submitted': time.time(),
+                   'started': None, 'finished': None}
+            self._seq += 1
+            self._jobs[job['id']] = job
+            self._save()
+            self._cond.notify_all()
+
+        return dict(job)
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job['state'] != QUEUED:
+                return False
+
+            job['state'] = CANCELED
+            job['finished'] = time.time()
+            self._save()
+
+        return True
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self):
+        with self._cond:
+            return [dict(job) for job in sorted(self._jobs.values(), key=lambda job: job['seq'])]
+
+    def _pick(self):
+        """The queued job of the highest priority whose site has not reached its concurrency limit"""
+        candidates = [job for job in self._jobs.values() if job['state'] == QUEUED and
+                      self._running.get(job['site'], 0) < self._site_limits.get(job['site'], self._default_site_limit)]
+
+        return min(candidates, key=lambda job: (-job['priority'], job['seq'])) if candidates else None
+
+    def take(self):
+        """Block until a job is ready to run, or return ``None`` if the queue is closed"""
+        with self._cond:
+            job = self._pick()
+            while job is None and not self._closed:
+                self._cond.wait()
+                job = self._pick()
+
+            if job is None:
+                return None
+
+            job['state'] = RUNNING
+            job['started'] = time.time()
+            self._running[job['site']] = self._running.get(job['site'], 0) + 1
+            self._save()
+
+            return dict(job)
+
+    def finish(self, job_id, ok, error=None):
+        with self._cond:
+            job = self._jobs[job_id]
+            job['state'] = DONE if ok else FAILED
+            job['finished'] = time.time()
+            if error:
+                job['error'] = error
+            self._running[job['site']] -= 1
+            self._save()
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class _JobAPIHandler(BaseHTTPRequestHandler):
+    server_version = 'mdl'
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_id(self):
+        parts = self.path.strip('/').split('/')
+        if parts[0] != 'jobs' or len(parts) > 2:
+            return None, False
+
+        return (parts[1] if len(parts) == 2 else None), True
+
+    def do_GET(self):
+        job_id, valid = self._job_id()
+        if not valid:
+            self._send_json(404, {'error': 'Not found'})
+        elif job_id is None:
+            self._send_json(200, self.server.queue.list())
+        else:
+            job = self.server.queue.get(job_id)
+            self._send_json(200, job) if job else self._send_json(404, {'error': 'No such job'})
+
+    def do_POST(self):
+        job_id, valid = self._job_id()
+        if not valid or job_id is not None:
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            req = json.loads(self.rfile.read(length).decode('utf-8'))
+            job = self.server.queue.submit(req['url'], priority=int(req.get('priority') or 0),
+                                           playlist_items=req.get('playlist_items') or '')
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        self._send_json(201, job)
+
+    def do_DELETE(self):
+        job_id, valid = self._job_id()
+        if not valid or job_id is None:
+            self._send_json(404, {'error': 'Not found'})
+        elif self.server.queue.cancel(job_id):
+            self._send_json(200, self.server.queue.get(job_id))
+        else:
+            self._send_json(409, {'error': 'Job is not queued'})
+
+    def address_string(self):
+        return self.client_address[0] if isinstance(self.client_address, tuple) and self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        LOGGER.debug('%s - %s', self.address_string(), format % args)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if UnixStreamServer is not None:
+    class _ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+        daemon_threads = True
+
+
+class DownloadDaemon(object):
+    def __init__(self, downloader, queue_file, max_jobs=4, site_limits=None, host='127.0.0.1', port=8770,
+                 unix_socket=None):
+        self.downloader = downloader
+        self.max_jobs = max_jobs
+        self.queue = JobQueue(queue_file, downloader.site_of, site_limits or {})
+
+        if unix_socket:
+            if UnixStreamServer is None:
+                raise OSError('Unix domain sockets are not supported on this platform')
+            remove_stale_socket(unix_socket)
+            self.server = _ThreadingUnixHTTPServer(unix_socket, _JobAPIHandler)
+            self.address = unix_socket
+        else:
+            self.server = _ThreadingHTTPServer((host, port), _JobAPIHandler)
+            self.address = 'http://{}:{}'.format(*self.server.server_address[:2])
+        self.server.queue = self.queue
+
+        self._workers = []
+
+    def _run_jobs(self):
+        while True:
+            job = self.queue.take()
+            if job is None:
+                return
+
+            LOGGER.info("Job {} started: {}".format(job['id'], job['url']))
+            ok, error = False, None
+            try:
+                # the episodes of the job only, leaving the configured ones shared by the jobs alone
+                playlist_items = parse_playlist_items(job['playlist_items']) if job['playlist_items'] else None
+                ok = self.downloader.download_url(job['url'], playlist_items=playlist_items)
+            except Exception as e:
+                error = repr(e)
+                LOGGER.error("Job {} failed: {}".format(job['id'], error))
+
+            self.queue.finish(job['id'], ok, error)
+            LOGGER.info("Job {} {}: {}".format(job['id'], DONE if ok else FAILED, job['url']))
+
+    def serve_forever(self):
+        for _ in range(self.max_jobs):
+            worker = threading.Thread(target=self._run_jobs, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        LOGGER.info("mdl daemon listening on {}".format(self.address))
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        self.queue.close()
+        self.server.server_close()
+        if UnixStreamServer is not None and isinstance(self.server, UnixStreamServer):
+            try:
+                os.remove(self.address)
+            except OSError:
+                pass
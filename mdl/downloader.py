@@ -1,25 +1,57 @@
 import os
+import sys
+import json
+import time
+import threading
 import subprocess
 import tempfile
 import shutil
 import errno
 import logging
+import binascii
 from math import trunc, log10
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 
 from certifi import where
-from bdownload.download import requests_retry_session
 
 from .commons import VIDEO_DEFINITIONS, VideoTypes, DEFAULT_YEAR
-from .sites import get_all_sites_vcs
+from .sites import get_all_sites_vcs, load_site_vc_class, route
 from .utils import logging_with_pipe, normalize_filename
+from .models import Episode
+from .hls import select_segments
+from .toolchain import has_cap
+from .preflight import file_allocation
+from .scratch import expected_size
 
 
 cert_path = where()
 
+MANIFEST_VERSION = 1
+
+# fragmented MP4 starting with an empty moov box, to which the fragments are appended as soon as they're joined
+FMP4_MOVFLAGS = '+frag_keyframe+empty_moov+default_base_moof'
+
+
+def _terminate_on(proc, stop, interval=1):
+    """Terminate the process `proc` once the event `stop` gets set, unless it has exited by then"""
+    while not stop.wait(interval):
+        if proc.poll() is not None:
+            return
+    if proc.poll() is None:
+        proc.terminate()
+
 
 class MDownloader(object):
     def __init__(self, args=None, confs=None):
         self._vcs = get_all_sites_vcs()
+        self._vcs_lock = threading.Lock()
+        self._catalog = None
+        self._catalog_lock = threading.Lock()
+        self._scratch = None
+        self._progress = None
+        self._progress_lock = threading.Lock()
+        self._rate_limiter = None
+        self._endpoints = None
         self.args = args
         self.confs = confs
 
@@ -27,40 +59,401 @@ class MDownloader(object):
         self._logger = logging.getLogger(logger_name)
 
     def download(self, urls):
+        plan_out = getattr(self.args, 'plan_out', None)
+        if plan_out:
+            self.write_manifest(urls, plan_out)
+            return
+
+        for url in urls:
+            self.download_url(url)
+
+    def download_url(self, url, playlist_items=None):
+        """Extract, download and join the videos of the `url`, only the episodes selected by the `playlist_items`
+        (a playlist segmented by :func:`mdl._segment_playlist_items`) if given, instead of those configured
+
+        :returns: ``True`` if all the episodes have been downloaded and joined, otherwise ``False``.
+        """
+        cover_info = self.extract_config_info(url, playlist_items=playlist_items)
+        if cover_info:
+            return self.download_cover(cover_info)
+
+        self._emit('job_finished', url=url, ok=False)
+        return False
+
+    def download_cover(self, cover_info, joined=None):
+        """Download and join the videos of the cover extracted by :meth:`extract_config_info`, appending the episodes
+        joined to the list `joined` if any.
+
+        :returns: ``True`` if all the episodes have been downloaded and joined, otherwise ``False``.
+        """
+        vc_name = cover_info['vc_name']
+        self._emit('cover_resolved', url=cover_info['url'], site=vc_name, title=cover_info.get('title'),
+                   episodes=len(cover_info.get('normal_ids') or []))
+        joiner = self._start_stream_joiner()
+        dropped = []
+        cover_dir, episodes = self.dwnld_videos_with_aria2(
+            cover_info, save_dir=self.confs[vc_name]["dir"], defn=self.confs[vc_name]['definition'], joiner=joiner,
+            dropped=dropped)
+
+        return self._verify_and_join(cover_dir, episodes, joiner, vc_name, cover_info['referrer'],
+                                     self.confs[vc_name]['user_agent'], cover_info['url'], dropped, joined)
+
+    def _start_stream_joiner(self):
+        """The joiner of the segments being downloaded in "--stream-join" mode, otherwise ``None``"""
+        if not getattr(self.args, 'stream_join', False):
+            return None
+
+        from .streamjoin import StreamJoiner
+        return StreamJoiner(self._ffmpeg_join_cmd, self._logger).start()
+
+    def _verify_and_join(self, cover_dir, episodes, joiner, vc_name, referer, user_agent, name, dropped=(),
+                         joined=None):
+        """Verify and join the downloaded `episodes`, except those joined by the stream `joiner` already, appending
+        the episodes joined to the list `joined` if any.
+
+        :returns: ``True`` if all the episodes have been joined, and none `dropped`, e.g. for the lack of space,
+            otherwise ``False``.
+        """
+        stream_joined = joiner.finish() if joiner is not None else {}
+        ok = False
+        if cover_dir:
+            pending = []
+            for episode in episodes:
+                if id(episode) in stream_joined:
+                    self._finish_episode(episode, stream_joined[id(episode)], vc_name, joined)
+                else:
+                    pending.append(episode)
+
+            corrupted = self.verify_episodes(pending, vc_name, referer, user_agent, name)
+            self._hand_off(corrupted)
+            pending = [episode for episode in pending if episode not in corrupted]
+            ok = self.join_videos(cover_dir, pending, site=vc_name, joined=joined) and not corrupted and not dropped
+
+        self._emit('job_finished', url=name, ok=ok)
+        return ok
+
+    def plan_cover(self, cover_info):
+        """Resolve the cover into an entry of the download manifest, with everything needed to download and join the
+        episodes but the site configuration.
+        """
+        vc_name = cover_info['vc_name']
+        cover_dir, episodes = self.plan_episodes(cover_info, save_dir=self.confs[vc_name]['dir'],
+                                                 defn=self.confs[vc_name]['definition'])
+
+        cover = {key: cover_info.get(key) for key in ('url', 'referrer', 'vc_name', 'source_name', 'title', 'year',
+                                                        'type', 'cover_id', 'episode_all')}
+        cover.update(user_agent=self.confs[vc_name]['user_agent'], definition=self.confs[vc_name]['definition'],
+                     cover_dir=cover_dir, episodes=[episode.to_dict() for episode in episodes])
+
+        return cover
+
+    def write_manifest(self, urls, manifest_path):
+        """Extract and resolve the `urls` without downloading, then write the results to the manifest file"""
+        covers = []
         for url in urls:
             cover_info = self.extract_config_info(url)
             if cover_info:
-                cover_dir, episodes = self.dwnld_videos_with_aria2(
-                    cover_info, save_dir=self.confs[cover_info["vc_name"]]["dir"],
-                    defn=self.confs[cover_info["vc_name"]]['definition'])
-                self.join_videos(cover_dir, episodes)
+                covers.append(self.plan_cover(cover_info))
+
+        with open(manifest_path, mode='w', encoding='utf-8') as fd:
+            json.dump({'version': MANIFEST_VERSION, 'covers': covers}, fd, ensure_ascii=False)
+
+        self._logger.info("Wrote the download plans of {} covers to '{}'.".format(len(covers), manifest_path))
+
+    @staticmethod
+    def _rebase_cover(cover, save_dir):
+        """Move the cover directory, along with its episode directories, into `save_dir`"""
+        cover_dir = os.path.abspath(os.path.join(save_dir, os.path.basename(cover['cover_dir'])))
+        for episode in cover['episodes']:
+            episode['dir'] = os.path.join(cover_dir, os.path.basename(episode['dir']))
+        cover['cover_dir'] = cover_dir
 
-    def extract_config_info(self, url):
-        for name, vc in self._vcs.items():
-            vcc = vc['class']
-            if not vcc.is_url_valid(url):
-                continue
+    def download_from_manifest(self, manifest_path, stop=None):
+        """Download and join the episodes planned in the manifest file written by :meth:`write_manifest`.
 
+        The videos are saved into the directories recorded in the manifest, unless a save directory is specified on
+        the command line. Once the event `stop` gets set, e.g. when the shard has been taken over by another worker,
+        the downloads are stopped and nothing more gets joined.
+
+        :returns: ``True`` if all the episodes have been downloaded and joined, otherwise ``False``.
+        """
+        with open(manifest_path, encoding='utf-8') as fd:
+            manifest = json.load(fd)
+
+        if manifest.get('version') != MANIFEST_VERSION:
+            self._logger.error("Unsupported manifest version: {!r}".format(manifest.get('version')))
+            return False
+
+        ok = True
+        save_dir = getattr(self.args, 'dir', None)
+        for cover in manifest['covers']:
+            if save_dir:
+                self._rebase_cover(cover, save_dir)
+
+            joiner = self._start_stream_joiner()
+            episodes = (Episode.from_dict(episode) for episode in cover['episodes'])
+            dropped = []
+            episodes = self._dwnld_episodes_with_aria2(episodes, cover['vc_name'], cover['referrer'],
+                                                       cover['user_agent'], cover['url'], joiner=joiner, stop=stop,
+                                                       dropped=dropped)
+            if stop is not None and stop.is_set():
+                if joiner is not None:
+                    joiner.abort()
+                return False
+
+            ok = self._verify_and_join(cover['cover_dir'] if episodes is not None else '', episodes or [], joiner,
+                                       cover['vc_name'], cover['referrer'], cover['user_agent'], cover['url'],
+                                       dropped) and ok
+
+        return ok
+
+    def site_of(self, url):
+        """Name of the site the `url` belongs to, or ``None`` if unsupported"""
+        return route(url)[0]
+
+    def _find_vc(self, url):
+        """The site name, the VideoConfig item and the route of the `url`, see :func:`.sites.route`"""
+        name, typ, match = route(url)
+        if name is None:
+            return None, None, None
+
+        vc = self._vcs[name]
+        load_site_vc_class(vc)
+        return name, vc, (typ, match)
+
+    def _get_vc_instance(self, vc):
+        with self._vcs_lock:
             vci = vc.get('instance')
             if vci is None:
-                requester = requests_retry_session()
-                vci = vcc(requester, self.args, self.confs)
+                from .requester import ThrottledSession
+
+                requester = ThrottledSession(self.rate_limiter, self.endpoints)
+                vci = vc['class'](requester, self.args, self.confs)
                 vc['instance'] = vci
 
-            cover_info = vci.get_video_config_info(url)
-            if cover_info:
-                cover_info["source_name"] = vcc.SOURCE_NAME
-                cover_info["vc_name"] = vcc.VC_NAME
-            return cover_info
-        else:
+        return vci
+
+    @property
+    def rate_limiter(self):
+        """The per-host rate limiter shared by the requesters of all the sites, see :mod:`.requester`"""
+        if self._rate_limiter is None:
+            from .requester import RateLimiter, parse_rate_limits
+
+            limits = {}
+            for name in self._vcs:
+                limits.update(parse_rate_limits((self.confs or {}).get(name, {}).get('rate_limits')))
+            self._rate_limiter = RateLimiter(limits)
+
+        return self._rate_limiter
+
+    @property
+    def endpoints(self):
+        """The timeouts, retry budgets and circuit breakers of the endpoints shared by the requesters of all the sites"""
+        if self._endpoints is None:
+            from .requester import Endpoints, parse_endpoint_policies
+
+            policies = {}
+            for name in self._vcs:
+                policies.update(parse_endpoint_policies((self.confs or {}).get(name, {}).get('endpoint_policies')))
+            self._endpoints = Endpoints(policies)
+
+        return self._endpoints
+
+    @property
+    def catalog(self):
+        """The catalog of the downloaded episodes if configured, otherwise ``None``"""
+        db_path = self.confs['misc'].get('catalog') if self.confs else None
+        if db_path and self._catalog is None:
+            with self._catalog_lock:
+                if self._catalog is None:
+                    from .catalog import Catalog
+                    self._catalog = Catalog(db_path)
+
+        return self._catalog
+
+    @property
+    def progress(self):
+        """The emitter of the progress events if "--progress-fd" or "--progress-socket" is specified, otherwise ``None``"""
+        fd, address = getattr(self.args, 'progress_fd', None), getattr(self.args, 'progress_socket', None)
+        if (fd is not None or address) and self._progress is None:
+            with self._progress_lock:
+                if self._progress is None:
+                    from .progress import open_emitter
+                    try:
+                        self._progress = open_emitter(fd, address)
+                    except OSError as e:
+                        self._logger.error('Failed to open the progress event stream: {!r}'.format(e))
+                        self.args.progress_fd = self.args.progress_socket = None
+
+        return self._progress
+
+    def close(self):
+        """Flush and close the progress event stream, if any"""
+        with self._progress_lock:
+            if self._progress is not None:
+                self._progress.close()
+
+    def _emit(self, event, **fields):
+        if self.progress is not None:
+            self.progress.emit(event, **fields)
+
+    @property
+    def scratch(self):
+        """The scratch directory to stage the episodes being downloaded in if configured, otherwise ``None``"""
+        root = self.confs['misc'].get('scratch_dir') if self.confs else None
+        if root and self._scratch is None:
+            from .scratch import Scratch, parse_size
+            self._scratch = Scratch(root, parse_size(self.confs['misc'].get('scratch_size')))
+
+        return self._scratch
+
+    def _find_owned_episodes(self, cover_info, episodes=None):
+        """Mark the `episodes`, default to all, of the cover found in the catalog, in the configured definition or a
+        higher one, with their catalog entries as ``vi['owned']``.
+
+        :returns: the list of the episodes not owned.
+        """
+        vc_name = cover_info['vc_name']
+        defn = self.confs[vc_name]['definition']
+        defns = list(VIDEO_DEFINITIONS)
+        defns = defns[:defns.index(defn) + 1] if defn in defns else defns
+
+        not_owned = []
+        for vi in (cover_info['normal_ids'] if episodes is None else episodes):
+            entry = self.catalog.lookup(vc_name, vi['V'], defns)
+            if entry:
+                vi['owned'] = entry
+            else:
+                not_owned.append(vi)
+
+        return not_owned
+
+    def extract_config_info(self, url, dwnld_info=True, skip_owned=True, playlist_items=None):
+        """Extract the cover info of the `url`, along with the download info of its episodes if `dwnld_info`, with
+        the episodes selected by the `playlist_items`, or those configured for the `url` if ``None``.
+
+        With `skip_owned`, the episodes already in the catalog are marked as owned, see :meth:`_find_owned_episodes`,
+        and their download info isn't extracted.
+        """
+        name, vc, url_route = self._find_vc(url)
+        if vc is None:
             # check site domain name against URL
             self._logger.error("Video URL {!r} is invalid".format(url))
             return None
 
-    def dwnld_videos_with_aria2(self, cover_info, save_dir='.', defn=None):
+        vcc = vc['class']
+        vci = self._get_vc_instance(vc)
+
+        skip_owned = skip_owned and dwnld_info and self.catalog is not None
+        cover_info = vci.get_video_config_info(url, dwnld_info=dwnld_info and not skip_owned, route=url_route,
+                                               playlist_items=playlist_items)
+        if cover_info:
+            cover_info["source_name"] = vcc.SOURCE_NAME
+            cover_info["vc_name"] = vcc.VC_NAME
+
+            if skip_owned:
+                self.resolve_episodes(cover_info)
+        return cover_info
+
+    def resolve_episodes(self, cover_info, episodes=None):
+        """Extract the download info of the `episodes`, default to all, of the cover, but those already owned if the
+        catalog is configured.
+        """
+        normal_ids = cover_info['normal_ids']
+        episodes = normal_ids if episodes is None else episodes
+        if self.catalog is not None:
+            not_owned = self._find_owned_episodes(cover_info, episodes)
+            if len(not_owned) < len(episodes):
+                self._logger.info('{} of the episodes are already owned: {}'.format(len(episodes) - len(not_owned),
+                                                                                    cover_info['url']))
+            episodes = not_owned
+
+        vci = self._get_vc_instance(self._vcs[cover_info['vc_name']])
+        cover_info['normal_ids'] = episodes
+        try:
+            vci.update_video_dwnld_info(cover_info)
+        finally:
+            cover_info['normal_ids'] = normal_ids
+
+    def _extract_metadata(self, url, site_limit, probe_defns):
+        meta = {'url': url}
+        try:
+            with site_limit:
+                cover_info = self.extract_config_info(url, dwnld_info=probe_defns, skip_owned=False)
+        except Exception as e:
+            meta['error'] = repr(e)
+            return meta
+
+        if not cover_info:
+            meta['error'] = 'No video info extracted'
+            return meta
+
+        normal_ids = cover_info.get('normal_ids') or []
+        meta.update(site=cover_info['vc_name'], title=cover_info.get('title'), year=cover_info.get('year'),
+                    type=cover_info.get('type'), cover_id=cover_info.get('cover_id'),
+                    episode_all=cover_info.get('episode_all'), episodes=len(normal_ids))
+        if probe_defns:
+            defns = set(defn for vi in normal_ids for defn, fmts in (vi.get('defns') or {}).items() if fmts)
+            meta['definitions'] = [defn for defn in VIDEO_DEFINITIONS if defn in defns]
+
+        return meta
+
+    def dump_metadata(self, urls, out=None, probe_defns=False):
+        """Extract the cover metadata of the `urls` concurrently, without downloading any video, and write them out as
+        JSON Lines in the order of completion.
+
+        The number of concurrent extractions for each site is limited to its ``metadata_concurrency`` configuration.
         """
+        out = out or sys.stdout
+
+        concurrency = {name: int(self.confs[name].get('metadata_concurrency') or 8) for name in self._vcs}
+        site_limits = {name: threading.BoundedSemaphore(limit) for name, limit in concurrency.items()}
+        max_workers = sum(concurrency.values())
+
+        done = failed = 0
+        time_start = time_report = time.monotonic()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = set()
+            for url in urls:
+                name = self.site_of(url)
+                if name is None:
+                    self._logger.error("Video URL {!r} is invalid".format(url))
+                    continue
+
+                futures.add(executor.submit(self._extract_metadata, url, site_limits[name], probe_defns))
+                # bound the pending jobs so as to keep the memory usage flat for huge URL lists
+                if len(futures) >= max_workers * 4:
+                    finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for fut in finished:
+                        meta = fut.result()
+                        failed += 'error' in meta
+                        out.write(json.dumps(meta, ensure_ascii=False) + '\n')
+                    out.flush()
+                    done += len(finished)
+
+                    now = time.monotonic()
+                    if now - time_report >= 10:
+                        time_report = now
+                        self._logger.info('Extracted {} covers, {:.2f} covers/s'.format(done, done / (now - time_start)))
+
+            for fut in as_completed(futures):
+                meta = fut.result()
+                failed += 'error' in meta
+                out.write(json.dumps(meta, ensure_ascii=False) + '\n')
+                out.flush()
+                done += 1
+
+        elapsed = time.monotonic() - time_start
+        self._logger.info('Extracted {} covers ({} failed) in {:.1f}s, {:.2f} covers/s'.format(
+            done, failed, elapsed, done / elapsed if elapsed else 0))
+
+    def plan_episodes(self, cover_info, save_dir='.', defn=None, dropped=None):
+        """Work out where to save the episodes of the cover and which files of them to download. The episodes known to
+        end before the "--start" time are left out, and appended to the list `dropped` if any.
+
         :returns:
-        (abs_cover_dir, [(abs_episode1_dir, [fname1.1.mp4, fname1.2.mp4]),(abs_episode2_dir, [fname2.1.mp4, fname2.2.mp4])])
+        (abs_cover_dir, iterator of Episode(abs_episode_dir, [fname1.mp4, fname2.mp4], [url1, url2])),
+        with the episodes being planned lazily as the iterator is consumed.
         """
 
         def pick_highest_definition(defns):
@@ -83,92 +476,360 @@ class MDownloader(object):
                 width = ndigits
 
             normal_ids = cover_info.get('normal_ids', [])
-            ep_cnt = sum([1 for vi in normal_ids if vi.get('defns') and any(vi['defns'].values())])  # number of valid episodes
+            ep_cnt = sum([1 for vi in normal_ids if vi.get('owned') or vi.get('synced') or (vi.get('defns') and any(vi['defns'].values()))])  # number of valid episodes
             numbering = False if (total_ep and total_ep == 1) or (not total_ep and ep_cnt == 1) else True
 
             return numbering, width
 
-        video_list = cover_info.get('normal_ids')
-        if video_list:
-            cover_name = '.'.join([cover_info.get('title') if cover_info.get('title') else cover_info['source_name'] + '_' + cover_info.get('cover_id', ''),
-                                   cover_info.get('year', DEFAULT_YEAR)])
-            cover_name = normalize_filename(cover_name, repl='_')
-            cover_default_dir = '.'.join([cover_name, cover_info.get('type', VideoTypes.MOVIE)])
-            cover_dir = os.path.abspath(os.path.join(save_dir, cover_default_dir))
+        def name_episode_dir(vi, defn_chosen):
+            if ep_fmt_numbering:
+                ep_name = vi.get('title')
+                ep_name = '-({})'.format(ep_name) if ep_name else ''
 
-            urls = []  # URLs file info for aria2c
-            episodes = []  # [(abs_episode1_dir, [fname1.1.mp4, fname1.2.mp4]), ]
+                episode_default_dir = '.'.join(
+                    [cover_name, 'EP' + '{:0{width}}'.format(vi['E'], width=ep_fmt_width) + ep_name,
+                     'WEBRip', cover_info['source_name'] + '_' + defn_chosen])
+            else:
+                episode_default_dir = '.'.join([cover_name, 'WEBRip', cover_info['source_name'] + '_' + defn_chosen])
 
-            ep_fmt_numbering, ep_fmt_width = determine_ep_naming_fmt()
+            return os.path.join(cover_dir, episode_default_dir)
 
+        def gen_episodes():
+            defn_chosen = defn
             for vi in video_list:
-                if vi.get('defns') and any(vi['defns'].values()):
-                    if not (defn and vi['defns'].get(defn)):
-                        defn = pick_highest_definition(vi['defns'])
-                    if ep_fmt_numbering:
-                        ep_name = vi.get('title')
-                        ep_name = '-({})'.format(ep_name) if ep_name else ''
-
-                        episode_default_dir = '.'.join(
-                            [cover_name, 'EP' + '{:0{width}}'.format(vi['E'], width=ep_fmt_width) + ep_name,
-                             'WEBRip', cover_info['source_name'] + '_' + defn])
-                    else:
-                        episode_default_dir = '.'.join([cover_name, 'WEBRip', cover_info['source_name'] + '_' + defn])
-                    episode_dir = os.path.join(cover_dir, episode_default_dir)
-
-                    format = pick_format(vi['defns'][defn])
+                if vi.get('owned'):
+                    self._link_owned_episode(vi['owned'], name_episode_dir(vi, vi['owned']['defn']))
+                elif vi.get('defns') and any(vi['defns'].values()):
+                    if not (defn_chosen and vi['defns'].get(defn_chosen)):
+                        defn_chosen = pick_highest_definition(vi['defns'])
+                    episode_dir = name_episode_dir(vi, defn_chosen)
+
+                    format = pick_format(vi['defns'][defn_chosen])
                     ext = format['ext']
+                    urls = format['urls']
+
+                    first, stop, clip = 0, len(urls), None
+                    if clip_start is not None or clip_end is not None:
+                        durations = getattr(urls, 'durations', None)
+                        if durations:
+                            # download only the segments covering the time range
+                            first, stop, offset = select_segments(durations, clip_start, clip_end)
+                            if first == stop:
+                                self._logger.error('The time range starts at or past the end of the episode ({:.3f}s), '
+                                                   'not downloaded. <{}>'.format(sum(durations), episode_dir))
+                                if dropped is not None:
+                                    dropped.append(Episode(episode_dir, vid=vi['V'], defn=defn_chosen))
+                                continue
+                            urls = urls[first:stop]
+                        else:
+                            offset = clip_start or 0.0
+                        clip = (offset, clip_end - (clip_start or 0.0) if clip_end is not None else None)
+
+                    # fname ~ seg_0000.mp4 seg_0001.mp4 seg_0002.mp4 ...
+                    fnames = ["seg_{:04}.{}".format(idx, ext) for idx in range(first, stop)]
+
+                    yield Episode(episode_dir, fnames, urls, clip, vid=vi['V'], defn=defn_chosen)
 
-                    fnames = []
-                    for idx, url in enumerate(format['urls']):
-                        # fname ~ seg_0000.mp4 seg_0001.mp4 seg_0002.mp4 ...
-                        fname = "seg_{:04}.{}".format(idx, ext)
-                        fnames.append(fname)
-                        urls.append('{}\n  dir={}\n  out={}'.format(url, episode_dir, fname))
-
-                    episodes.append((episode_dir, fnames))
-
-            urllist = '\n'.join(urls)
-
-            if not urllist:
-                self._logger.warning("No files to download for '{}'.".format(cover_info['url']))
-                return "", []
-
-            aria2c = self.confs['progs']['aria2c']
-            user_agent = self.confs[cover_info['vc_name']]['user_agent']
-            proxy = self.confs[cover_info['vc_name']]['proxy'] \
-                if self.confs[cover_info['vc_name']]['enable_proxy_dl_video'].lower() == "true" else ''
-            mcd = self.confs[cover_info['vc_name']]['max_concurrent_downloads']
-            mss = self.confs[cover_info['vc_name']]['min_split_size']
-            split = self.confs[cover_info['vc_name']]['split']
-            mcps = self.confs[cover_info['vc_name']]['max_connection_per_server']
-            retry_wait = self.confs[cover_info['vc_name']]['retry_wait']
-            speed_limit = self.confs[cover_info['vc_name']]['lowest_speed_limit']
-            referer = cover_info['referrer']
-
-            cmd_aria2c = [aria2c, '-c', '-j', mcd,  '-k', mss, '-s', split, '-x', mcps, '--max-file-not-found=5000', '-m0',
-                          '--retry-wait', retry_wait, '--lowest-speed-limit', speed_limit, '--no-conf', '-i-',
-                          '--console-log-level=warn', '--download-result=hide', '--summary-interval=0', '--uri-selector=adaptive',
-                          '--referer', referer, '--ca-certificate', cert_path, '-U', user_agent, '--all-proxy', proxy,
-                          '--retry-on-400=true', '--retry-on-403=true', '--retry-on-406=true', '--retry-on-unknown=true']
-            try:
-                with logging_with_pipe(self._logger, level=logging.INFO, text=True) as log_pipe:
-                    with subprocess.Popen(cmd_aria2c, bufsize=1, universal_newlines=True, encoding='utf-8',
-                                          stdin=subprocess.PIPE, stdout=log_pipe, stderr=subprocess.STDOUT) as proc:
-                        proc.stdin.write(urllist)
-                        proc.stdin.close()
-            except OSError as e:
-                self._logger.error("OS error number {}: '{}'".format(e.errno, e.strerror))
-
-            if not proc.returncode:
-                return cover_dir, episodes
-        else:
-            self._logger.warning("No files to download for '{}'.".format(cover_info['url']))
+        video_list = cover_info.get('normal_ids')
+        if not video_list:
+            return "", iter(())
+
+        cover_name = '.'.join([cover_info.get('title') if cover_info.get('title') else cover_info['source_name'] + '_' + cover_info.get('cover_id', ''),
+                               cover_info.get('year', DEFAULT_YEAR)])
+        cover_name = normalize_filename(cover_name, repl='_')
+        cover_default_dir = '.'.join([cover_name, cover_info.get('type', VideoTypes.MOVIE)])
+        cover_dir = os.path.abspath(os.path.join(save_dir, cover_default_dir))
+
+        clip_start, clip_end = getattr(self.args, 'start', None), getattr(self.args, 'end', None)
+
+        ep_fmt_numbering, ep_fmt_width = determine_ep_naming_fmt()
+
+        return cover_dir, gen_episodes()
+
+    def _link_owned_episode(self, entry, episode_dir):
+        """Hard-link the video file of the owned episode to where it would be saved after being joined"""
+        from .catalog import link_file
+
+        episode_name = episode_dir + os.path.splitext(entry['path'])[1]
+        try:
+            if link_file(entry['path'], episode_name):
+                self._logger.info("Linked the owned episode '{}' to '{}'.".format(entry['path'], episode_name))
+        except OSError as e:
+            self._logger.error("Failed to link the owned episode '{}': {}".format(entry['path'], e))
+
+    def dwnld_videos_with_aria2(self, cover_info, save_dir='.', defn=None, joiner=None, dropped=None):
+        """
+        `dropped` collects the episodes out of the time range, see :meth:`plan_episodes`, and the first episode
+        dropped for the lack of space, see :meth:`_dwnld_episodes_with_aria2`, if not ``None``.
+
+        :returns:
+        (abs_cover_dir, [Episode(abs_episode1_dir, [fname1.1.mp4, fname1.2.mp4]), Episode(abs_episode2_dir, [fname2.1.mp4, fname2.2.mp4])])
+        """
+        cover_dir, planned = self.plan_episodes(cover_info, save_dir=save_dir, defn=defn, dropped=dropped)
+        vc_name = cover_info['vc_name']
+
+        if cover_dir and all(vi.get('owned') or vi.get('synced') for vi in cover_info['normal_ids']):
+            for _ in planned:  # just link the owned episodes into the cover directory
+                pass
+            return cover_dir, []
+
+        episodes = self._dwnld_episodes_with_aria2(planned, vc_name, cover_info['referrer'],
+                                                   self.confs[vc_name]['user_agent'], cover_info['url'], joiner=joiner,
+                                                   dropped=[] if dropped is None else dropped)
+        if episodes is not None:
+            return cover_dir, episodes
 
         return "", []
 
-    def join_videos_with_ffmpeg_mkvmerge(self, cover_dir, episode_dir, fnames):
-        """abs_cover_dir > abs_episode_dir > video files """
+    def _dwnld_episodes_with_aria2(self, episodes, vc_name, referer, user_agent, name, joiner=None, stop=None,
+                                   dropped=None):
+        """Download the files of the `episodes` with aria2c, the site-specific options of which being taken from the
+        configuration of the site `vc_name`. Unless `dropped` is ``None``, e.g. for the repairs, the free space is
+        checked for each episode before it's fed, see :meth:`_space_checker`, and the first episode dropped for the
+        lack of space, if any, gets appended to `dropped`, with the later ones left unresolved. The episodes are
+        staged in the scratch directory, if admitted, and handed over to the stream `joiner` as they are fed. aria2c
+        gets terminated once the event `stop`, if any, is set.
+
+        :returns: the list of the episodes fed to aria2c if succeeded, otherwise ``None``.
+        """
+        fits = self._space_checker(vc_name, referer, user_agent, name) if dropped is not None else None
+
+        fed_episodes = []
+        staged_episodes = []
+        monitor = None
+        if self.progress is not None or joiner is not None:
+            from .progress import Aria2Monitor, free_port
+            rpc_port, rpc_secret = free_port(), binascii.hexlify(os.urandom(16)).decode('ascii')
+            monitor = Aria2Monitor(rpc_port, rpc_secret, self.progress, name)
+            if joiner is not None:
+                joiner.watch(monitor.is_complete)  # the segments reported complete by aria2c are ready to join
+
+        allocations = {}  # cover directory -> "file-allocation" of aria2c suited to its filesystem
+
+        def gen_aria2_input():
+            """Yield aria2c input file entries episode by episode, collecting the episodes along the way. The file
+            allocation is chosen for each episode, which may be staged in the scratch directory or spilled over to the
+            save directory on another filesystem.
+            """
+            for episode in episodes:
+                if fits is not None and not fits(episode):
+                    dropped.append(episode)
+                    break
+                fed_episodes.append(episode)
+                cover_dir = os.path.dirname(episode.dir)
+                if self.scratch is not None and self.scratch.stage(episode):
+                    staged_episodes.append(episode)
+                if joiner is not None:
+                    joiner.add(episode, cover_dir)
+                if monitor is not None:
+                    monitor.add(episode)
+                    self._emit('episode_resolved', url=name, vid=episode.vid, defn=episode.defn, dir=episode.dir,
+                               files=len(episode.fnames), bytes_total=expected_size(episode))
+                staged_cover_dir = os.path.dirname(episode.dir)
+                if staged_cover_dir not in allocations:
+                    allocations[staged_cover_dir] = file_allocation(staged_cover_dir)
+                allocation = allocations[staged_cover_dir]
+                for fname, url in zip(episode.fnames, episode.urls):
+                    yield '{}\n  dir={}\n  out={}\n'.format(url, episode.dir, fname) + \
+                        ('  file-allocation={}\n'.format(allocation) if allocation else '')
+
+        # URLs file info for aria2c, generated lazily and fed incrementally
+        aria2_input = gen_aria2_input()
+        try:
+            first_entry = next(aria2_input, None)
+        except OSError as e:  # e.g. short of space, or failed staging the episode
+            self._logger.error("OS error number {}: '{}'".format(e.errno, e.strerror))
+            self._hand_off(staged_episodes)
+            return None
+        if first_entry is None:
+            self._logger.warning("No files to download for '{}'.".format(name))
+            return None
+
+        aria2c = self.confs['progs']['aria2c']
+        proxy = self.confs[vc_name]['proxy'] if self.confs[vc_name]['enable_proxy_dl_video'].lower() == "true" else ''
+        mcd = self.confs[vc_name]['max_concurrent_downloads']
+        mss = self.confs[vc_name]['min_split_size']
+        split = self.confs[vc_name]['split']
+        mcps = self.confs[vc_name]['max_connection_per_server']
+        retry_wait = self.confs[vc_name]['retry_wait']
+        speed_limit = self.confs[vc_name]['lowest_speed_limit']
+
+        cmd_aria2c = [aria2c, '-c', '-j', mcd,  '-k', mss, '-s', split, '-x', mcps, '--max-file-not-found=5000', '-m0',
+                      '--retry-wait', retry_wait, '--lowest-speed-limit', speed_limit, '--no-conf', '-i-', '--deferred-input=true',
+                      '--console-log-level=warn', '--download-result=hide', '--summary-interval=0', '--uri-selector=adaptive',
+                      '--referer', referer, '--ca-certificate', cert_path, '-U', user_agent, '--all-proxy', proxy,
+                      '--retry-on-400=true', '--retry-on-403=true', '--retry-on-406=true', '--retry-on-unknown=true']
+        if monitor is not None:
+            cmd_aria2c += ['--enable-rpc=true', '--rpc-listen-port', str(rpc_port), '--rpc-secret', rpc_secret]
+        proc = None
+        try:
+            with logging_with_pipe(self._logger, level=logging.INFO, text=True) as log_pipe:
+                with subprocess.Popen(cmd_aria2c, universal_newlines=True, encoding='utf-8',
+                                      stdin=subprocess.PIPE, stdout=log_pipe, stderr=subprocess.STDOUT) as proc:
+                    if monitor is not None:
+                        monitor.start()
+                    fed = False
+                    try:
+                        if stop is not None:
+                            threading.Thread(target=_terminate_on, args=(proc, stop), daemon=True).start()
+                        # the blocking writes to the pipe throttle the generation of the entries, while aria2c reads
+                        # them only as needed and starts downloading before the whole list has been generated
+                        try:
+                            proc.stdin.write(first_entry)
+                            for entry in aria2_input:
+                                proc.stdin.write(entry)
+                            proc.stdin.close()
+                        except BrokenPipeError:
+                            self._logger.error("aria2c exited unexpectedly before reading the whole input.")
+                        fed = True
+                    finally:
+                        if not fed:  # failed generating the input, e.g. staging an episode
+                            proc.terminate()
+                            try:
+                                proc.stdin.close()
+                            except OSError:
+                                pass
+                        if monitor is not None:
+                            monitor.finish(proc)  # aria2c keeps running with RPC enabled until shut down
+        except OSError as e:
+            self._logger.error("OS error number {}: '{}'".format(e.errno, e.strerror))
+
+        if proc and not proc.returncode and not (monitor is not None and monitor.errors):
+            return fed_episodes
+
+        self._hand_off(staged_episodes)
+        return None
+
+    def _hand_off(self, episodes):
+        """Move the `episodes` staged in the scratch directory but not to be joined back into the save directory"""
+        if self.scratch is not None:
+            for episode in episodes:
+                self.scratch.hand_off(episode)
+
+    def _space_checker(self, vc_name, referer, user_agent, name):
+        """The check of the free space of the save directory for the episodes fed one by one, as per the 'low_space'
+        policy configured: 'fail' to give up the download once short of space, 'throttle' to download only the
+        leading episodes that fit, or 'ignore'.
+
+        :returns: the function telling whether the episode fits, raising ``OSError`` if short of space and the policy
+            is 'fail', or ``None`` if ignored.
+        """
+        policy = self.confs['misc'].get('low_space') or 'fail'
+        if policy == 'ignore':
+            return None
+
+        from .preflight import SpaceBudget, estimate_size
+
+        budget = None
+        session = None
+
+        def fits(episode):
+            nonlocal budget, session
+            if budget is None:
+                budget = SpaceBudget(os.path.dirname(episode.dir))
+            size = expected_size(episode)
+            if size is None:  # sample its files
+                if session is None:
+                    from bdownload.download import requests_retry_session
+
+                    session = requests_retry_session()
+                    session.headers.update({'Referer': referer, 'User-Agent': user_agent})
+                    proxy = self.confs[vc_name]['proxy'] \
+                        if self.confs[vc_name]['enable_proxy_dl_video'].lower() == "true" else ''
+                    if proxy:
+                        session.proxies = dict(http=proxy, https=proxy)
+                size = estimate_size(episode, session)
+
+            if budget.admit(size):
+                return True
+
+            msg = "Short of disk space in '{}' for '{}': {:.1f} MiB needed and {:.1f} MiB free".format(
+                budget.path, name, budget.required(size) / 1024 ** 2, budget.free / 1024 ** 2)
+            if policy == 'throttle':
+                self._logger.error(msg + ', the rest of the episodes dropped.')
+                return False
+            raise OSError(errno.ENOSPC, msg + ', download given up')
+
+        return fits
+
+    def verify_episodes(self, episodes, vc_name, referer, user_agent, name, retries=2):
+        """Verify the downloaded segments of the `episodes`, and re-download the corrupted ones up to `retries` times.
+
+        :returns: the list of the episodes still with corrupted segments.
+        """
+        from .verify import find_corrupted_segments
+
+        corrupted = find_corrupted_segments(episodes)
+        for _ in range(retries):
+            if not corrupted:
+                break
+
+            repairs = []
+            for episode, bad in corrupted:
+                for idx, reason in bad:
+                    self._logger.warning("Corrupted segment '{}' ({}), re-downloading.".format(
+                        os.path.join(episode.dir, episode.fnames[idx]), reason))
+                    for fn in (episode.fnames[idx], episode.fnames[idx] + '.aria2'):
+                        try:
+                            os.remove(os.path.join(episode.dir, fn))
+                        except OSError:
+                            pass
+
+                idxs = [idx for idx, _ in bad]
+                repairs.append(Episode(episode.dir, [episode.fnames[idx] for idx in idxs],
+                                       [episode.urls[idx] for idx in idxs]))
+
+            self._dwnld_episodes_with_aria2(repairs, vc_name, referer, user_agent, name)
+            retried = [episode for episode, _ in corrupted]
+            corrupted = find_corrupted_segments(retried, [[idx for idx, _ in bad] for _, bad in corrupted])
+
+        for episode, bad in corrupted:
+            self._logger.error('{} corrupted segments, not joined! <{}>'.format(len(bad), episode.dir))
+
+        return [episode for episode, _ in corrupted]
+
+    def _concat_mp4(self, episode_dir, fnames, episode_name):
+        """Join the MP4 parts in-process, see :func:`.mp4.concat_mp4`
+
+        :returns: ``True`` if succeeded, ``False`` if the parts should be joined otherwise.
+        """
+        from struct import error as struct_error
+        from .mp4 import concat_mp4, MP4Error
+
+        try:
+            concat_mp4([os.path.join(episode_dir, fn) for fn in fnames], episode_name)
+        except (MP4Error, struct_error, OSError) as e:
+            self._logger.warning("Failed to join the MP4 parts in-process ({}), falling back to mkvmerge/ffmpeg. "
+                                 "<{}>".format(e, episode_dir))
+            return False
+
+        return True
+
+    def _fmp4_opts(self, episode_name):
+        """Output options of ffmpeg for the fragmented MP4 in "--fmp4" mode, which is playable while still being written,
+        if the video file `episode_name` is an MP4 one, e.g. not for the MPEG-PS streams kept as they are
+        """
+        if not getattr(self.args, 'fmp4', False) or not episode_name.endswith('.mp4'):
+            return []
+
+        return ['-movflags', FMP4_MOVFLAGS, '-f', 'mp4']
+
+    def _ffmpeg_join_cmd(self, episode_name, clip=None):
+        """Command of ffmpeg joining the segments fed through its stdin into the video file `episode_name`"""
+        ffmpeg = self.confs['progs']['ffmpeg']
+        trim = []
+        if clip:
+            offset, duration = clip
+            trim = ['-ss', '{:.3f}'.format(offset)] + (['-t', '{:.3f}'.format(duration)] if duration is not None else [])
+
+        return ([ffmpeg, '-y', '-i', 'pipe:0'] + trim + ['-safe', '0', '-c', 'copy', '-hide_banner'] +
+                self._fmp4_opts(episode_name) + [episode_name])
+
+    def join_videos_with_ffmpeg_mkvmerge(self, cover_dir, episode_dir, fnames, clip=None):
+        """abs_cover_dir > abs_episode_dir > video files
+
+        :returns: the path to the joined video file if succeeded.
+        """
 
         if cover_dir and episode_dir and fnames:
             # determine the extension (i.e. video format)
@@ -191,8 +852,7 @@ class MDownloader(object):
                     cmd = ['ffmpeg', '-y', '-i', 'pipe:0', '-safe', '0', '-c', 'copy', '-hide_banner', episode_name]
                     proc = subprocess.run(cmd, input=tmpf.read())
                 '''
-                ffmpeg = self.confs['progs']['ffmpeg']
-                cmd = [ffmpeg, '-y', '-i', 'pipe:0', '-safe', '0', '-c', 'copy', '-hide_banner', episode_name]
+                cmd = self._ffmpeg_join_cmd(episode_name, clip)
                 try:
                     with logging_with_pipe(self._logger, level=logging.INFO) as log_pipe:
                         with subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=log_pipe, stderr=subprocess.STDOUT) as proc:
@@ -210,25 +870,50 @@ class MDownloader(object):
                 except OSError as e:
                     self._logger.error("OS error number {}: '{}'".format(e.errno, e.strerror))
             else:
-                if len(fnames) > 1:
-                    '''
-                    flist = ["file '{}'".format(os.path.join(episodedir, fn)) for fn in fnames]
-                    flist = '\n'.join(flist)
-    
-                    cmd = ['ffmpeg', '-y', '-safe', '0', '-protocol_whitelist', 'file,pipe', '-f', 'concat',
-                           '-i', 'pipe:0', '-c', 'copy', '-hide_banner', episode_name]
-                    cp = subprocess.run(cmd, input=flist.encode('utf-8'))
-                    '''
-                    flist = ["{}".format(os.path.join(episode_dir, fn)) for fn in fnames]
-                    episode_name = episode_name.rpartition('.')[0] + '.mkv'
-
-                    mkvmerge = self.confs['progs']['mkvmerge']
-                    cmd = [mkvmerge, '-o', episode_name, '['] + flist + [']']
+                if clip:
+                    self._logger.warning("Trimming is only supported for the segmented streams, "
+                                         "the whole video is kept. <{}>".format(episode_dir))
+                toolchain = self.confs.get('toolchain', {})
+                fmp4 = getattr(self.args, 'fmp4', False) and ('ffmpeg' not in toolchain or
+                                                              has_cap(toolchain, 'ffmpeg', 'concat_demuxer'))
+                if len(fnames) > 1 and suffix == '.mp4' and not fmp4 and self._concat_mp4(episode_dir, fnames, episode_name):
+                    return episode_name
+                elif len(fnames) > 1 or (fmp4 and suffix == '.mp4'):
+                    if len(fnames) == 1:
+                        # remux the single MP4 file into fragmented MP4, rather than just moving it
+                        ffmpeg = self.confs['progs']['ffmpeg']
+                        cmd = [ffmpeg, '-y', '-i', os.path.join(episode_dir, fnames[0]), '-c', 'copy', '-hide_banner'] + \
+                            self._fmp4_opts(episode_name) + [episode_name]
+                        concat_list = None
+                    elif not fmp4 and ('mkvmerge' not in toolchain or has_cap(toolchain, 'mkvmerge', 'append')):
+                        flist = ["{}".format(os.path.join(episode_dir, fn)) for fn in fnames]
+                        episode_name = episode_name.rpartition('.')[0] + '.mkv'
+
+                        mkvmerge = self.confs['progs']['mkvmerge']
+                        cmd = [mkvmerge, '-o', episode_name, '['] + flist + [']']
+                        concat_list = None
+                    elif fmp4 or has_cap(toolchain, 'ffmpeg', 'concat_demuxer'):
+                        # fall back to the concat demuxer of FFmpeg, with the file list fed through the pipe
+                        concat_list = ["file '{}'".format(os.path.join(episode_dir, fn).replace("'", "'\\''")) for fn in fnames]
+                        concat_list = '\n'.join(concat_list) + '\n'
+                        if fmp4:
+                            episode_name = episode_name.rpartition('.')[0] + '.mp4'
+
+                        ffmpeg = self.confs['progs']['ffmpeg']
+                        cmd = [ffmpeg, '-y', '-safe', '0', '-protocol_whitelist', 'file,pipe', '-f', 'concat',
+                               '-i', 'pipe:0', '-c', 'copy', '-hide_banner'] + self._fmp4_opts(episode_name) + [episode_name]
+                    else:
+                        self._logger.error("Neither mkvmerge nor ffmpeg is capable of joining the videos. <{}>".format(episode_dir))
+                        return None
+
                     try:
                         with logging_with_pipe(self._logger, level=logging.INFO, text=True) as log_pipe:
                             with subprocess.Popen(cmd, bufsize=1, universal_newlines=True, encoding='utf-8',
+                                                  stdin=subprocess.PIPE if concat_list else None,
                                                   stdout=log_pipe, stderr=subprocess.STDOUT) as proc:
-                                pass
+                                if concat_list:
+                                    proc.stdin.write(concat_list)
+                                    proc.stdin.close()
                     except OSError as e:
                         self._logger.error("OS error number {}: '{}'".format(e.errno, e.strerror))
                 else:
@@ -236,16 +921,37 @@ class MDownloader(object):
                     fn_whole = os.path.join(episode_dir, fnames[0])
                     shutil.move(fn_whole, episode_name)
 
-                    return True
+                    return episode_name
 
             if proc and proc.returncode == 0:
-                return True
+                return episode_name
 
-    def join_videos(self, cover_dir, episodes):
-        for episode_dir, fnames in episodes:
-            if len(fnames) > 0:
-                res = self.join_videos_with_ffmpeg_mkvmerge(cover_dir, episode_dir, fnames)
+    def _finish_episode(self, episode, episode_name, site=None, joined=None):
+        """Clean up after the episode has been joined into `episode_name`, record it in the catalog if whole, and
+        append it to the list `joined` if any.
+        """
+        if self.scratch is not None:
+            self.scratch.release(episode)
+        shutil.rmtree(episode.dir, ignore_errors=True)
+        if site and episode.vid and episode.defn and not episode.clip and self.catalog is not None:
+            self.catalog.record(site, episode.vid, episode.defn, episode_name)
+        if joined is not None:
+            joined.append(episode)
+        self._emit('episode_joined', site=site, vid=episode.vid, path=episode_name)
+
+    def join_videos(self, cover_dir, episodes, site=None, joined=None):
+        """Join the files of the `episodes` and, if the catalog is configured, record the whole episodes of the `site`
+        in it. The episodes joined are appended to the list `joined` if any.
+        """
+        ok = True
+        for episode in episodes:
+            if len(episode.fnames) > 0:
+                res = self.join_videos_with_ffmpeg_mkvmerge(cover_dir, episode.dir, episode.fnames, clip=episode.clip)
                 if res:
-                    shutil.rmtree(episode_dir, ignore_errors=True)
+                    self._finish_episode(episode, res, site, joined)
                 else:
-                    self._logger.error('Join videos failed! <{}>'.format(episode_dir))
+                    self._logger.error('Join videos failed! <{}>'.format(episode.dir))
+                    self._hand_off([episode])
+                    ok = False
+
+        return ok
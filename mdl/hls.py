@@ -0,0 +1,256 @@
+"""A streaming parser for HLS (m3u8) master and media playlists.
+
+References:
+    https://datatracker.ietf.org/doc/html/rfc8216
+"""
+import re
+
+
+_ATTRIBUTE_RE = re.compile(r'\s*([A-Z0-9-]+)\s*=\s*("[^"]*"|[^",]*)\s*(?:,|$)')
+
+
+def parse_attribute_list(attrs):
+    """Parse the attribute list of a playlist tag into a dict, with quoted-string values unquoted.
+
+    >>> parse_attribute_list('BANDWIDTH=1280000,CODECS="avc1.4d401f,mp4a.40.2",RESOLUTION=1280x720')
+    {'BANDWIDTH': '1280000', 'CODECS': 'avc1.4d401f,mp4a.40.2', 'RESOLUTION': '1280x720'}
+    """
+    res = {}
+    for mo in _ATTRIBUTE_RE.finditer(attrs):
+        name, value = mo.group(1), mo.group(2)
+        if value.startswith('"'):
+            value = value[1:-1]
+        res[name] = value
+
+    return res
+
+
+class ByteRange(object):
+    __slots__ = ('length', 'offset')
+
+    def __init__(self, length, offset):
+        self.length = length
+        self.offset = offset
+
+    def __repr__(self):
+        return 'ByteRange({}@{})'.format(self.length, self.offset)
+
+
+class Key(object):
+    """Decryption info from the ``EXT-X-KEY`` tag"""
+    __slots__ = ('method', 'uri', 'iv', 'keyformat')
+
+    def __init__(self, method, uri=None, iv=None, keyformat=None):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.keyformat = keyformat
+
+    def __repr__(self):
+        return 'Key(method={!r}, uri={!r})'.format(self.method, self.uri)
+
+
+class Variant(object):
+    """A variant stream from the ``EXT-X-STREAM-INF`` tag in a master playlist"""
+    __slots__ = ('uri', 'bandwidth', 'average_bandwidth', 'resolution', 'codecs', 'frame_rate', 'attrs')
+
+    def __init__(self, uri, attrs):
+        self.uri = uri
+        self.attrs = attrs
+        self.bandwidth = int(attrs.get('BANDWIDTH') or 0)
+        self.average_bandwidth = int(attrs.get('AVERAGE-BANDWIDTH') or 0)
+        resolution = attrs.get('RESOLUTION', '').lower().split('x')
+        self.resolution = (int(resolution[0]), int(resolution[1])) if len(resolution) == 2 else None
+        self.codecs = attrs.get('CODECS')
+        self.frame_rate = float(attrs['FRAME-RATE']) if attrs.get('FRAME-RATE') else None
+
+    def __repr__(self):
+        return 'Variant({!r}, bandwidth={})'.format(self.uri, self.bandwidth)
+
+
+class Segment(object):
+    """A media segment with the tags applied to it"""
+    __slots__ = ('uri', 'duration', 'title', 'sequence', 'byterange', 'key', 'discontinuity')
+
+    def __init__(self, uri, duration, title='', sequence=0, byterange=None, key=None, discontinuity=False):
+        self.uri = uri
+        self.duration = duration
+        self.title = title
+        self.sequence = sequence
+        self.byterange = byterange
+        self.key = key
+        self.discontinuity = discontinuity
+
+    def __repr__(self):
+        return 'Segment({!r}, duration={})'.format(self.uri, self.duration)
+
+
+class MasterPlaylist(object):
+    __slots__ = ('variants', 'version')
+    is_master = True
+
+    def __init__(self, variants=None, version=None):
+        self.variants = variants if variants is not None else []
+        self.version = version
+
+    def best_variant(self):
+        """Pick the variant stream of the highest bandwidth, the first one winning the tie"""
+        best = None
+        for variant in self.variants:
+            if best is None or variant.bandwidth > best.bandwidth:
+                best = variant
+
+        return best
+
+
+class MediaPlaylist(object):
+    __slots__ = ('segments', 'target_duration', 'media_sequence', 'endlist', 'version')
+    is_master = False
+
+    def __init__(self, segments=None, target_duration=None, media_sequence=0, endlist=False, version=None):
+        self.segments = segments if segments is not None else []
+        self.target_duration = target_duration
+        self.media_sequence = media_sequence
+        self.endlist = endlist
+        self.version = version
+
+    @property
+    def duration(self):
+        return sum(seg.duration for seg in self.segments)
+
+    @property
+    def encrypted(self):
+        return any(seg.key is not None for seg in self.segments)
+
+    def resources(self):
+        """Distinct segment URIs in playlist order along with their durations, with the byte-range segments of the same
+        resource coalesced.
+
+        Returns:
+            tuple: A list of the URIs and a list of the corresponding durations.
+        """
+        uris, durations = [], []
+        for seg in self.segments:
+            if uris and seg.byterange is not None and uris[-1] == seg.uri:
+                durations[-1] += seg.duration
+            else:
+                uris.append(seg.uri)
+                durations.append(seg.duration)
+
+        return uris, durations
+
+
+def select_segments(durations, start=None, end=None):
+    """Select the consecutive segments covering the time range [`start`, `end`).
+
+    Args:
+        durations (sequence of float): Durations of the segments in seconds.
+        start (float): Start of the range in seconds, default to the beginning.
+        end (float): End of the range in seconds, default to the end.
+
+    Returns:
+        tuple: The index of the first segment, the index past the last segment, and the offset of `start` from the
+        beginning of the first segment.
+
+    >>> select_segments([10, 10, 10, 10], 15, 25)
+    (1, 3, 5.0)
+    >>> select_segments([10, 10, 10, 10], 30)
+    (3, 4, 0.0)
+    """
+    start = start or 0.0
+    first, stop = len(durations), len(durations)
+    offset = 0.0
+
+    pos = 0.0
+    for idx, dur in enumerate(durations):
+        if first == len(durations) and start < pos + dur:
+            first, offset = idx, start - pos
+        pos += dur
+        if end is not None and end <= pos:
+            stop = idx + 1
+            break
+
+    return first, max(first, stop), offset
+
+
+def parse_playlist(lines):
+    """Parse a master or media playlist in a single pass over its lines.
+
+    Args:
+        lines (iterable of str): Lines of the playlist, e.g. from ``requests.Response.iter_lines(decode_unicode=True)``.
+
+    Returns:
+        :class:`MasterPlaylist` if any variant stream is found, :class:`MediaPlaylist` otherwise.
+
+    >>> pl = parse_playlist(['#EXTM3U', '#EXT-X-TARGETDURATION:10', '#EXTINF:9.5,', 'a.ts', '#EXT-X-DISCONTINUITY',
+    ...                      '#EXTINF:4,', 'b.ts', '#EXT-X-ENDLIST'])
+    >>> pl.is_master, pl.segments, pl.segments[1].discontinuity, pl.duration
+    (False, [Segment('a.ts', duration=9.5), Segment('b.ts', duration=4.0)], True, 13.5)
+    """
+    variants = []
+    segments = []
+    version = None
+    target_duration = None
+    media_sequence = 0
+    endlist = False
+
+    stream_inf = None  # attributes of the pending EXT-X-STREAM-INF
+    duration, title = None, ''
+    byterange = None
+    next_offset = {}  # uri -> offset following the last sub-range
+    key = None
+    discontinuity = False
+
+    for line in lines:
+        line = line.strip() if line else line
+        if not line:
+            continue
+
+        if line.startswith('#'):
+            tag, _, value = line.partition(':')
+            if tag == '#EXTINF':
+                dur, _, title = value.partition(',')
+                duration = float(dur or 0)
+            elif tag == '#EXT-X-BYTERANGE':
+                length, _, offset = value.partition('@')
+                byterange = (int(length), int(offset) if offset else None)
+            elif tag == '#EXT-X-KEY':
+                attrs = parse_attribute_list(value)
+                method = attrs.get('METHOD', 'NONE')
+                key = None if method == 'NONE' else \
+                    Key(method, uri=attrs.get('URI'), iv=attrs.get('IV'), keyformat=attrs.get('KEYFORMAT'))
+            elif tag == '#EXT-X-DISCONTINUITY':
+                discontinuity = True
+            elif tag == '#EXT-X-STREAM-INF':
+                stream_inf = parse_attribute_list(value)
+            elif tag == '#EXT-X-TARGETDURATION':
+                target_duration = int(value)
+            elif tag == '#EXT-X-MEDIA-SEQUENCE':
+                media_sequence = int(value)
+            elif tag == '#EXT-X-VERSION':
+                version = int(value)
+            elif tag == '#EXT-X-ENDLIST':
+                endlist = True
+            # other tags and comments are ignored
+        elif stream_inf is not None:
+            variants.append(Variant(line, stream_inf))
+            stream_inf = None
+        else:
+            br = None
+            if byterange is not None:
+                length, offset = byterange
+                offset = offset if offset is not None else next_offset.get(line, 0)
+                br = ByteRange(length, offset)
+                next_offset[line] = offset + length
+
+            segments.append(Segment(line, duration or 0.0, title=title, sequence=media_sequence + len(segments),
+                                    byterange=br, key=key, discontinuity=discontinuity))
+            duration, title = None, ''
+            byterange = None
+            discontinuity = False
+
+    if variants:
+        return MasterPlaylist(variants, version=version)
+
+    return MediaPlaylist(segments, target_duration=target_duration, media_sequence=media_sequence, endlist=endlist,
+                         version=version)
@@ -0,0 +1,159 @@
+"""Compact containers for the video download info held in ``cover_info``."""
+from array import array
+
+
+class MirroredURLs(object):
+    """Segment URLs of a video format sharing one table of mirror URL prefixes.
+
+    Rather than keeping, for every segment, a string of all the mirror URLs joined by tabs, the prefixes are stored
+    only once per format, along with the segment URL tails (e.g. file names, optionally followed by a query string).
+    The full mirror URLs of a segment are materialized on demand, i.e. when they are about to be fed to the downloader.
+
+    It behaves like a read-only sequence of tab-separated mirror URL strings, e.g.
+
+    >>> urls = MirroredURLs(['https://a.com/', 'https://b.com/'], ['v.1.ts', 'v.2.ts'])
+    >>> len(urls), urls[1]
+    (2, 'https://a.com/v.2.ts\\thttps://b.com/v.2.ts')
+    >>> urls.mirrors(0)
+    ['https://a.com/v.1.ts', 'https://b.com/v.1.ts']
+
+    The playing durations of the segments in seconds, e.g. from the ``EXTINF`` tags of an HLS media playlist, may go
+    along with the tails, in which case only part of a video can be downloaded. So may the file sizes of the segments
+    in bytes, against which the downloaded segments get verified.
+    """
+    __slots__ = ('prefixes', 'tails', 'durations', 'sizes')
+
+    def __init__(self, prefixes, tails=None, durations=None, sizes=None):
+        self.prefixes = tuple(prefixes)
+        self.tails = list(tails) if tails is not None else []
+        self.durations = array('d', durations) if durations is not None else None
+        self.sizes = None
+        self.set_sizes(sizes)
+
+    def append(self, tail):
+        self.tails.append(tail)
+
+    def set_sizes(self, sizes):
+        """Set the file sizes of the segments, which are dropped unless all of them are known"""
+        if sizes is not None and all(isinstance(size, int) and size > 0 for size in sizes):
+            self.sizes = array('q', sizes)
+        else:
+            self.sizes = None
+
+    def mirrors(self, idx):
+        tail = self.tails[idx]
+        return [prefix + tail for prefix in self.prefixes]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return MirroredURLs(self.prefixes, self.tails[idx],
+                                self.durations[idx] if self.durations is not None else None,
+                                self.sizes[idx] if self.sizes is not None else None)
+
+        return '\t'.join(self.mirrors(idx))
+
+    def __len__(self):
+        return len(self.tails)
+
+    def __iter__(self):
+        for idx in range(len(self.tails)):
+            yield self[idx]
+
+    def to_dict(self):
+        dic = {'prefixes': list(self.prefixes), 'tails': self.tails}
+        if self.durations is not None:
+            dic['durations'] = self.durations.tolist()
+        if self.sizes is not None:
+            dic['sizes'] = self.sizes.tolist()
+
+        return dic
+
+    @classmethod
+    def from_dict(cls, dic):
+        return cls(dic['prefixes'], dic['tails'], dic.get('durations'), dic.get('sizes'))
+
+    def __repr__(self):
+        return '{}(prefixes={!r}, segments={})'.format(type(self).__name__, self.prefixes, len(self.tails))
+
+
+class Episode(object):
+    """Files of an episode to be downloaded into its own directory and then joined.
+
+    ``urls`` is a sequence of the (tab-separated mirror) URLs of the files ``fnames``, in the same order.
+
+    ``clip`` is either ``None`` or a tuple of the offset and duration in seconds (``None`` for till the end), by which
+    the joined video gets trimmed, measured from the beginning of the first downloaded segment.
+
+    ``vid`` and ``defn`` are the video ID and the definition of the episode on the site, respectively.
+    """
+    __slots__ = ('dir', 'fnames', 'urls', 'clip', 'vid', 'defn')
+
+    def __init__(self, dir, fnames=None, urls=None, clip=None, vid=None, defn=None):
+        self.dir = dir
+        self.fnames = fnames if fnames is not None else []
+        self.urls = urls if urls is not None else []
+        self.clip = clip
+        self.vid = vid
+        self.defn = defn
+
+    def to_dict(self):
+        urls = self.urls.to_dict() if isinstance(self.urls, MirroredURLs) else list(self.urls)
+        return {'dir': self.dir, 'fnames': self.fnames, 'urls': urls, 'clip': self.clip,
+                'vid': self.vid, 'defn': self.defn}
+
+    @classmethod
+    def from_dict(cls, dic):
+        urls = dic['urls']
+        urls = MirroredURLs.from_dict(urls) if isinstance(urls, dict) else urls
+        clip = tuple(dic['clip']) if dic.get('clip') else None
+        return cls(dic['dir'], dic['fnames'], urls, clip, vid=dic.get('vid'), defn=dic.get('defn'))
+
+    def __repr__(self):
+        return 'Episode({!r}, files={})'.format(self.dir, len(self.fnames))
+
+
+class LazyEpisodeList(object):
+    """Read-only sequence of the episode info dicts (i.e. the items of ``cover_info['normal_ids']``), each of which is
+    made out of the raw item, e.g. from the listing of a web page, only upon the first access to it.
+
+    ``make`` is called as ``make(ep, item)`` with the episode number counting from 1 and the raw item. The dicts made
+    are cached, so that the updates to them are kept.
+
+    >>> eps = LazyEpisodeList(['a', 'b', 'c'], lambda ep, item: {'V': item, 'E': ep})
+    >>> len(eps), eps[-1], eps[1:]
+    (3, {'V': 'c', 'E': 3}, [{'V': 'b', 'E': 2}, {'V': 'c', 'E': 3}])
+    """
+    __slots__ = ('_items', '_make', '_episodes')
+
+    def __init__(self, items, make):
+        self._items = items
+        self._make = make
+        self._episodes = [None] * len(items)
+
+    def _get(self, idx):
+        episode = self._episodes[idx]
+        if episode is None:
+            episode = self._episodes[idx] = self._make(idx + 1, self._items[idx])
+
+        return episode
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._get(i) for i in range(*idx.indices(len(self._items)))]
+
+        if idx < 0:
+            idx += len(self._items)
+        if not 0 <= idx < len(self._items):
+            raise IndexError('episode index out of range')
+
+        return self._get(idx)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        for idx in range(len(self._items)):
+            yield self._get(idx)
+
+    def __repr__(self):
+        return '{}(episodes={})'.format(type(self).__name__, len(self._items))
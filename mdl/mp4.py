@@ -0,0 +1,459 @@
+"""Concatenation of the parts of an MP4 video in-process, i.e. without mkvmerge or ffmpeg.
+
+The ``moov`` boxes of the parts get parsed and their sample tables merged track by track, while the ``mdat``
+payloads are copied into the joined file by the kernel (``copy_file_range``, or ``sendfile``) where possible, instead
+of being read into Python. The joined file is laid out for fast start, i.e. ``ftyp``, ``moov`` and then ``mdat``.
+
+The parts must be of the same tracks in the same order, with identical sample descriptions (``stsd``) and media
+timescales, as is the case with the parts of one video split by the site. Otherwise :class:`MP4Error` is raised, upon
+which another joiner should be used instead.
+"""
+import os
+import errno
+import struct
+from bisect import bisect_right
+
+
+# boxes on the way to the sample tables, which are parsed into their children; the others are kept as they are
+_CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+_COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class MP4Error(Exception):
+    pass
+
+
+class _Box(object):
+    __slots__ = ('type', 'payload', 'children')
+
+    def __init__(self, type, payload=b'', children=None):
+        self.type = type
+        self.payload = payload
+        self.children = children
+
+    def find(self, type):
+        for child in self.children:
+            if child.type == type:
+                return child
+
+        return None
+
+    def path(self, *types):
+        box = self
+        for type in types:
+            box = box.find(type) if box is not None else None
+
+        if box is None:
+            raise MP4Error('{} box missing'.format('/'.join(t.decode('ascii') for t in types)))
+        return box
+
+    def serialize(self):
+        payload = b''.join(child.serialize() for child in self.children) if self.children is not None else self.payload
+        if len(payload) + 8 > 0xFFFFFFFF:
+            return struct.pack('>I4sQ', 1, self.type, len(payload) + 16) + payload
+
+        return struct.pack('>I4s', len(payload) + 8, self.type) + payload
+
+
+def _pread(fd, size, offset):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+
+    os.lseek(fd, offset, os.SEEK_SET)  # Windows
+    return os.read(fd, size)
+
+
+def _parse_boxes(data, start, end):
+    boxes = []
+    pos = start
+    while pos + 8 <= end:
+        size, type = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise MP4Error('malformed {!r} box'.format(type))
+
+        if type in _CONTAINERS:
+            boxes.append(_Box(type, children=_parse_boxes(data, pos + header, pos + size)))
+        else:
+            boxes.append(_Box(type, payload=data[pos + header:pos + size]))
+        pos += size
+
+    return boxes
+
+
+def _scan_top_level(fd, file_size):
+    """(type, offset, header size, box size) of the top-level boxes of the file"""
+    boxes = []
+    pos = 0
+    while pos < file_size:
+        header = _pread(fd, 16, pos)
+        if len(header) < 8:
+            raise MP4Error('truncated box header at {}'.format(pos))
+
+        size, type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise MP4Error('truncated box header at {}'.format(pos))
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size or pos + size > file_size:
+            raise MP4Error('malformed {!r} box at {}'.format(type, pos))
+
+        boxes.append((type, pos, header_size, size))
+        pos += size
+
+    return boxes
+
+
+def _full_box(payload):
+    """The version and the body of a full box"""
+    return payload[0], payload[4:]
+
+
+def _read_entries(body, fmt, count, offset=4):
+    entry_size = struct.calcsize('>' + fmt)
+    if offset + entry_size * count > len(body):
+        raise MP4Error('truncated sample table')
+
+    return list(struct.iter_unpack('>' + fmt, body[offset:offset + entry_size * count]))
+
+
+def _read_stbl(stbl):
+    """The sample tables of a track as a dict"""
+    tables = {'stsd': stbl.path(b'stsd').payload}
+
+    _, body = _full_box(stbl.path(b'stts').payload)
+    tables['stts'] = _read_entries(body, 'II', struct.unpack_from('>I', body)[0])
+
+    ctts = stbl.find(b'ctts')
+    if ctts is not None:
+        version, body = _full_box(ctts.payload)
+        tables['ctts_version'] = version
+        tables['ctts'] = _read_entries(body, 'Ii' if version else 'II', struct.unpack_from('>I', body)[0])
+
+    stss = stbl.find(b'stss')
+    if stss is not None:
+        _, body = _full_box(stss.payload)
+        tables['stss'] = [num for num, in _read_entries(body, 'I', struct.unpack_from('>I', body)[0])]
+
+    _, body = _full_box(stbl.path(b'stsz').payload)
+    sample_size, sample_count = struct.unpack_from('>II', body)
+    tables['sample_count'] = sample_count
+    tables['sizes'] = [size for size, in _read_entries(body, 'I', sample_count, 8)] if sample_size == 0 \
+        else [sample_size] * sample_count
+
+    _, body = _full_box(stbl.path(b'stsc').payload)
+    tables['stsc'] = _read_entries(body, 'III', struct.unpack_from('>I', body)[0])
+
+    co = stbl.find(b'stco') or stbl.find(b'co64')
+    if co is None:
+        raise MP4Error('chunk offset box missing')
+    _, body = _full_box(co.payload)
+    tables['offsets'] = [off for off, in _read_entries(body, 'I' if co.type == b'stco' else 'Q',
+                                                         struct.unpack_from('>I', body)[0])]
+
+    return tables
+
+
+# (offset of the timescale or None, offset of the duration, format of the duration) by box and version
+_TIME_FIELDS = {
+    b'mvhd': {0: (12, 16, '>I'), 1: (20, 24, '>Q')},
+    b'mdhd': {0: (12, 16, '>I'), 1: (20, 24, '>Q')},
+    b'tkhd': {0: (None, 20, '>I'), 1: (None, 28, '>Q')}
+}
+
+
+def _time_fields(box):
+    fields = _TIME_FIELDS[box.type].get(box.payload[0]) if box.payload else None
+    if fields is None:
+        raise MP4Error('unsupported version of {!r}'.format(box.type))
+
+    return fields
+
+
+def _get_time(box):
+    ts_off, dur_off, dur_fmt = _time_fields(box)
+    timescale = struct.unpack_from('>I', box.payload, ts_off)[0] if ts_off is not None else None
+    return timescale, struct.unpack_from(dur_fmt, box.payload, dur_off)[0]
+
+
+def _set_duration(box, duration):
+    _, dur_off, dur_fmt = _time_fields(box)
+    if dur_fmt == '>I' and duration > 0xFFFFFFFF:
+        raise MP4Error('duration overflow in {!r}'.format(box.type))
+
+    payload = bytearray(box.payload)
+    struct.pack_into(dur_fmt, payload, dur_off, duration)
+    box.payload = bytes(payload)
+
+
+def _extend_edit_list(edts, extra):
+    """The edit list box `edts` with its last edit of the media, i.e. not an empty edit, extended by the `extra`
+    duration in the movie timescale, or itself if it has no such edit
+    """
+    elst = _Box(b'edts', children=_parse_boxes(edts.payload, 0, len(edts.payload))).find(b'elst')
+    if elst is None:
+        return edts
+
+    version, body = _full_box(elst.payload)
+    fmt = 'QqI' if version else 'IiI'  # segment duration, media time and media rate
+    entries = _read_entries(body, fmt, struct.unpack_from('>I', body)[0])
+    for idx in range(len(entries) - 1, -1, -1):
+        duration, media_time, rate = entries[idx]
+        if media_time != -1:
+            if not version and duration + extra > 0xFFFFFFFF:
+                raise MP4Error('duration overflow in the edit list')
+            entries[idx] = (duration + extra, media_time, rate)
+            break
+    else:
+        return edts
+
+    elst = _Box(b'elst', _full_box_payload(version, struct.pack('>I', len(entries)) +
+                                             b''.join(struct.pack('>' + fmt, *entry) for entry in entries)))
+    return _Box(b'edts', children=[elst])
+
+
+class _Part(object):
+    __slots__ = ('path', 'size', 'ftyp', 'moov', 'mdats', 'tracks', 'timescale', 'duration')
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            boxes = _scan_top_level(fd, self.size)
+            self.ftyp = None
+            self.moov = None
+            self.mdats = []  # (start, end) of the mdat payloads
+            for type, pos, header_size, size in boxes:
+                if type == b'ftyp':
+                    self.ftyp = _pread(fd, size, pos)
+                elif type == b'moov':
+                    data = _pread(fd, size, pos)
+                    self.moov = _Box(b'moov', children=_parse_boxes(data, header_size, size))
+                elif type == b'mdat':
+                    self.mdats.append((pos + header_size, pos + size))
+                elif type == b'moof':
+                    raise MP4Error('fragmented MP4 is not supported')
+        finally:
+            os.close(fd)
+
+        if self.moov is None:
+            raise MP4Error('moov box missing')
+        if self.moov.find(b'mvex') is not None:
+            raise MP4Error('fragmented MP4 is not supported')
+
+        self.timescale, self.duration = _get_time(self.moov.path(b'mvhd'))
+        self.tracks = []
+        for trak in self.moov.children:
+            if trak.type == b'trak':
+                mdhd = trak.path(b'mdia', b'mdhd')
+                timescale, duration = _get_time(mdhd)
+                track = _read_stbl(trak.path(b'mdia', b'minf', b'stbl'))
+                track.update(trak=trak, timescale=timescale, duration=duration,
+                             tkhd_duration=_get_time(trak.path(b'tkhd'))[1], edts=trak.find(b'edts'),
+                             handler=trak.path(b'mdia', b'hdlr').payload[8:12])
+                self.tracks.append(track)
+
+    def relocate(self, offset, base):
+        """Offset of the chunk in the joined mdat payload, given the parts before taking `base` bytes of it"""
+        starts = [start for start, _ in self.mdats]
+        idx = bisect_right(starts, offset) - 1
+        if idx < 0 or offset >= self.mdats[idx][1]:
+            raise MP4Error('chunk at {} outside mdat'.format(offset))
+
+        return base + sum(end - start for start, end in self.mdats[:idx]) + offset - starts[idx]
+
+    @property
+    def payload_size(self):
+        return sum(end - start for start, end in self.mdats)
+
+
+def _merge_runs(runs):
+    """Concatenate (count, value) runs, merging the adjacent ones of the same value"""
+    merged = []
+    for count, value in runs:
+        if merged and merged[-1][1] == value:
+            merged[-1] = (merged[-1][0] + count, value)
+        else:
+            merged.append((count, value))
+
+    return merged
+
+
+def _full_box_payload(version, body):
+    return struct.pack('>B3x', version) + body
+
+
+def _build_stbl(stsd, tracks, chunk_offsets, use_co64):
+    stts = _merge_runs(entry for track in tracks for entry in track['stts'])
+    children = [_Box(b'stsd', stsd),
+                _Box(b'stts', _full_box_payload(0, struct.pack('>I', len(stts)) +
+                                                b''.join(struct.pack('>II', *entry) for entry in stts)))]
+
+    if any('ctts' in track for track in tracks):
+        version = max(track.get('ctts_version', 0) for track in tracks)
+        ctts = _merge_runs(entry for track in tracks
+                           for entry in track.get('ctts') or [(track['sample_count'], 0)])
+        children.append(_Box(b'ctts', _full_box_payload(version, struct.pack('>I', len(ctts)) +
+                                                         b''.join(struct.pack('>Ii' if version else '>II', *entry)
+                                                                  for entry in ctts))))
+
+    if any('stss' in track for track in tracks):
+        stss, base = [], 0
+        for track in tracks:
+            nums = track['stss'] if 'stss' in track else range(1, track['sample_count'] + 1)  # all sync samples
+            stss.extend(base + num for num in nums)
+            base += track['sample_count']
+        children.append(_Box(b'stss', _full_box_payload(0, struct.pack('>I%dI' % len(stss), len(stss), *stss))))
+
+    sizes = [size for track in tracks for size in track['sizes']]
+    if sizes and all(size == sizes[0] for size in sizes):
+        stsz = struct.pack('>II', sizes[0], len(sizes))
+    else:
+        stsz = struct.pack('>II%dI' % len(sizes), 0, len(sizes), *sizes)
+    children.append(_Box(b'stsz', _full_box_payload(0, stsz)))
+
+    stsc, base = [], 0
+    for track in tracks:
+        for first_chunk, samples, desc in track['stsc']:
+            if not stsc or stsc[-1][1:] != (samples, desc):
+                stsc.append((base + first_chunk, samples, desc))
+        base += len(track['offsets'])
+    children.append(_Box(b'stsc', _full_box_payload(0, struct.pack('>I', len(stsc)) +
+                                                    b''.join(struct.pack('>III', *entry) for entry in stsc))))
+
+    fmt = 'Q' if use_co64 else 'I'
+    children.append(_Box(b'co64' if use_co64 else b'stco',
+                         _full_box_payload(0, struct.pack('>I%d%s' % (len(chunk_offsets), fmt),
+                                                          len(chunk_offsets), *chunk_offsets))))
+
+    return _Box(b'stbl', children=children)
+
+
+def _copy_range(src_fd, dst_fd, offset, length):
+    """Append `length` bytes at `offset` of `src_fd` to `dst_fd`, preferably within the kernel"""
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    sendfile = getattr(os, 'sendfile', None) if os.name == 'posix' else None
+
+    while length > 0:
+        copied = 0
+        if copy_file_range is not None:
+            try:
+                copied = copy_file_range(src_fd, dst_fd, length, offset)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF):
+                    raise
+                copy_file_range = None
+                continue
+        elif sendfile is not None:
+            try:
+                copied = sendfile(dst_fd, src_fd, offset, length)
+            except OSError as e:
+                if e.errno not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK):
+                    raise
+                sendfile = None
+                continue
+        else:
+            data = _pread(src_fd, min(length, _COPY_CHUNK_SIZE), offset)
+            copied = os.write(dst_fd, data)
+
+        if not copied:
+            raise MP4Error('unexpected end of file')
+        offset += copied
+        length -= copied
+
+
+def concat_mp4(src_paths, dst_path):
+    """Join the MP4 files `src_paths` in order into the fast-start MP4 file `dst_path`.
+
+    Raises:
+        MP4Error: Raised when the files are malformed or can't be joined.
+    """
+    parts = [_Part(path) for path in src_paths]
+    first = parts[0]
+
+    for part in parts[1:]:
+        if len(part.tracks) != len(first.tracks):
+            raise MP4Error("'{}' differs in the number of tracks".format(part.path))
+        for track, first_track in zip(part.tracks, first.tracks):
+            for key in ('handler', 'stsd', 'timescale'):
+                if track[key] != first_track[key]:
+                    raise MP4Error("'{}' differs in the {} of a track".format(part.path, key))
+
+    # bases of the parts in the joined mdat payload
+    bases, payload_size = [], 0
+    for part in parts:
+        bases.append(payload_size)
+        payload_size += part.payload_size
+
+    relative_offsets = []  # chunk offsets of the tracks relative to the joined mdat payload
+    for ti in range(len(first.tracks)):
+        relative_offsets.append([part.relocate(offset, base) for part, base in zip(parts, bases)
+                                 for offset in part.tracks[ti]['offsets']])
+
+    mdat_header = struct.pack('>I4s', payload_size + 8, b'mdat') if payload_size + 8 <= 0xFFFFFFFF else \
+        struct.pack('>I4sQ', 1, b'mdat', payload_size + 16)
+    ftyp = first.ftyp or b''
+
+    def build_moov(data_start, use_co64):
+        moov = first.moov
+        movie_duration = 0
+        for ti, track in enumerate(first.tracks):
+            trak = track['trak']
+            tracks = [part.tracks[ti] for part in parts]
+
+            mdia = trak.path(b'mdia')
+            _set_duration(mdia.path(b'mdhd'), sum(t['duration'] for t in tracks))
+            tkhd_duration = sum(t['tkhd_duration'] * first.timescale // part.timescale
+                                for t, part in zip(tracks, parts))
+            _set_duration(trak.path(b'tkhd'), tkhd_duration)
+            movie_duration = max(movie_duration, tkhd_duration)
+
+            # the edit list of the first part, e.g. skipping the priming samples of AAC, or shifting the composition
+            # times of the B-frames, still applies to the joined track, extended over the parts after it
+            if track['edts'] is not None:
+                edts = _extend_edit_list(track['edts'], tkhd_duration - track['tkhd_duration'])
+                trak.children = [edts if child.type == b'edts' else child for child in trak.children]
+
+            minf = mdia.path(b'minf')
+            stbl = _build_stbl(track['stsd'], tracks, [data_start + off for off in relative_offsets[ti]], use_co64)
+            minf.children = [stbl if child.type == b'stbl' else child for child in minf.children]
+
+        _set_duration(moov.path(b'mvhd'), movie_duration)
+        return moov.serialize()
+
+    use_co64 = len(ftyp) + len(build_moov(0, False)) + len(mdat_header) + payload_size > 0xFFFFFFFF
+    moov_size = len(build_moov(0, use_co64))
+    moov = build_moov(len(ftyp) + moov_size + len(mdat_header), use_co64)
+
+    dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        for data in (ftyp, moov, mdat_header):
+            view = memoryview(data)
+            while view:
+                view = view[os.write(dst_fd, view):]
+
+        for part in parts:
+            src_fd = os.open(part.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            try:
+                for start, end in part.mdats:
+                    _copy_range(src_fd, dst_fd, start, end - start)
+            finally:
+                os.close(src_fd)
+    except BaseException:
+        os.close(dst_fd)
+        os.remove(dst_path)
+        raise
+    else:
+        os.close(dst_fd)
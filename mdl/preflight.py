@@ -0,0 +1,141 @@
+"""Disk-space preflight of the episodes about to be downloaded, and the preallocation strategy of aria2 per filesystem.
+
+The size of an episode is the sum of the file sizes resolved from the site, e.g. the ``getinfo`` API of QQVideo, if
+known, otherwise extrapolated from the ``Content-Length`` of a few of its files sampled with HEAD requests. Joining an
+episode takes room for it twice, i.e. the segments along with the joined video, until the segments get removed, so
+the filesystem of the save directory needs room for all the episodes plus the largest one.
+
+The episodes are checked one by one as they get resolved and fed to aria2, see :class:`SpaceBudget`, so that the
+downloads start without waiting for all of them.
+"""
+import os
+import sys
+import shutil
+
+from .scratch import expected_size
+
+
+HEAD_TIMEOUT = 10  # seconds
+
+SPACE_MARGIN = 256 * 1024 ** 2  # bytes kept free besides the episodes
+
+# aria2 "--file-allocation" by filesystem type: preallocating by writing zeros (aria2's default "prealloc") doubles the
+# writes, and even more so over a network filesystem, while `fallocate` is cheap where supported
+FALLOC_FSTYPES = ('ext4', 'xfs', 'btrfs', 'f2fs', 'tmpfs', 'ntfs')
+NO_ALLOC_FSTYPES = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'ceph', 'glusterfs', 'vfat', 'msdos', 'exfat',
+                    'fat', 'fat32')
+
+
+def _existing_ancestor(path):
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+
+    return path
+
+
+def free_space(path):
+    """Free bytes of the filesystem `path` is (to be) on"""
+    return shutil.disk_usage(_existing_ancestor(path)).free
+
+
+def filesystem_type(path):
+    """Type of the filesystem `path` is (to be) on in lowercase, e.g. 'ext4', 'nfs4' or 'ntfs', or ``None`` if unknown"""
+    path = os.path.realpath(_existing_ancestor(path))
+
+    if sys.platform == 'win32':
+        import ctypes
+        fstype = ctypes.create_unicode_buffer(261)
+        root = os.path.splitdrive(path)[0] + '\\'
+        if ctypes.windll.kernel32.GetVolumeInformationW(root, None, 0, None, None, None, fstype, len(fstype)):
+            return fstype.value.lower()
+        return None
+
+    try:
+        with open('/proc/self/mounts', encoding='utf-8') as fd:
+            mounts = [line.split()[1:3] for line in fd]
+    except OSError:
+        return None
+
+    fstype, longest = None, -1
+    for mount_point, typ in mounts:
+        mount_point = mount_point.replace('\\040', ' ')
+        if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > longest:
+            fstype, longest = typ, len(mount_point)
+
+    return fstype
+
+
+def file_allocation(path):
+    """The aria2 "--file-allocation" suited to the filesystem `path` is on, or ``None`` for aria2's default"""
+    fstype = filesystem_type(path)
+    if fstype is None:
+        return None
+    if fstype in FALLOC_FSTYPES:
+        return 'falloc'
+    if fstype in NO_ALLOC_FSTYPES or fstype.startswith('fuse'):
+        return 'none'
+
+    return None
+
+
+def _content_length(session, url):
+    try:
+        r = session.head(url.split('\t', 1)[0], allow_redirects=True, timeout=HEAD_TIMEOUT)
+        size = int(r.headers.get('Content-Length', 0)) if r.ok else 0
+    except (ValueError, OSError):  # including the exceptions of requests
+        size = 0
+
+    return size or None
+
+
+def estimate_size(episode, session):
+    """Estimate the size in bytes of the `episode`, sampling its first, middle and last files with HEAD requests if
+    the sizes of the files are unknown.
+
+    Returns:
+        int: The estimated size, or ``None`` if unknown.
+    """
+    size = expected_size(episode)
+    num = len(episode.fnames)
+    if size is not None or not num:
+        return size
+
+    lengths = [_content_length(session, episode.urls[idx]) for idx in sorted({0, num // 2, num - 1})]
+    if all(lengths):
+        return sum(lengths) * num // len(lengths)
+
+    return None
+
+
+class SpaceBudget(object):
+    """The free space of the filesystem of the save directory, taken up by the episodes admitted one by one"""
+
+    def __init__(self, path):
+        self.path = path
+        self.free = free_space(path)
+        self.needed = SPACE_MARGIN
+        self._largest = 0
+
+    def admit(self, size):
+        """Take up the room for downloading and joining the episode of the `size`, if it fits, while those of unknown
+        sizes are always admitted.
+
+        Returns:
+            bool: ``True`` if admitted, otherwise ``False``.
+        """
+        if size is None:
+            return True
+        if self.required(size) > self.free:
+            return False
+
+        self.needed += size
+        self._largest = max(self._largest, size)
+        return True
+
+    def required(self, size):
+        """Bytes required for the episodes admitted so far along with one more of the `size`"""
+        return self.needed + size + max(self._largest, size)
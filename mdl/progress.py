@@ -0,0 +1,238 @@
+"""Machine-readable progress events, written as JSON Lines to a file descriptor or a socket.
+
+Each event is a JSON object with the "event" name and the "time" in seconds since the epoch, along with its fields:
+
+    cover_resolved    url, site, title, episodes
+    episode_resolved  url, vid, defn, dir, files, bytes_total
+    episode_progress  url, vid, dir, bytes_done, bytes_total, rate
+    progress          url, bytes_done, bytes_total, rate, eta
+    episode_joined    site, vid, path
+    job_finished      url, ok
+
+The byte counts and rates come from the status of aria2c polled through its JSON-RPC interface at a bounded rate, and
+``bytes_total`` of an episode is the sum of the file sizes resolved from the site if known, or that reported by aria2c
+so far otherwise, which is ``None`` until all the files have started. The aggregate ``eta`` in seconds is estimated
+only if the sizes of all the episodes are known.
+"""
+import os
+import json
+import time
+import socket
+import threading
+import logging
+from urllib.request import urlopen, Request
+
+from .scratch import expected_size
+
+
+POLL_INTERVAL = 1.0  # seconds between the polls of aria2c, i.e. the bound of the rate of the progress events
+RPC_TIMEOUT = 5  # seconds
+MAX_STOPPED = 1000  # aria2c's default "--max-download-result"
+
+LOGGER = logging.getLogger('MDL.progress')
+
+
+class ProgressEmitter(object):
+    """Writer of the progress events, which stops writing on the first failure, e.g. when the reader is gone"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        fields['event'] = event
+        fields['time'] = round(time.time(), 3)
+        line = json.dumps(fields, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._stream is None:
+                return
+            try:
+                self._stream.write(line)
+                self._stream.flush()
+            except (OSError, ValueError) as e:
+                LOGGER.warning('Progress events stopped: {!r}'.format(e))
+                self._stream = None
+
+    def close(self):
+        with self._lock:
+            if self._stream is not None:
+                try:
+                    self._stream.close()
+                except OSError:  # e.g. the reader gone
+                    pass
+                self._stream = None
+
+
+def open_emitter(fd=None, address=None):
+    """Open the emitter writing to the file descriptor `fd`, or connected to the `address` of the form "HOST:PORT" for
+    TCP or the path to a Unix domain socket.
+    """
+    if fd is not None:
+        return ProgressEmitter(os.fdopen(fd, mode='w', encoding='utf-8'))
+
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit() and os.sep not in address:
+        sock = socket.create_connection((host, int(port)))
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+
+    return ProgressEmitter(sock.makefile(mode='w', encoding='utf-8'))
+
+
+class _EpisodeProgress(object):
+    __slots__ = ('episode', 'known_total', 'done', 'totals', 'rate', 'reported')
+
+    def __init__(self, episode):
+        self.episode = episode
+        self.known_total = expected_size(episode)
+        self.done = 0  # bytes of the files completed
+        self.totals = {}  # gid -> total bytes of the file
+        self.rate = 0
+        self.reported = None  # bytes done last reported
+
+    @property
+    def total(self):
+        if self.known_total is not None:
+            return self.known_total
+        return sum(self.totals.values()) if len(self.totals) >= len(self.episode.fnames) else None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Aria2Monitor(object):
+    """Poller of the status of aria2c through its JSON-RPC interface, emitting the progress of the episodes, if the
+    `emitter` is given, and keeping track of the files completed, see :meth:`is_complete`.
+
+    As aria2c with RPC enabled keeps running after all the downloads have finished, it's shut down through RPC by
+    :meth:`finish`, and the downloads failed are counted in :attr:`errors` instead of the exit status of aria2c.
+    """
+
+    def __init__(self, rpc_port, rpc_secret, emitter, url):
+        self._rpc_url = 'http://127.0.0.1:{}/jsonrpc'.format(rpc_port)
+        self._token = 'token:' + rpc_secret
+        self._emitter = emitter
+        self._url = url
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._episodes = {}  # episode directory -> _EpisodeProgress
+        self._stopped_gids = set()
+        self._completed = set()  # normalized paths of the files completed
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add(self, episode):
+        with self._lock:
+            self._episodes[episode.dir] = _EpisodeProgress(episode)
+
+    def finish(self, proc):
+        """Wait until aria2c, i.e. `proc`, which has been fed all the input, gets idle, report the final status, and
+        then shut it down.
+        """
+        idle_polls = 0
+        while proc.poll() is None and idle_polls < 2:  # idle twice in a row, in case of the input not read yet
+            time.sleep(POLL_INTERVAL)
+            try:
+                stat = self._call('aria2.getGlobalStat')
+                idle_polls = idle_polls + 1 if int(stat['numActive']) + int(stat['numWaiting']) == 0 else 0
+            except (OSError, ValueError, KeyError):
+                pass
+
+        self._stop.set()
+        self._thread.join()
+        if proc.poll() is None:
+            self._poll_quietly()
+            try:
+                self._call('aria2.shutdown')
+            except (OSError, ValueError, KeyError):
+                proc.terminate()
+
+    def is_complete(self, path):
+        """Whether aria2c has reported the file `path` completely downloaded"""
+        with self._lock:
+            return os.path.normpath(path) in self._completed
+
+    def _call(self, method, *params):
+        body = json.dumps({'jsonrpc': '2.0', 'id': 'mdl', 'method': method, 'params': [self._token] + list(params)})
+        req = Request(self._rpc_url, data=body.encode('utf-8'), headers={'Content-Type': 'application/json'})
+        with urlopen(req, timeout=RPC_TIMEOUT) as resp:
+            return json.loads(resp.read().decode('utf-8'))['result']
+
+    def poll(self):
+        keys = ['gid', 'dir', 'status', 'totalLength', 'completedLength', 'downloadSpeed', 'files']
+        active = self._call('aria2.tellActive', keys)
+        stopped = self._call('aria2.tellStopped', 0, MAX_STOPPED, keys)
+
+        with self._lock:
+            for prog in self._episodes.values():
+                prog.rate = 0
+
+            for status in stopped:
+                prog = self._episodes.get(status['dir'])
+                if prog is None or status['gid'] in self._stopped_gids:
+                    continue
+                self._stopped_gids.add(status['gid'])
+                prog.totals[status['gid']] = int(status['totalLength'])
+                if status['status'] == 'complete':
+                    prog.done += int(status['completedLength'])
+                    self._completed.update(os.path.normpath(f['path']) for f in status.get('files') or ()
+                                           if f.get('path'))
+                elif status['status'] == 'error':
+                    self.errors += 1
+
+            active_done = {}
+            for status in active:
+                prog = self._episodes.get(status['dir'])
+                if prog is None:
+                    continue
+                if int(status['totalLength']):
+                    prog.totals[status['gid']] = int(status['totalLength'])
+                active_done[status['dir']] = active_done.get(status['dir'], 0) + int(status['completedLength'])
+                prog.rate += int(status['downloadSpeed'])
+
+            self._emit_progress(active_done)
+
+    def _emit_progress(self, active_done):
+        if self._emitter is None:
+            return
+
+        bytes_done = bytes_total = rate = 0
+        all_known = True
+        for episode_dir, prog in self._episodes.items():
+            done, total = prog.done + active_done.get(episode_dir, 0), prog.total
+            if done != prog.reported or episode_dir in active_done:
+                prog.reported = done
+                self._emitter.emit('episode_progress', url=self._url, vid=prog.episode.vid, dir=episode_dir,
+                                   bytes_done=done, bytes_total=total, rate=prog.rate)
+            bytes_done += done
+            rate += prog.rate
+            if total is None:
+                all_known = False
+            else:
+                bytes_total += total
+
+        eta = None
+        if all_known:
+            remaining = max(bytes_total - bytes_done, 0)
+            eta = round(remaining / rate, 1) if rate else 0 if not remaining else None
+        self._emitter.emit('progress', url=self._url, bytes_done=bytes_done,
+                           bytes_total=bytes_total if all_known else None, rate=rate, eta=eta)
+
+    def _run(self):
+        while not self._stop.wait(POLL_INTERVAL):
+            self._poll_quietly()
+
+    def _poll_quietly(self):
+        try:
+            self.poll()
+        except (OSError, ValueError, KeyError) as e:  # e.g. aria2c not listening yet, or exiting
+            LOGGER.debug('Polling aria2c failed: {!r}'.format(e))
@@ -0,0 +1,322 @@
+"""The requester layer shared by the `VideoConfig` instances of the sites, i.e. the HTTP sessions with per-host rate
+limiting, and per-endpoint timeouts, retry budgets and circuit breakers.
+
+Each rate-limited host has a token bucket, refilled at the configured rate up to the burst size, and shared by all the
+sessions, so that the requests to the host made concurrently by the covers and episodes being extracted are paced as a
+whole. The rate adapts to the responses of the host (AIMD): it's halved upon a 429 or 403 response, pausing the host
+for its ``Retry-After`` if any, and then recovers gradually with the successful responses. A host that isn't configured
+is not limited, until it throttles the requests.
+
+Each endpoint, i.e. the host and the path of the URL, e.g. ``vv.video.qq.com/getinfo``, has its own timeout and maximum
+retries, as configured or the defaults, and the retries are further bounded by its retry budget, i.e. a fraction of its
+requests, so that a degraded endpoint doesn't keep every request waiting through full retry cycles. The failures of an
+endpoint, i.e. the connection errors, the timeouts and the 5xx responses, trip its circuit breaker after a few in a row,
+upon which its requests fail right away with :class:`CircuitOpenError` until a probe request succeeds after a while,
+letting the sites fall back on the alternatives at once, e.g. QQVideo on the P10201 platform when ``getinfo`` of P10801
+is failing. Both the rate limiter and the endpoints are shared by all the covers and episodes of a run.
+"""
+import re
+import time
+import random
+import threading
+import logging
+from urllib.parse import urlsplit
+
+from requests import RequestException
+from requests.adapters import HTTPAdapter
+from bdownload.download import RequestsSessionWrapper, RETRY_EXEMPT_STATUS_CODES, RETRY_BACKOFF_FACTOR
+
+
+THROTTLED_STATUS_CODES = (429, 403)
+
+DEFAULT_RATE = 10.0  # requests per second to start with for the hosts throttling without being configured
+MIN_RATE = 0.2
+MAX_RETRY_AFTER = 60  # seconds
+
+DEFAULT_RETRIES = 2  # maximum retries of a request to the endpoints not configured
+RETRY_RATIO = 0.2  # retries earned by each request of an endpoint, i.e. its retry budget
+MAX_RETRY_TOKENS = 10
+FAILURE_THRESHOLD = 5  # failures in a row tripping the circuit breaker of an endpoint
+RESET_TIMEOUT = 30  # seconds before a tripped circuit breaker lets a probe request through
+
+LOGGER = logging.getLogger('MDL.requester')
+
+
+def parse_rate_limits(rate_limits):
+    """Parse the rate limits of the form "HOST:RATE[/BURST] ...", with the RATE in requests per second.
+
+    >>> parse_rate_limits('vv.video.qq.com:10/20 profile.m1905.com:2.5')
+    {'vv.video.qq.com': (10.0, 20), 'profile.m1905.com': (2.5, 2)}
+    """
+    limits = {}
+    for limit in (rate_limits or '').split():
+        m = re.match(r'^([^:/\s]+):(\d+(?:\.\d+)?)(?:/(\d+))?$', limit)
+        if not m:
+            raise ValueError('invalid rate limit: {!r}'.format(limit))
+
+        rate = float(m.group(2))
+        burst = int(m.group(3)) if m.group(3) else max(int(rate), 1)
+        limits[m.group(1).lower()] = (rate, burst)
+
+    return limits
+
+
+def parse_endpoint_policies(policies):
+    """Parse the endpoint policies of the form "HOST/PATH:TIMEOUT[/RETRIES] ...", with the TIMEOUT in seconds.
+
+    >>> parse_endpoint_policies('vv.video.qq.com/getinfo:4/1 vd.l.qq.com/proxyhttp:8')
+    {'vv.video.qq.com/getinfo': (4.0, 1), 'vd.l.qq.com/proxyhttp': (8.0, None)}
+    """
+    endpoints = {}
+    for policy in (policies or '').split():
+        m = re.match(r'^([^:/\s]+/[^:\s]*):(\d+(?:\.\d+)?)(?:/(\d+))?$', policy)
+        if not m:
+            raise ValueError('invalid endpoint policy: {!r}'.format(policy))
+
+        endpoints[m.group(1).lower()] = (float(m.group(2)), int(m.group(3)) if m.group(3) else None)
+
+    return endpoints
+
+
+def endpoint_of(url):
+    """The endpoint of the `url`, i.e. its host and path, e.g. 'vv.video.qq.com/getinfo'"""
+    parts = urlsplit(url)
+    return (parts.hostname or '').lower() + (parts.path or '/')
+
+
+class CircuitOpenError(RequestException):
+    """Raised on the requests to an endpoint whose circuit breaker is open"""
+
+    def __init__(self, endpoint):
+        super().__init__('circuit open: {}'.format(endpoint))
+        self.endpoint = endpoint
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._time = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self._tokens + (now - self._time) * self.rate, self.burst)
+        self._time = now
+
+    def acquire(self):
+        """Take a token, blocking until one is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """Back off multiplicatively, and pause for `retry_after` seconds if given"""
+        with self._lock:
+            self.rate = max(self.rate / 2, MIN_RATE)
+            self._tokens = min(self._tokens, 0.0)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + min(retry_after, MAX_RETRY_AFTER))
+
+    def succeeded(self):
+        """Recover additively towards the maximum rate"""
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+
+
+class RateLimiter(object):
+    """Token buckets of the hosts, see the module docstring"""
+
+    def __init__(self, limits=None):
+        """`limits` maps the host names to the tuples of the rate in requests per second and the burst size"""
+        self._buckets = {host: TokenBucket(rate, burst) for host, (rate, burst) in (limits or {}).items()}
+        self._lock = threading.Lock()
+
+    def acquire(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is not None:
+            bucket.acquire()
+
+    def feedback(self, host, status_code, retry_after=None):
+        bucket = self._buckets.get(host)
+        if status_code in THROTTLED_STATUS_CODES:
+            if bucket is None:
+                with self._lock:
+                    bucket = self._buckets.setdefault(host, TokenBucket(DEFAULT_RATE, int(DEFAULT_RATE)))
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:  # an HTTP date
+                retry_after = None
+            bucket.throttled(retry_after)
+            LOGGER.debug('{} throttled with {}, backing off to {:.1f} requests/s'.format(host, status_code, bucket.rate))
+        elif bucket is not None and status_code < 400:
+            bucket.succeeded()
+
+
+class CircuitBreaker(object):
+    """Breaker tripped by `FAILURE_THRESHOLD` failures in a row, and reset by a probe request succeeding once it has
+    been open for `RESET_TIMEOUT` seconds
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < RESET_TIMEOUT:
+                return False
+            self._probing = True  # half open, i.e. only the probe request goes through
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                if self._opened_at is not None:
+                    LOGGER.info('Circuit of {} closed'.format(self.endpoint))
+                self._failures, self._opened_at, self._probing = 0, None, False
+                return
+
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= FAILURE_THRESHOLD):
+                if not self._probing:
+                    LOGGER.warning('Circuit of {} opened after {} failures'.format(self.endpoint, self._failures))
+                self._opened_at, self._probing = time.monotonic(), False
+
+
+class RetryBudget(object):
+    """Retries allowed of an endpoint, earning `RETRY_RATIO` of a retry by each request, up to `MAX_RETRY_TOKENS`"""
+
+    def __init__(self):
+        self._tokens = float(MAX_RETRY_TOKENS)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._tokens + RETRY_RATIO, MAX_RETRY_TOKENS)
+
+    def withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class _Endpoint(object):
+    __slots__ = ('timeout', 'retries', 'breaker', 'budget')
+
+    def __init__(self, endpoint, timeout, retries):
+        self.timeout = timeout
+        self.retries = retries
+        self.breaker = CircuitBreaker(endpoint)
+        self.budget = RetryBudget()
+
+
+class Endpoints(object):
+    """Timeouts, retry budgets and circuit breakers of the endpoints, see the module docstring"""
+
+    def __init__(self, policies=None):
+        """`policies` maps the endpoints to the tuples of the timeout in seconds, or ``None`` for the default of the
+        session, and the maximum retries, or ``None`` for `DEFAULT_RETRIES`
+        """
+        self._policies = policies or {}
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        with self._lock:
+            ep = self._endpoints.get(endpoint)
+            if ep is None:
+                timeout, retries = self._policies.get(endpoint, (None, None))
+                ep = _Endpoint(endpoint, timeout, DEFAULT_RETRIES if retries is None else retries)
+                self._endpoints[endpoint] = ep
+
+        return ep
+
+
+class ThrottledSession(RequestsSessionWrapper):
+    """Session whose every request, including each retry, is paced by the shared :class:`RateLimiter`, and retried
+    and broken per endpoint as per the shared :class:`Endpoints`.
+
+    The retries are all made here, in place of both the extended retries of :meth:`RequestsSessionWrapper.get` and the
+    built-in retries of ``urllib3``, so as to be bounded by the retry budgets. Like the former, :meth:`get` raises on
+    the bad status codes once out of retries.
+    """
+
+    def __init__(self, rate_limiter, endpoints, num_pools=20, pool_maxsize=20, pool_block=True, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+        self.endpoints = endpoints
+
+        adapter = HTTPAdapter(max_retries=0, pool_connections=num_pools, pool_maxsize=pool_maxsize,
+                              pool_block=pool_block)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def get(self, url, **kwargs):
+        if self.requester_cb:
+            self.requester_cb()
+
+        if self.referrer == '*':
+            self.headers.update({'Referer': url})
+
+        kwargs.setdefault('allow_redirects', True)
+        r = self.request('GET', url, **kwargs)
+        if r.status_code not in RETRY_EXEMPT_STATUS_CODES:
+            r.raise_for_status()
+
+        return r
+
+    def request(self, method, url, *args, **kwargs):
+        endpoint = endpoint_of(url)
+        host = endpoint.split('/', 1)[0]
+        ep = self.endpoints.get(endpoint)
+        if ep.timeout is not None:
+            kwargs['timeout'] = ep.timeout
+        else:
+            kwargs.setdefault('timeout', self.timeout)
+
+        ep.budget.deposit()
+        attempt = 0
+        while True:
+            if not ep.breaker.allow():
+                raise CircuitOpenError(endpoint)
+
+            self.rate_limiter.acquire(host)
+            try:
+                r = super().request(method, url, *args, **kwargs)
+            except RequestException as e:
+                ep.breaker.record(False)
+                if attempt >= ep.retries or not ep.budget.withdraw():
+                    raise
+                error = e
+            else:
+                self.rate_limiter.feedback(host, r.status_code, r.headers.get('Retry-After'))
+                failed = r.status_code >= 500
+                ep.breaker.record(not failed)
+                if not (failed or r.status_code == 429) or attempt >= ep.retries or not ep.budget.withdraw():
+                    return r
+                error = r.status_code
+                r.close()
+
+            attempt += 1
+            backoff = random.randrange(0, 2 ** attempt) * RETRY_BACKOFF_FACTOR
+            LOGGER.debug('Retrying {} {}/{} in {:.2f} seconds: {!r}'.format(endpoint, attempt, ep.retries, backoff,
+                                                                            error))
+            time.sleep(backoff)
@@ -0,0 +1,160 @@
+"""Staging of the episodes being downloaded in a fast scratch directory, e.g. on tmpfs or a local NVMe drive.
+
+The segments of an admitted episode are downloaded into, verified and joined from the scratch directory, and only the
+joined video gets written into the cover directory under the save directory, which may well be a slow network mount.
+An episode is admitted only if its expected size fits in the room left in the scratch directory, i.e. within both the
+configured capacity and the free space of the filesystem, minus what has been reserved for the episodes in flight
+but not yet written. Otherwise it spills over to be downloaded into the save directory as usual.
+
+The staged episode is released once joined, or else handed off, i.e. moved back into the save directory, so that the
+download can be resumed from there, whether it failed, got corrupted or was given up.
+"""
+import os
+import re
+import shutil
+import hashlib
+import threading
+import logging
+
+
+# assumed size of the episodes whose file sizes are unknown, until any episode with known size has been admitted
+UNKNOWN_EPISODE_SIZE = 1024 ** 3
+
+LOGGER = logging.getLogger('MDL.scratch')
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def parse_size(size):
+    """Parse the size in bytes of the form "<number>[K|M|G|T]", e.g. "512M" or "16G".
+
+    >>> parse_size('16G'), parse_size('1.5k'), parse_size('')
+    (17179869184, 1536, None)
+    """
+    if not size:
+        return None
+
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', size, re.I)
+    if not m:
+        raise ValueError('invalid size: {!r}'.format(size))
+
+    return int(float(m.group(1)) * _SIZE_UNITS[m.group(2).upper()])
+
+
+def expected_size(episode):
+    """Total size in bytes of the files of the `episode`, or ``None`` if unknown"""
+    sizes = getattr(episode.urls, 'sizes', None)
+    if sizes is None or len(sizes) != len(episode.fnames) or not all(size > 0 for size in sizes):
+        return None
+
+    return sum(sizes)
+
+
+class Scratch(object):
+    def __init__(self, root, capacity=None):
+        """`capacity` is the maximum number of bytes to occupy in the scratch directory `root`, default to unlimited
+        but by the free space of its filesystem.
+        """
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._reserved = {}  # staged episode directory -> (bytes reserved, episode directory in the save directory)
+        self._typical_size = UNKNOWN_EPISODE_SIZE
+
+    @staticmethod
+    def _staged_bytes(staged_dir):
+        try:
+            return sum(entry.stat().st_size for entry in os.scandir(staged_dir) if entry.is_file())
+        except OSError:
+            return 0
+
+    def _room(self):
+        staged = {staged_dir: self._staged_bytes(staged_dir) for staged_dir in self._reserved}
+        # the bytes written so far have been taken off the free space already
+        room = shutil.disk_usage(self.root).free - sum(max(need - staged[staged_dir], 0)
+                                                       for staged_dir, (need, _) in self._reserved.items())
+        if self.capacity is not None:
+            room = min(room, self.capacity - sum(max(need, staged[staged_dir])
+                                                 for staged_dir, (need, _) in self._reserved.items()))
+
+        return room
+
+    def _staged_dir(self, episode_dir):
+        """The directory in the scratch directory to stage the episode of the directory `episode_dir` in, under that
+        of its cover, which is told apart from the covers of the same name in other save directories by the digest of
+        its path
+        """
+        cover_dir, episode_basename = os.path.split(os.path.abspath(episode_dir))
+        digest = hashlib.sha1(cover_dir.encode('utf-8')).hexdigest()[:10]
+        return os.path.join(self.root, '{}.{}'.format(os.path.basename(cover_dir), digest), episode_basename)
+
+    def stage(self, episode):
+        """Redirect the `episode` into the scratch directory if admitted, creating the directory of the cover of the
+        `episode`, where it's to be joined into, as that's no longer created by downloading into it.
+
+        Returns:
+            bool: ``True`` if staged, ``False`` if spilled over, or staged already, e.g. being repaired.
+        """
+        with self._lock:
+            if episode.dir in self._reserved:
+                return False
+
+        cover_dir, episode_basename = os.path.split(episode.dir)
+        staged_dir = self._staged_dir(episode.dir)
+        if os.path.isdir(episode.dir) and not os.path.isdir(staged_dir):
+            return False  # resume the download left in the save directory
+
+        size = expected_size(episode)
+        with self._lock:
+            if size is not None:
+                self._typical_size = size
+            need = size if size is not None else self._typical_size
+            if not os.path.isdir(staged_dir) and need > self._room():
+                LOGGER.info("Scratch directory full, '{}' spilled over.".format(episode_basename))
+                return False
+
+            self._reserved[staged_dir] = (need, episode.dir)
+
+        os.makedirs(cover_dir, exist_ok=True)
+        os.makedirs(staged_dir, exist_ok=True)
+        episode.dir = staged_dir
+
+        return True
+
+    def release(self, episode):
+        """Remove the staged directory of the joined `episode`, along with that of its cover if left empty"""
+        with self._lock:
+            if self._reserved.pop(episode.dir, None) is None:
+                return
+
+        shutil.rmtree(episode.dir, ignore_errors=True)
+        self._remove_cover_dir(episode.dir)
+
+    def hand_off(self, episode):
+        """Move the staged directory of the `episode` not joined back into the save directory, to be resumed from
+        there, and release its reservation
+        """
+        with self._lock:
+            reserved = self._reserved.pop(episode.dir, None)
+        if reserved is None:
+            return
+
+        staged_dir, episode_dir = episode.dir, reserved[1]
+        try:
+            if os.path.isdir(episode_dir):
+                shutil.rmtree(staged_dir)  # resumed in the save directory meanwhile
+            else:
+                shutil.move(staged_dir, episode_dir)
+                episode.dir = episode_dir
+        except OSError as e:
+            LOGGER.warning("Failed to hand '{}' off to the save directory: {!r}".format(staged_dir, e))
+            shutil.rmtree(staged_dir, ignore_errors=True)
+        self._remove_cover_dir(staged_dir)
+
+    @staticmethod
+    def _remove_cover_dir(staged_dir):
+        try:
+            os.rmdir(os.path.dirname(staged_dir))
+        except OSError:
+            pass
@@ -0,0 +1,284 @@
+"""Sharded downloading by multiple workers sharing a directory.
+
+The coordinator resolves the covers and splits their episodes into shards, each of which is a download manifest
+(see :meth:`MDownloader.write_manifest`) of its own, laid out in the shard directory as follows:
+
+    pending/<shard_id>.json            shards waiting to be claimed
+    claimed/<shard_id>@<worker>.json   shards being worked on, whose mtime serves as the heartbeat of the worker
+    done/<shard_id>.json               shards downloaded and joined
+    failed/<shard_id>.json             shards failed
+    status/<shard_id>.json             status reports of the workers
+
+A worker claims a shard by atomically renaming it from ``pending/`` into ``claimed/``, so only one of the competing
+workers wins, whether they run on the same host or on different ones over a shared filesystem. When there are no more
+pending shards, idle workers steal the claimed shards whose heartbeats have stopped for a while, e.g. those of crashed
+or hung workers, which the coordinator also moves back into ``pending/``, and then the stragglers, i.e. the shards
+taking much longer than those done, once each. A worker whose claim is gone, i.e. stolen, stops its download at the
+next heartbeat, leaving the rest to the new owner. The workers keep polling until no claims are left, so that the
+shards of the workers dying late still get taken over.
+"""
+import os
+import json
+import time
+import socket
+import statistics
+import threading
+import logging
+
+from .downloader import MANIFEST_VERSION
+
+
+PENDING, CLAIMED, DONE, FAILED, STATUS = 'pending', 'claimed', 'done', 'failed', 'status'
+
+HEARTBEAT_INTERVAL = 10  # seconds
+STEAL_AFTER = 120  # seconds without heartbeats
+STRAGGLER_FACTOR = 3  # times the median duration of the shards done, after which a live shard can be stolen
+
+LOGGER = logging.getLogger('MDL.shard')
+
+
+def _write_json(path, obj):
+    """Write the JSON file atomically, so that it never gets seen half-written"""
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, mode='w', encoding='utf-8') as fd:
+        json.dump(obj, fd, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _list_shards(shard_dir, state):
+    try:
+        return sorted(fn for fn in os.listdir(os.path.join(shard_dir, state)) if fn.endswith('.json'))
+    except FileNotFoundError:
+        return []
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as fd:
+            return json.load(fd)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_stale(path, steal_after):
+    try:
+        return time.time() - os.stat(path).st_mtime >= steal_after
+    except OSError:
+        return False
+
+
+def requeue_stale_shards(shard_dir, steal_after=STEAL_AFTER):
+    """Move the claimed shards whose heartbeats have stopped for `steal_after` seconds back into ``pending/``
+
+    Returns:
+        int: The number of shards requeued.
+    """
+    num = 0
+    for fn in _list_shards(shard_dir, CLAIMED):
+        stale = os.path.join(shard_dir, CLAIMED, fn)
+        if not _is_stale(stale, steal_after):
+            continue
+
+        shard_id, _, owner = fn[:-len('.json')].partition('@')
+        try:
+            os.rename(stale, os.path.join(shard_dir, PENDING, shard_id + '.json'))
+        except OSError:
+            continue  # stolen or finished in the meantime
+
+        LOGGER.warning("Requeued the shard {} of the unresponsive worker {!r}.".format(shard_id, owner))
+        num += 1
+
+    return num
+
+
+def create_shards(downloader, urls, shard_dir, shard_size=1):
+    """Resolve the covers of the `urls` and split their episodes into shards of at most `shard_size` episodes each.
+
+    Returns:
+        int: The number of shards created.
+    """
+    for state in (PENDING, CLAIMED, DONE, FAILED, STATUS):
+        os.makedirs(os.path.join(shard_dir, state), exist_ok=True)
+
+    num_shards = 0
+    for url in urls:
+        cover_info = downloader.extract_config_info(url)
+        if not cover_info:
+            continue
+
+        cover = downloader.plan_cover(cover_info)
+        episodes = cover.pop('episodes')
+        for idx in range(0, len(episodes), shard_size):
+            shard = dict(cover, episodes=episodes[idx:idx + shard_size])
+            shard_id = '{:06}'.format(num_shards)
+            _write_json(os.path.join(shard_dir, PENDING, shard_id + '.json'),
+                        {'version': MANIFEST_VERSION, 'covers': [shard]})
+            num_shards += 1
+
+    LOGGER.info("Created {} shards in '{}'.".format(num_shards, shard_dir))
+    return num_shards
+
+
+def shards_summary(shard_dir):
+    return {state: len(_list_shards(shard_dir, state)) for state in (PENDING, CLAIMED, DONE, FAILED)}
+
+
+def wait_for_shards(shard_dir, interval=HEARTBEAT_INTERVAL, steal_after=STEAL_AFTER):
+    """Report the progress of the workers until all the shards have been either done or failed, requeuing the shards
+    of the unresponsive workers along the way
+    """
+    summary = shards_summary(shard_dir)
+    while summary[PENDING] or summary[CLAIMED]:
+        LOGGER.info('Shards: {pending} pending, {claimed} claimed, {done} done, {failed} failed'.format(**summary))
+        time.sleep(interval)
+        requeue_stale_shards(shard_dir, steal_after)
+        summary = shards_summary(shard_dir)
+
+    LOGGER.info('All shards finished: {done} done, {failed} failed'.format(**summary))
+    return summary
+
+
+class ShardWorker(object):
+    def __init__(self, downloader, shard_dir, worker_id=None, steal_after=STEAL_AFTER):
+        self.downloader = downloader
+        self.shard_dir = shard_dir
+        self.worker_id = worker_id or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.steal_after = steal_after
+
+    def _path(self, state, fn):
+        return os.path.join(self.shard_dir, state, fn)
+
+    def _write_status(self, shard_id, state, started, steals=0, finished=None):
+        _write_json(self._path(STATUS, shard_id + '.json'),
+                    {'shard': shard_id, 'worker': self.worker_id, 'state': state,
+                     'started': started, 'finished': finished, 'steals': steals})
+
+    def _straggle_after(self):
+        """Seconds after which a live shard counts as a straggler, or ``None`` if no shards done to compare with"""
+        durations = []
+        for fn in _list_shards(self.shard_dir, STATUS):
+            status = _read_json(self._path(STATUS, fn))
+            if status and status.get('state') == DONE and status.get('finished'):
+                durations.append(status['finished'] - status['started'])
+
+        if not durations:
+            return None
+        return max(statistics.median(durations) * STRAGGLER_FACTOR, HEARTBEAT_INTERVAL * 3)
+
+    def _steal(self, fn, reason):
+        shard_id, _, owner = fn[:-len('.json')].partition('@')
+        claimed = self._path(CLAIMED, '{}@{}.json'.format(shard_id, self.worker_id))
+        try:
+            os.rename(self._path(CLAIMED, fn), claimed)
+            os.utime(claimed)
+        except OSError:
+            return None
+
+        LOGGER.warning("Stole the shard {} from the {} worker {!r}.".format(shard_id, reason, owner))
+        return claimed
+
+    def _claim(self):
+        """Claim a pending shard, or else steal a stale one, or else a straggler
+
+        Returns:
+            tuple: The shard ID, the path to the claimed shard and the number of times it has been stolen as a
+            straggler, or ``(None, None, 0)`` if nothing to claim.
+        """
+        for fn in _list_shards(self.shard_dir, PENDING):
+            shard_id = fn[:-len('.json')]
+            claimed = self._path(CLAIMED, '{}@{}.json'.format(shard_id, self.worker_id))
+            try:
+                os.rename(self._path(PENDING, fn), claimed)
+            except OSError:
+                continue  # claimed by another worker in the meantime
+
+            return shard_id, claimed, 0
+
+        claims = _list_shards(self.shard_dir, CLAIMED)
+        for fn in claims:
+            if _is_stale(self._path(CLAIMED, fn), self.steal_after):
+                claimed = self._steal(fn, 'unresponsive')
+                if claimed is not None:
+                    status = _read_json(self._path(STATUS, fn.partition('@')[0] + '.json')) or {}
+                    return fn.partition('@')[0], claimed, status.get('steals', 0)
+
+        straggle_after = self._straggle_after()
+        if straggle_after is not None:
+            now = time.time()
+            for fn in claims:
+                shard_id, _, owner = fn[:-len('.json')].partition('@')
+                status = _read_json(self._path(STATUS, shard_id + '.json'))
+                if not status or status.get('worker') != owner or status.get('steals', 0) or \
+                        now - status['started'] < straggle_after:
+                    continue  # not started by the owner yet, stolen once already, or not straggling
+
+                claimed = self._steal(fn, 'straggling')
+                if claimed is not None:
+                    # let the owner notice at its next heartbeat and stop downloading into the same directories
+                    time.sleep(HEARTBEAT_INTERVAL * 2)
+                    return shard_id, claimed, 1
+
+        return None, None, 0
+
+    def _heartbeat(self, shard_id, claimed, stopped, lost):
+        while not stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                os.utime(claimed)
+            except OSError:
+                LOGGER.warning("Worker {} lost the shard {}, download stopped.".format(self.worker_id, shard_id))
+                lost.set()  # stolen
+                return
+
+    def _run_shard(self, shard_id, claimed, steals=0):
+        """Download and join the shard, reporting its status
+
+        Returns:
+            bool: ``False`` if the shard has been taken over by another worker in the meantime, otherwise ``True``.
+        """
+        started = time.time()
+        self._write_status(shard_id, CLAIMED, started, steals)
+
+        stopped, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(shard_id, claimed, stopped, lost), daemon=True)
+        heartbeat.start()
+        try:
+            ok = self.downloader.download_from_manifest(claimed, stop=lost)
+        except Exception as e:
+            LOGGER.error("Shard {} failed: {!r}".format(shard_id, e))
+            ok = False
+        finally:
+            stopped.set()
+            heartbeat.join()
+
+        if lost.is_set():
+            return False
+
+        state = DONE if ok else FAILED
+        try:
+            os.rename(claimed, self._path(state, shard_id + '.json'))
+        except OSError:
+            LOGGER.warning("Shard {} has been taken over by another worker.".format(shard_id))
+            return False
+
+        self._write_status(shard_id, state, started, steals, time.time())
+        return True
+
+    def run(self):
+        """Work on the shards until there is nothing left to claim, nor any claim of the other workers left to take
+        over
+        """
+        num_shards = 0
+        while True:
+            shard_id, claimed, steals = self._claim()
+            if shard_id is None:
+                if not _list_shards(self.shard_dir, CLAIMED):
+                    break
+                time.sleep(HEARTBEAT_INTERVAL)
+                continue
+
+            LOGGER.info("Worker {} claimed the shard {}.".format(self.worker_id, shard_id))
+            if self._run_shard(shard_id, claimed, steals):
+                num_shards += 1
+
+        LOGGER.info("Worker {} finished {} shards.".format(self.worker_id, num_shards))
+        return num_shards
@@ -1,12 +1,111 @@
+import re
+import logging
+import threading
+from importlib import import_module
+from urllib.parse import urlsplit
 
+# the site modules are imported lazily upon the first use of their VideoConfig classes
+_ALL_SITES_VIDEOCONFIG_CLASSES = {'QQVideo': {'module': '.vqq', 'class_name': 'QQVideoVC', 'class': None, 'instance': None, 'nodejs': True},
+                                  'm1905': {'module': '.m1905', 'class_name': 'M1905VC', 'class': None, 'instance': None, 'nodejs': False}
+                                  }
 
-from .vqq import QQVideoVC
-from .m1905 import M1905VC
+# third-party sites get registered as entry points of this group, named after the sites (i.e. `VC_NAME`), e.g.
+#   entry_points={'mdl.sites': ['MySite = mdl_mysite:MySiteVC']}
+ENTRY_POINT_GROUP = 'mdl.sites'
 
-_ALL_SITES_VIDEOCONFIG_CLASSES = {'QQVideo': {'class': QQVideoVC, 'instance': None, 'nodejs': True},
-                                  'm1905': {'class': M1905VC, 'instance': None, 'nodejs': False}
-                                  }
+_plugins_loaded = False
+
+# host -> [(site name, type of the URL pattern counting from 1, compiled URL pattern)], with the patterns whose host is
+# unknown put under `None`
+_routes = None
+_routes_lock = threading.Lock()
+
+LOGGER = logging.getLogger('MDL.sites')
+
+
+def _iter_entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        try:
+            from pkg_resources import iter_entry_points
+        except ImportError:
+            return []
+        return iter_entry_points(group)
+
+    eps = entry_points()
+    return eps.select(group=group) if hasattr(eps, 'select') else eps.get(group, [])
+
+
+def _load_plugins():
+    global _plugins_loaded
+
+    if _plugins_loaded:
+        return
+    _plugins_loaded = True
+
+    for ep in _iter_entry_points(ENTRY_POINT_GROUP):
+        if ep.name in _ALL_SITES_VIDEOCONFIG_CLASSES:
+            LOGGER.warning("Site plugin {!r} conflicts with an existing site, ignored.".format(ep.name))
+            continue
+
+        _ALL_SITES_VIDEOCONFIG_CLASSES[ep.name] = {'module': None, 'class_name': None, 'entry_point': ep,
+                                                   'class': None, 'instance': None, 'nodejs': False}
 
 
 def get_all_sites_vcs():
+    _load_plugins()
     return _ALL_SITES_VIDEOCONFIG_CLASSES
+
+
+def load_site_vc_class(vc):
+    """Import the site module of `vc`, an item of :func:`get_all_sites_vcs`, and return its VideoConfig class"""
+    if vc['class'] is None:
+        if vc.get('entry_point') is not None:
+            vc['class'] = vc['entry_point'].load()
+        else:
+            vc['class'] = getattr(import_module(vc['module'], __name__), vc['class_name'])
+
+    return vc['class']
+
+
+def _build_routes():
+    routes = {}
+    for name, vc in get_all_sites_vcs().items():
+        for typ, pat in enumerate(load_site_vc_class(vc)._VIDEO_URL_PATS, 1):
+            if pat.get('cpat') is None:
+                pat['cpat'] = re.compile(pat['pat'], re.IGNORECASE)
+
+            # the host is derived from the example URL of the pattern
+            host = urlsplit(pat['eg']).hostname if pat.get('eg') else None
+            routes.setdefault(host, []).append((name, typ, pat['cpat']))
+
+    return routes
+
+
+def route(url):
+    """Classify the `url` by looking up the URL patterns of its host only.
+
+    Returns:
+        tuple: The site name, the type of the matching URL pattern counting from 1 (i.e. its position in
+        `_VIDEO_URL_PATS`) and the match object, or ``(None, None, None)`` if no site supports the `url`.
+    """
+    global _routes
+
+    if _routes is None:
+        with _routes_lock:
+            if _routes is None:
+                _routes = _build_routes()
+
+    try:
+        host = urlsplit(url).hostname
+    except ValueError:
+        return None, None, None
+
+    for candidates in (_routes.get(host, ()), _routes.get(None, ())):
+        for name, typ, cpat in candidates:
+            match = cpat.match(url)
+            if match:
+                return name, typ, match
+
+    return None, None, None
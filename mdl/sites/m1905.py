@@ -11,6 +11,8 @@ from math import floor as math_floor
 from ..videoconfig import VideoConfig
 from ..commons import VideoTypes
 from ..utils import json_path_get
+from ..models import MirroredURLs
+from ..hls import parse_playlist
 
 
 class M1905VC(VideoConfig):
@@ -145,80 +147,52 @@ class M1905VC(VideoConfig):
 
         return year, urls
 
-    def get_cover_info(self, url):
+    def get_cover_info(self, url, route=None):
         cover_info = None
         episode_info = None
 
-        for typ, pat in enumerate(self._VIDEO_URL_PATS, 1):
-            match = pat['cpat'].match(url)
-            if match:
-                cover_info = {}
-                if typ == 1:  # 'video_episode_sd'
-                    episode_info = self._get_episode_info_sd(url)
-                    if episode_info:
-                        year, _ = self._get_cover_info(self._VIDEO_COVER_FORMAT.format(episode_info['cover_id']))
-                        episode_info['year'] = year
-
-                        cover_info["normal_ids"] = [dict(V=episode_info['vid'], E=1, vip=False, defns={}, page=url)]
-                elif typ == 2:  # 'video_cover'
-                    year, urls_dict = self._get_cover_info(self._VIDEO_COVER_FORMAT.format(match.group(1)))
-                    if urls_dict:
-                        cover_info["normal_ids"] = []
-                        ep_num = 0
-                        if urls_dict.get('sd'):
-                            episode_info = self._get_episode_info_sd(urls_dict['sd'])
-                            if episode_info:
-                                episode_info['year'] = year
-                                ep_num += 1
-                                cover_info["normal_ids"].append(dict(V=episode_info['vid'], E=ep_num, vip=False, defns={}, page=urls_dict['sd']))
-
-                        if urls_dict.get('hd'):
-                            episode_info = self._get_episode_info_hd(urls_dict['hd'])
-                            if episode_info:
-                                ep_num += 1
-                                cover_info["normal_ids"].append(dict(V=episode_info['vid'], E=ep_num, vip=True, defns={}, page=urls_dict['hd']))
-                else:  # video_episode_hd
-                    episode_info = self._get_episode_info_hd(url)
-                    if episode_info:
-                        cover_info["normal_ids"] = [dict(V=episode_info['vid'], E=1, vip=True, defns={}, page=url)]
-
+        typ, match = route or self.match_url(url)
+        if match:
+            cover_info = {}
+            if typ == 1:  # 'video_episode_sd'
+                episode_info = self._get_episode_info_sd(url)
+                if episode_info:
+                    year, _ = self._get_cover_info(self._VIDEO_COVER_FORMAT.format(episode_info['cover_id']))
+                    episode_info['year'] = year
+
+                    cover_info["normal_ids"] = [dict(V=episode_info['vid'], E=1, vip=False, defns={}, page=url)]
+            elif typ == 2:  # 'video_cover'
+                year, urls_dict = self._get_cover_info(self._VIDEO_COVER_FORMAT.format(match.group(1)))
+                if urls_dict:
+                    cover_info["normal_ids"] = []
+                    ep_num = 0
+                    if urls_dict.get('sd'):
+                        episode_info = self._get_episode_info_sd(urls_dict['sd'])
+                        if episode_info:
+                            episode_info['year'] = year
+                            ep_num += 1
+                            cover_info["normal_ids"].append(dict(V=episode_info['vid'], E=ep_num, vip=False, defns={}, page=urls_dict['sd']))
+
+                    if urls_dict.get('hd'):
+                        episode_info = self._get_episode_info_hd(urls_dict['hd'])
+                        if episode_info:
+                            ep_num += 1
+                            cover_info["normal_ids"].append(dict(V=episode_info['vid'], E=ep_num, vip=True, defns={}, page=urls_dict['hd']))
+            else:  # video_episode_hd
+                episode_info = self._get_episode_info_hd(url)
                 if episode_info:
-                    cover_info["title"] = episode_info["title"]
-                    cover_info["year"] = episode_info["year"]
-                    cover_info["type"] = VideoTypes.MOVIE
-                    cover_info["cover_id"] = episode_info["cover_id"]
-                    cover_info["episode_all"] = len(cover_info["normal_ids"])
-                    cover_info["referrer"] = url
+                    cover_info["normal_ids"] = [dict(V=episode_info['vid'], E=1, vip=True, defns={}, page=url)]
 
-                break
+            if episode_info:
+                cover_info["title"] = episode_info["title"]
+                cover_info["year"] = episode_info["year"]
+                cover_info["type"] = VideoTypes.MOVIE
+                cover_info["cover_id"] = episode_info["cover_id"]
+                cover_info["episode_all"] = len(cover_info["normal_ids"])
+                cover_info["referrer"] = url
 
         return cover_info
 
-    @staticmethod
-    def _pick_highest_bandwidth_m3u8(playlist_variants):
-        bandwidth, m3u = 0, ""
-        streams = playlist_variants.splitlines()
-        i = 0
-        while i < len(streams):
-            stream = streams[i]
-            if stream and stream.startswith("#EXT-X-STREAM-INF:"):
-                # skip the blank and comment lines, if any
-                while not streams[i + 1] or streams[i + 1].startswith("#"):
-                    i += 1
-
-                stream_match = re.search(r"BANDWIDTH\s*=\s*(\d+)", stream)
-                if stream_match:
-                    matched = int(stream_match.group(1))
-                    if matched > bandwidth:
-                        bandwidth = matched
-                        m3u = streams[i + 1]
-
-                i += 2
-            else:
-                i += 1
-
-        return bandwidth, m3u
-
     def _get_ts_playlist(self, m3u8_url):
         url_prefix = m3u8_url.rpartition('/')[0]
         playlist = m3u8_url
@@ -227,16 +201,13 @@ class M1905VC(VideoConfig):
                 r = self._requester.get(playlist)
                 if r.status_code == 200:
                     r.encoding = "utf-8"
-                    for line in r.iter_lines(decode_unicode=True):
-                        if line:
-                            if line.startswith("#EXT-X-STREAM-INF:"):  # in master playlist
-                                _, m3u = self._pick_highest_bandwidth_m3u8(r.text)
-                                playlist = "%s/%s" % (url_prefix, m3u)
-                                break
-                            elif line.startswith("#EXTINF:"):  # in media playlist
-                                mpeg_urls = ["%s/%s" % (url_prefix, ts) for ts in r.text.splitlines() if
-                                             ts and not ts.startswith('#')]
-                                return mpeg_urls
+                    m3u8 = parse_playlist(r.iter_lines(decode_unicode=True))
+                    if m3u8.is_master:
+                        variant = m3u8.best_variant()
+                        playlist = "%s/%s" % (url_prefix, variant.uri)
+                    elif m3u8.segments:
+                        uris, durations = m3u8.resources()
+                        return MirroredURLs([url_prefix + '/'], uris, durations)
         except Exception:
             print("Failed to fetch {!r}".format(m3u8_url))  # logging
 
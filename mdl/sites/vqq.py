@@ -5,9 +5,13 @@ import subprocess
 
 from urllib.parse import urlencode
 
+from requests import RequestException
+
 from ..commons import VideoTypeCodes, VideoTypes, DEFAULT_YEAR
 from ..videoconfig import VideoConfig
 from ..utils import json_path_get, build_cookiejar_from_kvp
+from ..models import MirroredURLs, LazyEpisodeList
+from ..hls import parse_playlist
 
 mdl_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -212,11 +216,9 @@ class QQVideoVC(VideoConfig):
                     if drm == 1 and not preview and not self.has_vip:
                         return format_name, ext, urls
 
+                    urls = MirroredURLs(chosen_url_prefixes)
                     for idx in range(start, fc + 1):
-                        vfilename_new = '.'.join([vfn[0], str(idx), 'ts'])
-                        url_mirrors = '\t'.join(
-                            ['%s%s' % (prefix, vfilename_new) for prefix in chosen_url_prefixes])
-                        urls.append(url_mirrors)
+                        urls.append('.'.join([vfn[0], str(idx), 'ts']))
                 else:  # 'mp4'
                     if drm == 1 and not self.has_vip:
                         return format_name, ext, urls
@@ -234,11 +236,11 @@ class QQVideoVC(VideoConfig):
                         r = self._requester.get(playlist_url, cookies=self.user_token)
                         if r.status_code == 200:
                             r.encoding = 'utf-8'
-                            for line in r.iter_lines(decode_unicode=True):
-                                if line and not line.startswith('#'):
-                                    url_mirrors = '\t'.join(
-                                        ['%s%s/%s' % (prefix, vfilename, line) for prefix in chosen_url_prefixes])
-                                    urls.append(url_mirrors)
+                            m3u8 = parse_playlist(r.iter_lines(decode_unicode=True))
+                            if not m3u8.is_master:
+                                uris, durations = m3u8.resources()
+                                urls = MirroredURLs(['%s%s/' % (prefix, vfilename) for prefix in chosen_url_prefixes],
+                                                    uris, durations)
                     else:
                         # return self._get_video_urls_p10901(vid, definition)
                         return self._get_video_urls_p10201(vid, definition, vurl, referrer)
@@ -291,6 +293,8 @@ class QQVideoVC(VideoConfig):
                     cdn = [prefix for prefix in url_prefixes if prefix not in chosen_url_prefixes]
                     chosen_url_prefixes += cdn
 
+                urls = MirroredURLs(chosen_url_prefixes)
+
                 # drm = json_path_get(data, ['vl', 'vi', 0, 'drm'])
 
                 # pick the best matched definition from available formats
@@ -314,6 +318,9 @@ class QQVideoVC(VideoConfig):
                 fc = json_path_get(data, ['vl', 'vi', 0, 'cl', 'fc'])
                 keyids = [chap.get('keyid') for chap in json_path_get(data, ['vl', 'vi', 0, 'cl', 'ci'], [])] if fc \
                     else [json_path_get(data, ['vl', 'vi', 0, 'cl', 'keyid'])]
+                # file sizes of the parts, for the verification of the downloaded files
+                sizes = [chap.get('cs') for chap in json_path_get(data, ['vl', 'vi', 0, 'cl', 'ci'], [])] if fc \
+                    else [json_path_get(data, ['vl', 'vi', 0, 'fs'])]
                 for keyid in keyids:
                     keyid_new = keyid.split('.')
                     if len(keyid_new) == 3:
@@ -321,6 +328,8 @@ class QQVideoVC(VideoConfig):
                         keyid_new = '.'.join(keyid_new)
                     else:
                         keyid_new = '.'.join(vfn[:-1])
+                    if keyid_new != keyid:
+                        sizes = None  # of another format than that of the file to download
                     cfilename = keyid_new + '.' + ext
                     params = {
                         'otype': 'json',
@@ -343,14 +352,13 @@ class QQVideoVC(VideoConfig):
                             vkey = key_data.get('key', fvkey)
                             if not vkey:
                                 return format_name, ext, urls
-                            url_mirrors = '\t'.join(['%s%s?sdtfrom=v1010&vkey=%s' % (url_prefix, cfilename, vkey)
-                                                    for url_prefix in chosen_url_prefixes])
-                            if url_mirrors:
-                                urls.append(url_mirrors)
+                            if chosen_url_prefixes:
+                                urls.append('%s?sdtfrom=v1010&vkey=%s' % (cfilename, vkey))
 
                 # check if the URLs for the file parts have all been successfully obtained
                 if len(keyids) == len(urls):
                     format_name = ret_defn
+                    urls.set_sizes(sizes)
 
         return format_name, ext, urls
 
@@ -424,6 +432,8 @@ class QQVideoVC(VideoConfig):
                         cdn = [prefix for prefix in url_prefixes if prefix not in chosen_url_prefixes]
                         chosen_url_prefixes += cdn
 
+                    urls = MirroredURLs(chosen_url_prefixes)
+
                     # drm = json_path_get(data, ['vl', 'vi', 0, 'drm'])
 
                     # pick the best matched definition from available formats
@@ -447,6 +457,9 @@ class QQVideoVC(VideoConfig):
                     fc = json_path_get(data, ['vl', 'vi', 0, 'cl', 'fc'])
                     keyids = [chap.get('keyid') for chap in json_path_get(data, ['vl', 'vi', 0, 'cl', 'ci'], [])] if fc \
                         else [json_path_get(data, ['vl', 'vi', 0, 'cl', 'keyid'])]
+                    # file sizes of the parts, for the verification of the downloaded files
+                    sizes = [chap.get('cs') for chap in json_path_get(data, ['vl', 'vi', 0, 'cl', 'ci'], [])] if fc \
+                        else [json_path_get(data, ['vl', 'vi', 0, 'fs'])]
 
                     for keyid in keyids:
                         keyid_new = keyid.split('.')
@@ -457,6 +470,8 @@ class QQVideoVC(VideoConfig):
                             if len(vfn) == 3 and int(keyid_new[1]) != format_id:
                                 vfn[1] = vfn[1][0] + str(format_id)
                             keyid_new = '.'.join(vfn[:-1])
+                        if keyid_new != keyid:
+                            sizes = None  # of another format than that of the file to download
                         cfilename = keyid_new + '.' + ext
 
                         ckey_req = ' '.join([QQVideoPlatforms.P10201, self.APP_VER, vid, vurl, referrer, r'\n'])
@@ -502,20 +517,23 @@ class QQVideoVC(VideoConfig):
                                     return format_name, ext, urls
                                 if not fc:
                                     cfilename = key_data.get('filename', cfilename)
-                                url_mirrors = '\t'.join(['%s%s?sdtfrom=v1010&vkey=%s' % (url_prefix, cfilename, vkey)
-                                                        for url_prefix in chosen_url_prefixes])
-                                if url_mirrors:
-                                    urls.append(url_mirrors)
+                                if chosen_url_prefixes:
+                                    urls.append('%s?sdtfrom=v1010&vkey=%s' % (cfilename, vkey))
 
                     # check if the URLs for the file parts have all been successfully obtained
                     if len(keyids) == len(urls):
                         format_name = ret_defn
+                        urls.set_sizes(sizes)
 
         return format_name, ext, urls
 
     def _get_video_urls(self, vid, definition, vurl, referrer):
         if self.no_logo:
-            return self._get_video_urls_p10801(vid, definition, vurl, referrer)
+            try:
+                return self._get_video_urls_p10801(vid, definition, vurl, referrer)
+            except RequestException as e:  # including CircuitOpenError, i.e. P10801 failing lately
+                self._logger.warning('Falling back on P10201 for {}: {!r}'.format(vid, e))
+                return self._get_video_urls_p10201(vid, definition, vurl, referrer)
         else:
             # return self._get_video_urls_p10901(vid, definition)
             return self._get_video_urls_p10201(vid, definition, vurl, referrer)
@@ -573,12 +591,17 @@ class QQVideoVC(VideoConfig):
                 ep_list = ep_list[0]
 
                 if len(ep_list) >= len(cover_info['normal_ids']):  # ensure the full list of episodes
-                    cover_info['normal_ids'] = [{'V': item['item_params']['vid'],
-                                                 'E': ep,
-                                                 'title': json_path_get(item, ['item_params', 'play_title']) or json_path_get(item, ['item_params', 'title'])
-                                                 # exclude the types of videos that are unlikely to have meaningful episode names
-                                                 if cover_info['type'] not in [VideoTypes.TV, ] else ''}
-                                                for ep, item in enumerate(ep_list, start=1)]
+                    # exclude the types of videos that are unlikely to have meaningful episode names
+                    with_title = cover_info['type'] not in [VideoTypes.TV, ]
+
+                    def make_episode(ep, item):
+                        return {'V': item['item_params']['vid'],
+                                'E': ep,
+                                'title': json_path_get(item, ['item_params', 'play_title']) or json_path_get(item, ['item_params', 'title'])
+                                if with_title else ''}
+
+                    # the episodes are made on demand, i.e. only those selected by the playlist items
+                    cover_info['normal_ids'] = LazyEpisodeList(ep_list, make_episode)
 
     def _get_cover_info(self, cover_url):
         """"{
@@ -619,38 +642,32 @@ class QQVideoVC(VideoConfig):
 
         return info
 
-    def get_cover_info(self, videourl):
+    def get_cover_info(self, videourl, route=None):
         cover_info = None
-        for typ, pat in enumerate(self._VIDEO_URL_PATS, 1):
-            match = pat['cpat'].match(videourl)
-            if match:
-                if typ == 1:  # 'video_cover'
-                    cover_info = self._get_cover_info(videourl)
-                    break
-                elif typ == 2:  # 'video_detail'
-                    cover_id = match.group(2)
-                    cover_url = self._VIDEO_COVER_PREFIX + cover_id + '.html'
-                    cover_info = self._get_cover_info(cover_url)
-                    break
-                elif typ == 3:  # 'video_episode'
-                    cover_id = match.group(1)
-                    video_id = match.group(2)
-                    cover_url = self._VIDEO_COVER_PREFIX + cover_id + '.html'
-                    cover_info = self._get_cover_info(cover_url)
-                    if cover_info:
-                        cover_info['normal_ids'] = [dic for dic in cover_info['normal_ids'] if dic['V'] == video_id]
-                    break
-                else:  # typ == 4 'video_page'
-                    video_id = match.group(1)
-                    cover_info = self._get_cover_info(videourl)
-                    if cover_info:
-                        cover_info['normal_ids'] = \
-                            [dic for dic in cover_info['normal_ids'] if dic['V'] == video_id] if cover_info['normal_ids'] else \
-                            [{"V": video_id, "E": 1}]
-
-                        if not cover_info['cover_id']:
-                            cover_info['cover_id'] = video_id
-                    break
+        typ, match = route or self.match_url(videourl)
+        if typ == 1:  # 'video_cover'
+            cover_info = self._get_cover_info(videourl)
+        elif typ == 2:  # 'video_detail'
+            cover_id = match.group(2)
+            cover_url = self._VIDEO_COVER_PREFIX + cover_id + '.html'
+            cover_info = self._get_cover_info(cover_url)
+        elif typ == 3:  # 'video_episode'
+            cover_id = match.group(1)
+            video_id = match.group(2)
+            cover_url = self._VIDEO_COVER_PREFIX + cover_id + '.html'
+            cover_info = self._get_cover_info(cover_url)
+            if cover_info:
+                cover_info['normal_ids'] = [dic for dic in cover_info['normal_ids'] if dic['V'] == video_id]
+        elif typ == 4:  # 'video_page'
+            video_id = match.group(1)
+            cover_info = self._get_cover_info(videourl)
+            if cover_info:
+                cover_info['normal_ids'] = \
+                    [dic for dic in cover_info['normal_ids'] if dic['V'] == video_id] if cover_info['normal_ids'] else \
+                    [{"V": video_id, "E": 1}]
+
+                if not cover_info['cover_id']:
+                    cover_info['cover_id'] = video_id
 
         return cover_info
 
@@ -698,6 +715,9 @@ class QQVideoVC(VideoConfig):
                 }
             }]
         }
+
+        Note that "urls" is actually a :class:`MirroredURLs` sequence, from which the tab-separated mirror URLs of each
+        segment get materialized on access.
         """
         for vi in cover_info['normal_ids']:
             vi.setdefault('defns', {})
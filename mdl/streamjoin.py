@@ -0,0 +1,147 @@
+"""Joining the segments of the episodes while they are still being downloaded.
+
+The segments of a segmented stream (i.e. MPEG-TS) are fed in order into a long-running ``ffmpeg -c copy`` process for
+each episode, each as soon as it and all the earlier ones have been downloaded, so that the joined video is ready right
+after the last segment arrives. A segment counts as downloaded only once aria2 has reported it complete, through its
+JSON-RPC interface (see :meth:`.progress.Aria2Monitor.is_complete`), as neither the size of a preallocated file nor
+that of a stalled download tells whether it's complete.
+
+An episode whose segments turn out corrupted, or are still incomplete after the downloads have finished, is given up
+by the joiner, to be verified, repaired and joined the regular way.
+"""
+import os
+import queue
+import shutil
+import threading
+import logging
+import subprocess
+
+from .utils import logging_with_pipe
+from .verify import check_segment
+
+
+POLL_INTERVAL = 0.5  # seconds
+
+STREAMABLE_EXTS = ('ts',)
+
+
+def _kill(proc):
+    proc.kill()
+    try:
+        proc.stdin.close()
+    except OSError:
+        pass
+    proc.wait()
+
+
+class StreamJoiner(object):
+    def __init__(self, make_cmd, logger, poll_interval=POLL_INTERVAL):
+        """`make_cmd` is called as ``make_cmd(episode_name, clip)`` to make the ffmpeg command joining the segments fed
+        through its stdin into the video file `episode_name`.
+        """
+        self._make_cmd = make_cmd
+        self._logger = logger
+        self._poll_interval = poll_interval
+
+        self._episodes = queue.Queue()
+        self._downloads_finished = threading.Event()
+        self._aborted = False
+        self._is_complete = None
+        self._joined = {}  # id(episode) -> path to the joined video
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def add(self, episode, cover_dir=None):
+        """Queue the `episode` for joining into the `cover_dir`, default to the parent of its directory, if it's of a
+        segmented stream.
+        """
+        if episode.fnames and episode.fnames[0].rpartition('.')[-1] in STREAMABLE_EXTS:
+            self._episodes.put((episode, cover_dir or os.path.dirname(episode.dir)))
+
+    def finish(self):
+        """Tell the joiner that the downloads have finished, and wait for it to finish joining.
+
+        Returns:
+            dict: ``id(episode)`` mapped to the path to the joined video, for the episodes joined.
+        """
+        self._downloads_finished.set()
+        self._episodes.put((None, None))
+        self._thread.join()
+
+        return self._joined
+
+    def watch(self, is_complete):
+        """Take the segments as downloaded once ``is_complete(path)`` returns ``True``"""
+        self._is_complete = is_complete
+
+    def abort(self):
+        """Give up joining the episodes not joined yet, and wait for the joiner to stop"""
+        self._aborted = True
+        self.finish()
+
+    def _wait_for_segment(self, path):
+        """Wait until the segment has been reported downloaded, or the downloads have finished without it"""
+        while not self._aborted:
+            finished = self._downloads_finished.is_set()
+            if self._is_complete is not None and self._is_complete(path):
+                return True
+            if finished:
+                break
+
+            self._downloads_finished.wait(self._poll_interval)
+
+        return False
+
+    def _join_episode(self, episode, cover_dir):
+        sizes = getattr(episode.urls, 'sizes', None)
+        if sizes is not None and len(sizes) != len(episode.fnames):
+            sizes = None
+
+        episode_name = os.path.join(cover_dir, os.path.basename(episode.dir)) + '.mp4'
+        proc = None
+        try:
+            with logging_with_pipe(self._logger, level=logging.INFO) as log_pipe:
+                for idx, fn in enumerate(episode.fnames):
+                    path = os.path.join(episode.dir, fn)
+                    if not self._wait_for_segment(path):
+                        self._logger.warning("Segment '{}' not downloaded, stream join given up.".format(path))
+                        break
+
+                    reason = check_segment(path, sizes[idx] if sizes is not None else None)
+                    if reason is not None:
+                        self._logger.warning("Corrupted segment '{}' ({}), stream join given up.".format(path, reason))
+                        break
+
+                    if proc is None:
+                        proc = subprocess.Popen(self._make_cmd(episode_name, episode.clip), stdin=subprocess.PIPE,
+                                                stdout=log_pipe, stderr=subprocess.STDOUT)
+                    with open(path, 'rb') as fd:
+                        shutil.copyfileobj(fd, proc.stdin)
+                else:
+                    proc.stdin.close()
+                    if proc.wait() == 0:
+                        return episode_name
+        except OSError as e:
+            self._logger.error("OS error number {}: '{}'".format(e.errno, e.strerror))
+
+        if proc is not None:
+            _kill(proc)
+            try:
+                os.remove(episode_name)
+            except OSError:
+                pass
+
+        return None
+
+    def _run(self):
+        while True:
+            episode, cover_dir = self._episodes.get()
+            if episode is None or self._aborted:
+                return
+
+            episode_name = self._join_episode(episode, cover_dir)
+            if episode_name is not None:
+                self._joined[id(episode)] = episode_name
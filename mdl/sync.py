@@ -0,0 +1,125 @@
+"""Incremental syncing of the covers of ongoing series, i.e. ``mdl sync``.
+
+The state of each cover is persisted in the state file, i.e. the episodes last seen, along with their numbers and
+titles, and those downloaded:
+
+    {URL: {"seen": {vid: [episode number, title]}, "downloaded": [vid], "synced": timestamp}}
+
+Each sync of a cover fetches only its metadata, without resolving any episode, and diffs the episode list against the
+state, so that only the new or changed episodes, and those failed last time, get resolved and downloaded. Multiple
+covers are synced concurrently, over and over at the interval specified if any.
+"""
+import os
+import json
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+LOGGER = logging.getLogger('MDL.sync')
+
+
+def _fingerprint(vi):
+    return [vi.get('E'), vi.get('title')]
+
+
+class SyncState(object):
+    """States of the covers, persisted in a JSON file"""
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        try:
+            with open(state_file, encoding='utf-8') as fd:
+                self._covers = json.load(fd)
+        except FileNotFoundError:
+            self._covers = {}
+
+    def get(self, url):
+        with self._lock:
+            cover = self._covers.get(url) or {}
+            return dict(seen=dict(cover.get('seen') or {}), downloaded=set(cover.get('downloaded') or ()))
+
+    def update(self, url, seen, downloaded):
+        with self._lock:
+            self._covers[url] = {'seen': seen, 'downloaded': sorted(downloaded), 'synced': time.time()}
+            tmp_file = self.state_file + '.tmp'
+            with open(tmp_file, mode='w', encoding='utf-8') as fd:
+                json.dump(self._covers, fd, ensure_ascii=False)
+            os.replace(tmp_file, self.state_file)
+
+
+class Syncer(object):
+    def __init__(self, downloader, state_file, max_covers=4):
+        self._dl = downloader
+        self.state = SyncState(state_file)
+        self.max_covers = max_covers
+
+    def sync_cover(self, url):
+        """Download the new or changed episodes of the cover since the last sync.
+
+        :returns: ``True`` if all of them have been downloaded and joined, otherwise ``False``.
+        """
+        cover_info = self._dl.extract_config_info(url, dwnld_info=False)
+        if not cover_info:
+            return False
+
+        state = self.state.get(url)
+        seen, downloaded = {}, set()
+        pending = []
+        for vi in cover_info['normal_ids']:
+            vid = vi['V']
+            seen[vid] = _fingerprint(vi)
+            if vid in state['downloaded'] and state['seen'].get(vid) == seen[vid]:
+                vi['synced'] = True
+                downloaded.add(vid)
+            else:
+                pending.append(vi)
+
+        if not pending:
+            LOGGER.info('No new episodes: {}'.format(url))
+            self.state.update(url, seen, downloaded)
+            return True
+
+        LOGGER.info('{} new or changed episodes: {}'.format(len(pending), url))
+        self._dl.resolve_episodes(cover_info, pending)
+        joined = []
+        ok = self._dl.download_cover(cover_info, joined)
+
+        joined_vids = {episode.vid for episode in joined}
+        for vi in pending:
+            if vi.get('owned') or vi['V'] in joined_vids:
+                downloaded.add(vi['V'])
+        self.state.update(url, seen, downloaded)
+
+        return ok
+
+    def _sync_cover(self, url):
+        try:
+            return self.sync_cover(url)
+        except Exception as e:
+            LOGGER.error("Failed to sync '{}': {!r}".format(url, e))
+            return False
+
+    def sync(self, urls):
+        """Sync the covers of the `urls` concurrently, once.
+
+        :returns: the number of the covers failed.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_covers) as executor:
+            results = list(executor.map(self._sync_cover, urls))
+
+        return results.count(False)
+
+    def run(self, urls, interval=0):
+        """Sync the covers of the `urls` every `interval` seconds, or only once if no interval"""
+        urls = list(urls)
+        while True:
+            time_start = time.monotonic()
+            failed = self.sync(urls)
+            LOGGER.info('Synced {} covers, {} failed.'.format(len(urls), failed))
+            if not interval:
+                return failed
+
+            time.sleep(max(interval - (time.monotonic() - time_start), 0))
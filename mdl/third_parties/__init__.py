@@ -6,10 +6,6 @@ import logging
 from argparse import ArgumentParser
 import zipfile
 import tarfile
-from distutils.dir_util import copy_tree, remove_tree
-
-from bdownload.download import BDownloader, BDownloaderException
-from bdownload.cli import install_signal_handlers, ignore_termination_signals
 
 
 MOD_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -307,6 +303,9 @@ pkgs_full_path = [os.path.join(base, prog + progs_conf[prog][system][bitness]['e
 
 
 def download(**kwargs):
+    from bdownload.download import BDownloader, BDownloaderException
+    from bdownload.cli import install_signal_handlers, ignore_termination_signals
+
     urls = [progs_conf[prog][system][bitness]['url'] for prog in progs_name]
     pkgs_urls = list(zip(pkgs_full_path, urls))
 
@@ -373,6 +372,8 @@ def extract():
 
 
 def finalize():
+    from distutils.dir_util import copy_tree, remove_tree
+
     tmp_progs_bin_path = [os.path.normpath(os.path.join(base, *progs_conf[prog][system][bitness]['content-path'])) for prog, base in zip(progs_name, progs_base_path)]
     tmp_progs_base_path = [os.path.normpath(os.path.join(base, progs_conf[prog][system][bitness]['content-path'][0])) for prog, base in zip(progs_name, progs_base_path)]
 
@@ -0,0 +1,185 @@
+"""Discovery of the third-party programs along with their versions and capabilities.
+
+Probing the programs takes spawning several processes, so the results are cached in a JSON file, keyed by the path to
+the program together with its modification time and size, and only get re-probed when the program is changed.
+"""
+import os
+import re
+import sys
+import json
+import errno
+import logging
+import subprocess
+from shutil import which
+
+
+CACHE_VERSION = 1
+
+LOGGER = logging.getLogger('MDL.toolchain')
+
+
+def default_cache_file():
+    if sys.platform == 'win32':
+        cache_dir = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+
+    return os.path.join(cache_dir, 'mdl', 'toolchain.json')
+
+
+def _run(cmd):
+    try:
+        cp = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True,
+                            encoding='utf-8', errors='replace', timeout=30)
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+    return cp.stdout
+
+
+def _parse_version(text, regex):
+    mo = re.search(regex, text)
+    return mo.group(1) if mo else ''
+
+
+def _version_tuple(version):
+    return tuple(int(num) for num in re.findall(r'\d+', version)[:3])
+
+
+def _probe_aria2c(path):
+    out = _run([path, '--version'])
+    features = _parse_version(out, r'Enabled Features:\s*(.*)')
+    return {
+        'version': _parse_version(out, r'aria2 version\s+(\S+)'),
+        'caps': {
+            'rpc': 'XML-RPC' in features,
+            'https': 'HTTPS' in features,
+            'async_dns': 'Async DNS' in features
+        }
+    }
+
+
+def _probe_ffmpeg(path):
+    out = _run([path, '-hide_banner', '-version'])
+    demuxers = _run([path, '-hide_banner', '-demuxers'])
+    muxers = _run([path, '-hide_banner', '-muxers'])
+    protocols = _run([path, '-hide_banner', '-protocols'])
+
+    # e.g. "Input:\n  file\n  pipe\nOutput:\n  file\n..."
+    input_protocols = protocols.partition('Input:')[2].partition('Output:')[0].split()
+    return {
+        'version': _parse_version(out, r'ffmpeg version\s+(\S+)'),
+        'caps': {
+            'concat_demuxer': re.search(r'^\s*D\S*\s+concat\s', demuxers, re.MULTILINE) is not None,
+            'mp4_muxer': re.search(r'^\s*\S*E\s+mp4\s', muxers, re.MULTILINE) is not None,
+            'protocols': input_protocols
+        }
+    }
+
+
+def _probe_mkvmerge(path):
+    out = _run([path, '--version'])
+    version = _parse_version(out, r'mkvmerge\s+v(\S+)')
+    return {
+        'version': version,
+        'caps': {
+            # the "[ file1 file2 ]" syntax for appending files
+            'append': bool(version) and _version_tuple(version) >= (7, 7)
+        }
+    }
+
+
+def _probe_node(path):
+    out = _run([path, '--version'])
+    return {
+        'version': _parse_version(out, r'v(\d+\.\d+\.\d+)'),
+        'caps': {}
+    }
+
+
+_PROBERS = {
+    'aria2c': _probe_aria2c,
+    'ffmpeg': _probe_ffmpeg,
+    'mkvmerge': _probe_mkvmerge,
+    'node': _probe_node
+}
+
+
+def _load_cache(cache_file):
+    try:
+        with open(cache_file, encoding='utf-8') as fd:
+            cache = json.load(fd)
+    except (OSError, ValueError):
+        return {}
+
+    return cache.get('progs', {}) if cache.get('version') == CACHE_VERSION else {}
+
+
+def _save_cache(cache_file, progs):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, mode='w', encoding='utf-8') as fd:
+            json.dump({'version': CACHE_VERSION, 'progs': progs}, fd, indent=2)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        LOGGER.debug("Failed to save the toolchain cache '{}': {}".format(cache_file, e))
+
+
+def discover_toolchain(progs, cache_file=None):
+    """Locate the programs and probe for their versions and capabilities, reusing the cached results if the programs
+    are unchanged.
+
+    Args:
+        progs (dict): Program names, i.e. 'aria2c', 'ffmpeg', 'mkvmerge' and 'node', mapped to their paths.
+        cache_file (str): Path to the cache file, default to :func:`default_cache_file`.
+
+    Returns:
+        dict: Program names mapped to the info of the programs, e.g.
+            {'ffmpeg': {'path': '/usr/bin/ffmpeg', 'mtime': 1589963400.0, 'size': 77896680, 'version': '4.2.2',
+                        'caps': {'concat_demuxer': True, 'mp4_muxer': True, 'protocols': ['file', 'pipe', ...]}}}
+
+    Raises:
+        FileNotFoundError: Raised when any of the programs can't be found.
+    """
+    cache_file = cache_file or default_cache_file()
+    cache = _load_cache(cache_file)
+
+    toolchain = {}
+    updated = False
+    for name, prog in progs.items():
+        cached = cache.get(prog)
+        if cached:
+            try:
+                st = os.stat(cached['path'])
+            except OSError:
+                st = None
+
+            if st is not None and cached['mtime'] == st.st_mtime and cached['size'] == st.st_size:
+                toolchain[name] = cached
+                continue
+
+        path, exe = os.path.split(prog)
+
+        # the path given may lack the extension, e.g. '.exe' on Windows
+        exe_path = which(exe, path=path)
+        if exe_path is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), exe)
+        st = os.stat(exe_path)
+
+        info = {'path': exe_path, 'mtime': st.st_mtime, 'size': st.st_size}
+        info.update(_PROBERS[name](exe_path))
+        LOGGER.debug('Probed {} {}: {}'.format(name, info['version'], info['caps']))
+
+        toolchain[name] = cache[prog] = info
+        updated = True
+
+    if updated:
+        _save_cache(cache_file, cache)
+
+    return toolchain
+
+
+def has_cap(toolchain, name, cap):
+    """Whether the program `name` in the `toolchain` has the capability `cap`"""
+    return bool(toolchain.get(name, {}).get('caps', {}).get(cap))
@@ -1,13 +1,17 @@
 from functools import reduce
 import operator
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 import os
+import re
+import sys
+import time
+import queue
+import atexit
+import selectors
 import threading
 from contextlib import contextmanager
 
-import requests
-
 
 ILLEGAL_FILENAME_CHARS = (' ', '#', '%', '&', '{', '}', '\\', '<', '>', '*', '?', '/', '$', '!', '\'', '"', ':', '@', '+', '`', '|', '=')
 
@@ -59,7 +63,9 @@ def build_cookiejar_from_kvp(key_values):
 
     """
     if key_values:
-        cookiejar = requests.cookies.RequestsCookieJar()
+        from requests.cookies import RequestsCookieJar
+
+        cookiejar = RequestsCookieJar()
         kvps = [cookie for cookies in key_values.split(";") for cookie in cookies.split()]
         for kvp in kvps:
             key, value = kvp.split("=")
@@ -68,7 +74,26 @@ def build_cookiejar_from_kvp(key_values):
         return cookiejar
 
 
+class _LazyQueueHandler(QueueHandler):
+    """Queue handler leaving the records to be formatted by the handlers of the listener thread, rather than formatting
+    them eagerly on the logging thread as :class:`QueueHandler` does for pickling them, which is of no use in-process.
+    """
+    def prepare(self, record):
+        return record
+
+
+_LISTENERS = {}  # logger name -> the QueueListener feeding its handlers
+
+
+def _stop_listener(listener):
+    if getattr(listener, '_thread', None) is not None:  # not stopped yet
+        listener.stop()
+
+
 def build_logger(logger_name, log_file_name, logger_level=logging.DEBUG, console_level=logging.INFO, file_level=logging.DEBUG):
+    """Build the logger whose records are handed over through a queue to the console and the file handlers, which run
+    on a listener thread of their own, so that logging never blocks on formatting, writing or rotating the log file.
+    """
     logger = logging.getLogger(logger_name)
     logger.setLevel(logger_level)
 
@@ -78,13 +103,19 @@ def build_logger(logger_name, log_file_name, logger_level=logging.DEBUG, console
     cf = logging.Formatter('%(message)s')
     ch.setFormatter(cf)
 
-    fh = RotatingFileHandler(log_file_name, mode='a', maxBytes=1024*1024*2, backupCount=1)
+    # the log file doesn't get opened until the first record is emitted
+    fh = RotatingFileHandler(log_file_name, mode='a', maxBytes=1024*1024*2, backupCount=1, delay=True)
     fh.setLevel(file_level)
     ff = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - \n%(message)s')
     fh.setFormatter(ff)
 
-    logger.addHandler(ch)
-    logger.addHandler(fh)
+    log_queue = queue.SimpleQueue() if hasattr(queue, 'SimpleQueue') else queue.Queue()
+    listener = QueueListener(log_queue, ch, fh, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)  # flush the records left in the queue
+    _LISTENERS[logger_name] = listener
+
+    logger.addHandler(_LazyQueueHandler(log_queue))
 
     return logger
 
@@ -95,38 +126,208 @@ def change_logging_level(logger_name, logger_level=None, console_level=None, fil
     if logger_level is not None:
         logger.setLevel(logger_level)
 
-    for handler in logger.handlers:
+    listener = _LISTENERS.get(logger_name)
+    for handler in list(logger.handlers) + list(listener.handlers if listener else ()):
         if isinstance(handler, logging.StreamHandler) and console_level is not None:
             handler.setLevel(console_level)
         elif isinstance(handler, logging.FileHandler) and file_level is not None:
             handler.setLevel(file_level)
 
 
+PROGRESS_INTERVAL = 1.0  # seconds between the progress lines logged of each pipe
+
+# progress lines of ffmpeg, aria2c and mkvmerge, respectively, which are rewritten in place with "\r" on a console
+_PROGRESS_RE = re.compile(r'^\s*(?:(?:frame|size)=|\[#[0-9a-f]+ |Progress: \d+%)')
+_NEWLINES_RE = re.compile(rb'\r\n|\r|\n')
+
+READ_SIZE = 64 * 1024
+
+RECORDS_PER_SEC = 20  # records logged of each pipe per second, beyond which the output gets sampled
+SAMPLED_LINES = 5
+
+
+class _LoggedPipe(object):
+    """Read end of a pipe whose lines get logged, those read at a time in one record, with the progress lines
+    rate-limited to the latest one every `PROGRESS_INTERVAL` seconds.
+
+    Verbose output is sampled: beyond `RECORDS_PER_SEC` records per second, only the last `SAMPLED_LINES` lines are
+    held back to be logged next, along with the number of the lines skipped, so that the final lines, e.g. the errors
+    before a child process exits, are never lost.
+    """
+    __slots__ = ('fd', 'logger', 'level', 'encoding', '_tail', '_progress', '_progress_time', '_tokens',
+                 '_refill_time', '_held', '_skipped')
+
+    def __init__(self, fd, logger, level, encoding):
+        self.fd = fd
+        self.logger = logger
+        self.level = level
+        self.encoding = encoding
+        self._tail = b''
+        self._progress = None
+        self._progress_time = 0.0
+        self._tokens = RECORDS_PER_SEC
+        self._refill_time = time.monotonic()
+        self._held = []
+        self._skipped = 0
+
+    def feed(self, data):
+        lines = _NEWLINES_RE.split(self._tail + data)
+        self._tail = lines.pop()
+        self._log(lines)
+
+    def _log(self, lines):
+        if not self.logger.isEnabledFor(self.level):
+            return
+
+        batch = []
+        for line in lines:
+            line = line.decode(self.encoding, errors='replace').rstrip()
+            if not line:
+                continue
+            if _PROGRESS_RE.match(line):
+                self._progress = line
+            else:
+                if self._progress is not None:  # the last progress before the line, kept in order
+                    batch.append(self._progress)
+                    self._progress = None
+                batch.append(line)
+
+        self._held.extend(batch)
+        if len(self._held) > SAMPLED_LINES and not self._has_token():
+            self._skipped += len(self._held) - SAMPLED_LINES
+            del self._held[:-SAMPLED_LINES]
+        self.flush()
+
+    def _has_token(self):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._refill_time) * RECORDS_PER_SEC, RECORDS_PER_SEC)
+        self._refill_time = now
+
+        return self._tokens >= 1
+
+    def flush(self, force=False):
+        """Log the lines held back and then the latest progress line if due, and tell whether any is still held back"""
+        if self._held and (force or self._has_token()):
+            self._tokens -= 1
+            if self._skipped:
+                self._held.insert(0, '[{} lines of output skipped]'.format(self._skipped))
+                self._skipped = 0
+            self.logger.log(self.level, '\n'.join(self._held))
+            self._held = []
+
+        if self._progress is not None and not self._held:  # never ahead of the older lines held back
+            now = time.monotonic()
+            if force or now - self._progress_time >= PROGRESS_INTERVAL:
+                self.logger.log(self.level, self._progress)
+                self._progress, self._progress_time = None, now
+
+        return bool(self._held) or self._progress is not None
+
+    def close(self):
+        self._log([self._tail])
+        self._tail = b''
+        self.flush(force=True)
+        os.close(self.fd)
+
+
+class _PipeReactor(object):
+    """Single thread multiplexing the read ends of all the pipes being logged with `selectors`.
+
+    The pipes are handed over to the reactor thread to be registered, as the selectors aren't thread-safe, and the
+    thread gets started upon the first pipe and exits as soon as all the pipes are closed, so that it never outlives
+    the child processes writing to the pipes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = []
+        self._wakeup_r = self._wakeup_w = None
+
+    def add(self, pipe):
+        os.set_blocking(pipe.fd, False)
+        with self._lock:
+            self._pending.append(pipe)
+            if self._thread is None:
+                self._wakeup_r, self._wakeup_w = os.pipe()
+                os.set_blocking(self._wakeup_r, False)
+                self._thread = threading.Thread(target=self._run, args=(self._wakeup_r, self._wakeup_w),
+                                                name='MDL-log-pipes')
+                self._thread.start()
+            else:
+                os.write(self._wakeup_w, b'\0')
+
+    def _run(self, wakeup_r, wakeup_w):
+        pipes = set()
+        with selectors.DefaultSelector() as selector:
+            selector.register(wakeup_r, selectors.EVENT_READ)
+            while True:
+                with self._lock:
+                    for pipe in self._pending:
+                        selector.register(pipe.fd, selectors.EVENT_READ, pipe)
+                        pipes.add(pipe)
+                    self._pending = []
+
+                    if not pipes:
+                        self._thread = None
+                        break
+
+                held_back = any([pipe.flush() for pipe in pipes])
+                for key, _ in selector.select(1 / RECORDS_PER_SEC if held_back else None):
+                    pipe = key.data
+                    if pipe is None:
+                        try:
+                            os.read(wakeup_r, READ_SIZE)
+                        except BlockingIOError:
+                            pass
+                        continue
+
+                    try:
+                        data = os.read(pipe.fd, READ_SIZE)
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        data = b''
+
+                    if data:
+                        pipe.feed(data)
+                    else:
+                        selector.unregister(pipe.fd)
+                        pipes.discard(pipe)
+                        pipe.close()
+
+        os.close(wakeup_r)
+        os.close(wakeup_w)
+
+
+_REACTOR = _PipeReactor()
+
+
+def _log_pipe_in_thread(pipe):
+    """Fallback of the reactor where pipes can't be selected, i.e. on Windows"""
+    def run():
+        for data in iter(lambda: os.read(pipe.fd, READ_SIZE), b''):
+            pipe.feed(data)
+        pipe.close()
+
+    threading.Thread(target=run).start()
+
+
 @contextmanager
 def logging_with_pipe(logger, level, text=False, encoding='utf-8'):
-    """
-    From:
+    """Log the lines written to the pipe, whose write end is yielded for the child processes to write to, by the
+    reactor thread shared by all the pipes. The lines are always decoded with `encoding`, whether `text` or not.
+
+    Originally from:
      https://codereview.stackexchange.com/questions/6567/redirecting-subprocesses-output-stdout-and-stderr-to-the-logging-module
 
     """
     fd_read, fd_write = os.pipe()
-
-    def run():
-        with os.fdopen(fd_read, mode='rb') as readp:
-            for line in iter(readp.readline, b''):
-                if not line.isspace():
-                    logger.log(level, line.decode(encoding))
-
-    def run_text():
-        with os.fdopen(fd_read, mode='r', encoding=encoding) as readp:
-            for line in iter(readp.readline, ''):
-                if not line.isspace():
-                    logger.log(level, line)
-
-    if text:
-        threading.Thread(target=run_text).start()
+    pipe = _LoggedPipe(fd_read, logger, level, encoding)
+    if sys.platform == 'win32':
+        _log_pipe_in_thread(pipe)
     else:
-        threading.Thread(target=run).start()
+        _REACTOR.add(pipe)
 
     try:
         yield fd_write
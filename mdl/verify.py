@@ -0,0 +1,130 @@
+"""Integrity verification of the downloaded segments before joining them.
+
+A segment is deemed corrupted if it's missing, still being downloaded (i.e. with the aria2 control file left behind),
+of a size other than the expected one, or malformed, e.g. an HTML error page saved in place of the video:
+
+* MPEG-TS: every 188-byte packet must start with the sync byte 0x47, which is checked over the memory-mapped file,
+  vectorized with NumPy if available.
+* MP4: the top-level boxes must tile the whole file, and the ``moov`` box must be among them.
+"""
+import os
+import mmap
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+
+def _check_ts(path, size):
+    if size % TS_PACKET_SIZE:
+        return 'truncated TS packet'
+
+    with open(path, 'rb') as fd, mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if numpy is not None:
+            sync = numpy.frombuffer(mm, dtype=numpy.uint8)[::TS_PACKET_SIZE]
+            intact = bool((sync == TS_SYNC_BYTE).all())
+            del sync  # release the buffer of the mmap before closing it
+        else:
+            sync = mm[::TS_PACKET_SIZE]
+            intact = sync.count(TS_SYNC_BYTE) == len(sync)
+
+    return None if intact else 'TS sync byte lost'
+
+
+def _check_mp4(path, size):
+    has_moov = False
+    with open(path, 'rb') as fd:
+        offset = 0
+        while offset < size:
+            fd.seek(offset)
+            header = fd.read(16)
+            if len(header) < 8:
+                return 'truncated MP4 box header at {}'.format(offset)
+
+            box_size, box_type = struct.unpack('>I4s', header[:8])
+            if box_size == 1:  # 64-bit largesize
+                if len(header) < 16:
+                    return 'truncated MP4 box header at {}'.format(offset)
+                box_size = struct.unpack('>Q', header[8:16])[0]
+            elif box_size == 0:  # extending to the end of the file
+                box_size = size - offset
+
+            if box_size < 8 or not all(0x20 <= c < 0x7f for c in box_type):
+                return 'malformed MP4 box at {}'.format(offset)
+            if offset + box_size > size:
+                return 'truncated MP4 box {!r}'.format(box_type.decode('ascii'))
+
+            has_moov = has_moov or box_type == b'moov'
+            offset += box_size
+
+    return None if has_moov else 'MP4 moov box missing'
+
+
+_CHECKERS = {'ts': _check_ts, 'mp4': _check_mp4}
+
+
+def check_segment(path, expected_size=None):
+    """Verify the downloaded segment file.
+
+    Returns:
+        str: The reason why the segment is corrupted, or ``None`` if it's intact.
+    """
+    if os.path.exists(path + '.aria2'):
+        return 'incomplete download'
+
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return 'missing'
+
+    if not size:
+        return 'empty'
+    if expected_size and size != expected_size:
+        return 'size {} instead of {}'.format(size, expected_size)
+
+    checker = _CHECKERS.get(path.rpartition('.')[-1].lower())
+    try:
+        return checker(path, size) if checker else None
+    except (OSError, ValueError) as e:
+        return repr(e)
+
+
+def find_corrupted_segments(episodes, indices=None, max_workers=MAX_WORKERS):
+    """Verify the segments of the `episodes` in a thread pool.
+
+    Args:
+        episodes (list of :class:`Episode`): The episodes whose segments are to be verified.
+        indices (list of list of int): For each episode, the indices of the segments to verify, default to all.
+
+    Returns:
+        list: Tuples of the episode and the list of the ``(index, reason)`` of its corrupted segments, for the
+        episodes with any corrupted segment.
+    """
+    tasks = []
+    for i, episode in enumerate(episodes):
+        sizes = getattr(episode.urls, 'sizes', None)
+        if sizes is not None and len(sizes) != len(episode.fnames):
+            sizes = None
+
+        for idx in (indices[i] if indices is not None else range(len(episode.fnames))):
+            tasks.append((i, idx, os.path.join(episode.dir, episode.fnames[idx]),
+                          sizes[idx] if sizes is not None else None))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        reasons = list(executor.map(lambda task: check_segment(task[2], task[3]), tasks))
+
+    corrupted = {}
+    for (i, idx, _, _), reason in zip(tasks, reasons):
+        if reason is not None:
+            corrupted.setdefault(i, []).append((idx, reason))
+
+    return [(episodes[i], corrupted[i]) for i in sorted(corrupted)]
@@ -27,17 +27,30 @@ class VideoConfig(object):
             self._requester.headers.update({'User-Agent': user_agent})
 
     @classmethod
-    def is_url_valid(cls, url):
-        for pat in cls._VIDEO_URL_PATS:
+    def match_url(cls, url):
+        """Match the `url` against `_VIDEO_URL_PATS`.
+
+        Returns:
+            tuple: The type of the first matching URL pattern counting from 1 and the match object, or
+            ``(None, None)`` if none matches.
+        """
+        for typ, pat in enumerate(cls._VIDEO_URL_PATS, 1):
             if pat.get('cpat') is None:
                 pat['cpat'] = re.compile(pat['pat'], re.IGNORECASE)
             match = pat['cpat'].match(url)
             if match:
-                return True
+                return typ, match
 
-        return False
+        return None, None
 
-    def get_cover_info(self, url):
+    @classmethod
+    def is_url_valid(cls, url):
+        return cls.match_url(url)[1] is not None
+
+    def get_cover_info(self, url, route=None):
+        """`route` is the type of the URL pattern and the match object, as returned by :meth:`match_url`, if the `url`
+        has been matched already.
+        """
         pass
 
     def update_video_dwnld_info(self, cover_info):
@@ -57,24 +70,29 @@ class VideoConfig(object):
 
     @staticmethod
     def _slice_by_rangeset(lst, rangeset):
-        slic = []
+        """Select the items of `lst` by the 1-based `rangeset` in order, each item at most once, accessing only the
+        selected ones.
+        """
+        num = len(lst)
+        picked = set()
+        indices = []
         for rng in rangeset:
             if isinstance(rng, tuple):
-                sl = lst[rng[0]-1:rng[1]]
-                for d in sl:
-                    if d not in slic:
-                        slic.append(d)
+                idxs = range(max(rng[0], 1) - 1, num if rng[1] is None else min(rng[1], num))
             else:
-                sl = lst[rng-1:rng]
-                if sl and (sl[0] not in slic):
-                    slic += sl
-
-        return slic
-
-    def filter_video_episodes(self, url, cover_info):
-        if cover_info['normal_ids'] and self.confs['playlist_items'][url]:
+                idxs = range(rng - 1, rng) if 1 <= rng <= num else ()
+            for idx in idxs:
+                if idx not in picked:
+                    picked.add(idx)
+                    indices.append(idx)
+
+        return [lst[idx] for idx in indices]
+
+    def filter_video_episodes(self, url, cover_info, playlist_items=None):
+        if playlist_items is None:
+            playlist_items = self.confs['playlist_items'].get(url)
+        if cover_info['normal_ids'] and playlist_items:
             normal_ids = cover_info['normal_ids']
-            playlist_items = self.confs['playlist_items'][url]
 
             if len(normal_ids) == 1:
                 if not self._in_rangeset(normal_ids[0]['E'], playlist_items):
@@ -84,13 +102,14 @@ class VideoConfig(object):
 
         return cover_info
 
-    def get_video_config_info(self, url):
-        cover_info = self.get_cover_info(url)
+    def get_video_config_info(self, url, dwnld_info=True, route=None, playlist_items=None):
+        cover_info = self.get_cover_info(url, route=route)
         if cover_info:
             cover_info['url'] = url  # original request URL
 
-            cover_info = self.filter_video_episodes(url, cover_info)
-            self.update_video_dwnld_info(cover_info)
+            cover_info = self.filter_video_episodes(url, cover_info, playlist_items)
+            if dwnld_info:
+                self.update_video_dwnld_info(cover_info)
 
         return cover_info
 
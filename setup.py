@@ -35,6 +35,9 @@ setup(
     packages=find_packages(where='.'),
     python_requires='>=3.6',
     install_requires=['bdownload'],
+    extras_require={
+        'numpy': ['numpy']  # faster verification of the downloaded MPEG-TS segments
+    },
     include_package_data=True,
     package_data={
         'mdl': [